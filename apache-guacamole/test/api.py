@@ -1,12 +1,14 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from kubernetes import client, config
+from kubernetes.client.rest import ApiException
 import os
 import time
 import base64
 import hmac
 import hashlib
 import json
+import secrets
 import requests
 
 app = FastAPI()
@@ -22,6 +24,12 @@ GUI_IMAGE = os.getenv("GUI_IMAGE")
 GUAC_SECRET_HEX = os.getenv("GUAC_SECRET_HEX")
 GUAC_HOST = os.getenv("GUAC_HOST")   # http://guacamole.guac.svc.cluster.local:8080
 
+# Warm pool of GUI pods: one StatefulSet + headless Service, leased by label
+POOL_NAME = os.getenv("POOL_NAME", "gui-pool")
+POOL_SIZE = int(os.getenv("POOL_SIZE", "3"))
+LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", "3600"))
+LEASE_LABEL = "guac-lease"
+
 apps = client.AppsV1Api()
 core = client.CoreV1Api()
 
@@ -30,6 +38,16 @@ class CreateRequest(BaseModel):
     name: str
 
 
+class LeaseRequest(BaseModel):
+    name: str
+
+
+class ReleaseRequest(BaseModel):
+    name: str
+    # Returned by /lease; only its holder can hand the pod back
+    lease_token: str
+
+
 def sign_token(payload: dict, secret_hex: str):
     header = {"alg": "HS256", "typ": "JWT"}
     key = bytes.fromhex(secret_hex)
@@ -42,6 +60,122 @@ def sign_token(payload: dict, secret_hex: str):
     return (signing_input + b"." + sig_b64).decode()
 
 
+def connection_url(name: str, hostname: str, expires: int):
+    payload = {
+        "username": name,
+        "expires": expires,
+        "connections": {
+            f"conn-{name}": {
+                "protocol": "vnc",
+                "parameters": {
+                    "hostname": hostname,
+                    "port": "5900",
+                }
+            }
+        }
+    }
+    token = sign_token(payload, GUAC_SECRET_HEX)
+    return f"{GUAC_HOST}/guacamole/#/?token={token}"
+
+
+def ensure_pool():
+    """Create the pool's headless Service and StatefulSet, or bring an existing one up to date."""
+    labels = {"app": POOL_NAME}
+
+    service = client.V1Service(
+        metadata=client.V1ObjectMeta(name=POOL_NAME, labels=labels),
+        spec=client.V1ServiceSpec(
+            cluster_ip="None",
+            selector=labels,
+            ports=[client.V1ServicePort(name="vnc", port=5900, target_port=5900)],
+        ),
+    )
+    try:
+        core.create_namespaced_service(namespace=NAMESPACE, body=service)
+    except ApiException as e:
+        if e.status != 409:
+            raise
+
+    container = client.V1Container(
+        name="gui",
+        image=GUI_IMAGE,
+        ports=[client.V1ContainerPort(container_port=5900)],
+        readiness_probe=client.V1Probe(
+            tcp_socket=client.V1TCPSocketAction(port=5900),
+            period_seconds=2,
+        ),
+    )
+    template = client.V1PodTemplateSpec(
+        # Every (re)created pod starts out free; releasing a lease deletes the pod
+        metadata=client.V1ObjectMeta(labels={**labels, LEASE_LABEL: "free"}),
+        spec=client.V1PodSpec(containers=[container]),
+    )
+    spec = client.V1StatefulSetSpec(
+        replicas=POOL_SIZE,
+        service_name=POOL_NAME,
+        pod_management_policy="Parallel",
+        selector={"matchLabels": labels},
+        template=template,
+        # A rolling update would restart leased pods under their users; pods pick up a
+        # new template when they are recycled instead
+        update_strategy=client.V1StatefulSetUpdateStrategy(type="OnDelete"),
+    )
+    sts = client.V1StatefulSet(metadata=client.V1ObjectMeta(name=POOL_NAME), spec=spec)
+    try:
+        apps.create_namespaced_stateful_set(namespace=NAMESPACE, body=sts)
+    except ApiException as e:
+        if e.status != 409:
+            raise
+        apps.patch_namespaced_stateful_set(name=POOL_NAME, namespace=NAMESPACE, body=sts)
+        recycle_outdated()
+
+
+def recycle_outdated():
+    """Reset free pods still running an older template; leased ones are recycled on release"""
+    revision = apps.read_namespaced_stateful_set(name=POOL_NAME, namespace=NAMESPACE).status.update_revision
+    pods = core.list_namespaced_pod(
+        namespace=NAMESPACE, label_selector=f"app={POOL_NAME},{LEASE_LABEL}=free"
+    )
+    for pod in pods.items:
+        if revision and (pod.metadata.labels or {}).get("controller-revision-hash") != revision:
+            reset_pod(pod.metadata.name)
+
+
+def pod_ready(pod):
+    if pod.metadata.deletion_timestamp or pod.status.phase != "Running":
+        return False
+    return any(c.type == "Ready" and c.status == "True" for c in (pod.status.conditions or []))
+
+
+def reset_pod(pod_name: str, resource_version: str = None):
+    # The StatefulSet recreates the pod from its template: clean display, lease label "free"
+    body = None
+    if resource_version:
+        # Only the pod as it was read: a lease that changed hands since is left alone
+        body = client.V1DeleteOptions(preconditions=client.V1Preconditions(resource_version=resource_version))
+    core.delete_namespaced_pod(name=pod_name, namespace=NAMESPACE, grace_period_seconds=0, body=body)
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def reclaim_expired():
+    pods = core.list_namespaced_pod(
+        namespace=NAMESPACE, label_selector=f"app={POOL_NAME},{LEASE_LABEL}=leased"
+    )
+    now = int(time.time())
+    for pod in pods.items:
+        expires = int((pod.metadata.annotations or {}).get(f"{LEASE_LABEL}/expires", "0"))
+        if expires and expires < now and not pod.metadata.deletion_timestamp:
+            reset_pod(pod.metadata.name)
+
+
+@app.on_event("startup")
+def startup():
+    ensure_pool()
+
+
 @app.post("/create")
 def create_pod(req: CreateRequest):
     name = req.name.lower()
@@ -77,22 +211,7 @@ def create_pod(req: CreateRequest):
     time.sleep(3)
 
     # 4. Build connection token
-    payload = {
-        "username": name,
-        "expires": int(time.time()) + 3600,
-        "connections": {
-            f"conn-{name}": {
-                "protocol": "vnc",
-                "parameters": {
-                    "hostname": svc_name,
-                    "port": "5900",
-                }
-            }
-        }
-    }
-    token = sign_token(payload, GUAC_SECRET_HEX)
-
-    full_url = f"{GUAC_HOST}/guacamole/#/?token={token}"
+    full_url = connection_url(name, svc_name, int(time.time()) + 3600)
 
     return {
         "message": "Pod + Service created",
@@ -101,3 +220,88 @@ def create_pod(req: CreateRequest):
         "statefulset": ss_name
     }
 
+
+
+@app.post("/lease")
+def lease_pod(req: LeaseRequest):
+    name = req.name.lower()
+    reclaim_expired()
+
+    pods = core.list_namespaced_pod(
+        namespace=NAMESPACE, label_selector=f"app={POOL_NAME},{LEASE_LABEL}=free"
+    )
+    expires = int(time.time()) + LEASE_SECONDS
+    token = secrets.token_urlsafe(24)
+    for pod in pods.items:
+        if not pod_ready(pod):
+            continue
+        # resourceVersion makes the patch conditional, so two API replicas never lease the same pod
+        patch = {
+            "metadata": {
+                "resourceVersion": pod.metadata.resource_version,
+                "labels": {LEASE_LABEL: "leased"},
+                "annotations": {
+                    f"{LEASE_LABEL}/user": name,
+                    f"{LEASE_LABEL}/expires": str(expires),
+                    # Only the digest is stored; the token itself goes to the caller
+                    f"{LEASE_LABEL}/token": token_digest(token),
+                },
+            }
+        }
+        try:
+            core.patch_namespaced_pod(name=pod.metadata.name, namespace=NAMESPACE, body=patch)
+        except ApiException as e:
+            if e.status == 409:
+                continue
+            raise
+
+        pod_name = pod.metadata.name
+        hostname = f"{pod_name}.{POOL_NAME}.{NAMESPACE}.svc.cluster.local"
+        return {
+            "message": "Pod leased from pool",
+            "guacamole_url": connection_url(name, hostname, expires),
+            "pod": pod_name,
+            "expires": expires,
+            "lease_token": token,
+        }
+
+    raise HTTPException(status_code=503, detail="No ready pods in pool, retry shortly")
+
+
+@app.post("/release/{pod_name}")
+def release_pod(pod_name: str, req: ReleaseRequest):
+    try:
+        pod = core.read_namespaced_pod(name=pod_name, namespace=NAMESPACE)
+    except ApiException as e:
+        raise HTTPException(status_code=404, detail=f"Pod not found: {e.reason}")
+
+    labels = pod.metadata.labels or {}
+    if labels.get("app") != POOL_NAME or labels.get(LEASE_LABEL) != "leased":
+        raise HTTPException(status_code=409, detail=f"Pod {pod_name} is not leased from the pool")
+    annotations = pod.metadata.annotations or {}
+    holder = annotations.get(f"{LEASE_LABEL}/user")
+    digest = annotations.get(f"{LEASE_LABEL}/token", "")
+    if holder != req.name.lower() or not hmac.compare_digest(digest, token_digest(req.lease_token)):
+        raise HTTPException(status_code=403, detail=f"Pod {pod_name} is not leased to {req.name}")
+
+    try:
+        reset_pod(pod_name, pod.metadata.resource_version)
+    except ApiException as e:
+        if e.status == 409:
+            raise HTTPException(status_code=409, detail=f"Lease on {pod_name} changed; not released")
+        raise
+    return {"message": f"Pod {pod_name} returned to pool"}
+
+
+@app.get("/pool")
+def pool_status():
+    pods = core.list_namespaced_pod(namespace=NAMESPACE, label_selector=f"app={POOL_NAME}")
+    counts = {"ready": 0, "leased": 0, "starting": 0}
+    for pod in pods.items:
+        if (pod.metadata.labels or {}).get(LEASE_LABEL) == "leased":
+            counts["leased"] += 1
+        elif pod_ready(pod):
+            counts["ready"] += 1
+        else:
+            counts["starting"] += 1
+    return {"size": POOL_SIZE, **counts}
@@ -0,0 +1,146 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "4"))
+QUEUE_SLO_SECONDS = float(os.environ.get("ADMISSION_QUEUE_SLO_SECONDS", "60"))
+# Starting estimate for one create, replaced by an EWMA of observed durations
+INITIAL_CREATE_SECONDS = float(os.environ.get("ADMISSION_INITIAL_CREATE_SECONDS", "1.0"))
+CREATE_EWMA_ALPHA = 0.2
+
+queue_depth = Gauge("chromium_admission_queue_depth", "Create requests waiting for a slot")
+in_flight_creates = Gauge("chromium_admission_in_flight", "Create requests holding a slot")
+# Unlabelled: tenants are user-supplied owners, far too many for label values
+rejections = Counter("chromium_admission_rejections_total", "Create requests rejected at admission")
+queue_wait = Histogram("chromium_admission_wait_seconds", "Time spent queued before admission")
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, position: int, eta_seconds: float):
+        self.position = position
+        self.eta_seconds = eta_seconds
+        super().__init__(f"Admission queue past SLO: position {position}, ETA {eta_seconds:.0f}s")
+
+
+class Ticket:
+    def __init__(self, tenant: str):
+        self.tenant = tenant
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+        self.position = 0
+        self.eta_seconds = 0.0
+        self.wait_seconds = 0.0
+
+
+class AdmissionQueue:
+    """Caps in-flight creates and hands out free slots round-robin across tenants.
+
+    One tenant submitting a burst of 200 sessions only gets every Nth slot while
+    other tenants are waiting, instead of starving them.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, slo_seconds=QUEUE_SLO_SECONDS):
+        self.max_in_flight = max_in_flight
+        self.slo_seconds = slo_seconds
+        self.in_flight = 0
+        self.queues = OrderedDict()
+        self.create_seconds = INITIAL_CREATE_SECONDS
+
+    def _dispatch_order(self):
+        """Waiting tickets in the order round-robin will admit them."""
+        order = []
+        pending = [list(q) for q in self.queues.values()]
+        depth = 0
+        while True:
+            row = [q[depth] for q in pending if depth < len(q)]
+            if not row:
+                return order
+            order.extend(row)
+            depth += 1
+
+    def _eta(self, position: int) -> float:
+        waves = math.floor(position / self.max_in_flight) + 1
+        return waves * self.create_seconds
+
+    def estimate(self, tenant: str):
+        """Position and ETA a new request from tenant would get right now."""
+        own = len(self.queues.get(tenant, ()))
+        position = sum(min(len(q), own + 1) for t, q in self.queues.items() if t != tenant) + own
+        if self.in_flight < self.max_in_flight and position == 0:
+            return 0, 0.0
+        return position, self._eta(position)
+
+    def snapshot(self):
+        order = self._dispatch_order()
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": len(order),
+            "queued_by_tenant": {t: len(q) for t, q in self.queues.items()},
+            "avg_create_seconds": round(self.create_seconds, 3),
+            "slo_seconds": self.slo_seconds,
+            "eta_seconds_for_new_request": round(self._eta(len(order)), 1) if order else 0.0
+        }
+
+    def _dispatch(self):
+        while self.in_flight < self.max_in_flight and self.queues:
+            tenant, queue = next(iter(self.queues.items()))
+            ticket = queue.popleft()
+            # Rotate the tenant to the back so the next slot goes to someone else
+            del self.queues[tenant]
+            if queue:
+                self.queues[tenant] = queue
+            if ticket.future.cancelled():
+                continue
+            self.in_flight += 1
+            ticket.future.set_result(None)
+        queue_depth.set(sum(len(q) for q in self.queues.values()))
+        in_flight_creates.set(self.in_flight)
+
+    def _remove(self, ticket: Ticket):
+        queue = self.queues.get(ticket.tenant)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self.queues[ticket.tenant]
+        queue_depth.set(sum(len(q) for q in self.queues.values()))
+
+    @asynccontextmanager
+    async def admit(self, tenant: str):
+        """Wait for a create slot, or raise AdmissionRejected if the wait would break the SLO."""
+        position, eta = self.estimate(tenant)
+        if eta > self.slo_seconds:
+            rejections.inc()
+            print(f"Admission: rejected create for {tenant} at position {position}, eta {eta:.1f}s")
+            raise AdmissionRejected(position, eta)
+
+        ticket = Ticket(tenant)
+        ticket.position, ticket.eta_seconds = position, eta
+        self.queues.setdefault(tenant, deque()).append(ticket)
+        self._dispatch()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Slot was granted just as the client went away; give it back
+                self.in_flight -= 1
+                self._dispatch()
+            else:
+                self._remove(ticket)
+            raise
+        ticket.wait_seconds = time.monotonic() - ticket.enqueued_at
+        queue_wait.observe(ticket.wait_seconds)
+
+        started = time.monotonic()
+        try:
+            yield ticket
+        finally:
+            elapsed = time.monotonic() - started
+            self.create_seconds += CREATE_EWMA_ALPHA * (elapsed - self.create_seconds)
+            self.in_flight -= 1
+            self._dispatch()
@@ -0,0 +1,163 @@
+import asyncio
+import math
+import os
+import time
+from collections import defaultdict
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+from prometheus_client import Counter, Gauge
+
+# Arrivals are counted in fixed buckets; forecasts look HORIZON buckets ahead
+BUCKET_SECONDS = int(os.environ.get("CAPACITY_BUCKET_SECONDS", "60"))
+HORIZON_BUCKETS = int(os.environ.get("CAPACITY_HORIZON_BUCKETS", "5"))
+EWMA_ALPHA = float(os.environ.get("CAPACITY_EWMA_ALPHA", "0.3"))
+SEASONAL_ALPHA = float(os.environ.get("CAPACITY_SEASONAL_ALPHA", "0.5"))
+
+# Headroom is a Deployment of low-priority placeholder pods sized like a session.
+# Real sessions preempt them, so the nodes they hold are already up when a burst lands.
+HEADROOM_NAMESPACE = os.environ.get("HEADROOM_NAMESPACE", "default")
+HEADROOM_DEPLOYMENT = os.environ.get("HEADROOM_DEPLOYMENT", "chromium-headroom")
+HEADROOM_MIN = int(os.environ.get("HEADROOM_MIN", "0"))
+HEADROOM_MAX = int(os.environ.get("HEADROOM_MAX", "20"))
+CONTROL_INTERVAL = int(os.environ.get("CAPACITY_INTERVAL_SECONDS", "15"))
+
+SECONDS_PER_DAY = 24 * 3600
+
+arrivals_total = Counter(
+    "chromium_session_arrivals_total", "Session pods created, seen through the pod watch", ["version"]
+)
+forecast_sessions = Gauge(
+    "chromium_capacity_forecast_sessions",
+    "Forecast session arrivals over the control horizon", ["version"]
+)
+forecast_error = Gauge(
+    "chromium_capacity_forecast_abs_error",
+    "Absolute error of the one-bucket-ahead forecast for the last closed bucket", ["version"]
+)
+headroom_replicas = Gauge(
+    "chromium_capacity_headroom_replicas", "Headroom replicas chosen by the controller"
+)
+scale_decisions = Counter(
+    "chromium_capacity_scale_decisions_total", "Headroom scale changes", ["direction"]
+)
+
+
+class ArrivalForecaster:
+    """Per-version arrival counts with an EWMA level and a time-of-day seasonal term.
+
+    The EWMA follows the recent rate; the seasonal table remembers what happened in
+    the same bucket on previous days, so scheduled CI bursts are anticipated instead
+    of chased.
+    """
+
+    def __init__(self, bucket_seconds=BUCKET_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.slots_per_day = max(1, SECONDS_PER_DAY // bucket_seconds)
+        self.bucket = int(time.time() // bucket_seconds)
+        self.current = defaultdict(int)
+        self.level = defaultdict(float)
+        self.seasonal = defaultdict(dict)
+        self.predicted = {}
+
+    def record(self, version, now=None):
+        self.roll(now)
+        self.current[version] += 1
+        arrivals_total.labels(version=version).inc()
+
+    def roll(self, now=None):
+        """Close every bucket that has elapsed and update the models."""
+        bucket = int((now or time.time()) // self.bucket_seconds)
+        while self.bucket < bucket:
+            self._close_bucket()
+            self.bucket += 1
+
+    def _close_bucket(self):
+        slot = self.bucket % self.slots_per_day
+        for version in set(self.level) | set(self.current):
+            observed = self.current.get(version, 0)
+            if version in self.predicted:
+                forecast_error.labels(version=version).set(abs(observed - self.predicted[version]))
+            self.level[version] += EWMA_ALPHA * (observed - self.level[version])
+            table = self.seasonal[version]
+            table[slot] = table.get(slot, observed) + SEASONAL_ALPHA * (observed - table.get(slot, observed))
+            self.predicted[version] = self._bucket_forecast(version, self.bucket + 1)
+        self.current.clear()
+
+    def _bucket_forecast(self, version, bucket):
+        seasonal = self.seasonal[version].get(bucket % self.slots_per_day, 0.0)
+        return max(self.level[version], seasonal)
+
+    def forecast(self, version, horizon=HORIZON_BUCKETS):
+        return sum(
+            self._bucket_forecast(version, self.bucket + i) for i in range(1, horizon + 1)
+        )
+
+    def versions(self):
+        return set(self.level) | set(self.current)
+
+
+class CapacityController:
+    """Scales the headroom Deployment to cover forecast demand."""
+
+    def __init__(self, apps_api=None, forecaster=None, is_leader=lambda: True):
+        self.apps = apps_api or client.AppsV1Api()
+        self.forecaster = forecaster or ArrivalForecaster()
+        # Every replica forecasts; only the leader scales
+        self.is_leader = is_leader
+        self.replicas = None
+
+    def record(self, version):
+        self.forecaster.record(version)
+
+    def desired_replicas(self):
+        total = 0.0
+        for version in self.forecaster.versions():
+            demand = self.forecaster.forecast(version)
+            forecast_sessions.labels(version=version).set(demand)
+            total += demand
+        return min(HEADROOM_MAX, max(HEADROOM_MIN, math.ceil(total)))
+
+    def decide(self):
+        self.forecaster.roll()
+        desired = self.desired_replicas()
+        headroom_replicas.set(desired)
+        return desired
+
+    def apply(self, desired):
+        if desired == self.replicas:
+            return
+        try:
+            self.apps.patch_namespaced_deployment_scale(
+                name=HEADROOM_DEPLOYMENT,
+                namespace=HEADROOM_NAMESPACE,
+                body={"spec": {"replicas": desired}}
+            )
+        except ApiException as e:
+            print(f"Capacity: failed to scale {HEADROOM_DEPLOYMENT}: {e.reason}")
+            return
+        if self.replicas is not None:
+            scale_decisions.labels(direction="up" if desired > self.replicas else "down").inc()
+        self.replicas = desired
+
+    def status(self):
+        return {
+            "headroom_replicas": self.replicas,
+            "forecast": {v: round(self.forecaster.forecast(v), 2) for v in sorted(self.forecaster.versions())},
+            "bucket_seconds": self.forecaster.bucket_seconds,
+            "horizon_buckets": HORIZON_BUCKETS
+        }
+
+    async def run(self):
+        while True:
+            try:
+                # Model updates stay on the event loop with record(); only the API call leaves it
+                desired = self.decide()
+                if self.is_leader():
+                    await asyncio.to_thread(self.apply, desired)
+                else:
+                    # Re-apply after a failover even if the new leader computed the same number
+                    self.replicas = None
+            except Exception as e:
+                print(f"Capacity: control loop error: {e}")
+            await asyncio.sleep(CONTROL_INTERVAL)
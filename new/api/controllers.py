@@ -0,0 +1,283 @@
+"""Coordination of background work across API replicas.
+
+- Coordinator: one Lease elects the leader for cluster-wide singletons (headroom
+  scaling, image pinning); one Lease per replica advertises membership, and a
+  consistent-hash ring over the live members splits per-session work between them.
+- WorkQueue: deduplicating asyncio queue with a token-bucket rate limit and
+  per-key exponential backoff, so a failing item is retried without hot-looping.
+"""
+import asyncio
+import bisect
+import hashlib
+import os
+import random
+import socket
+import time
+from datetime import datetime, timezone
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+from prometheus_client import Counter, Gauge
+
+LEASE_NAMESPACE = os.environ.get("LEASE_NAMESPACE", "default")
+LEADER_LEASE = os.environ.get("LEADER_LEASE", "chromium-api-leader")
+LEASE_DURATION_SECONDS = int(os.environ.get("LEASE_DURATION_SECONDS", "15"))
+RENEW_SECONDS = float(os.environ.get("LEASE_RENEW_SECONDS", "5"))
+# Downward API pod name; unique per replica and stable for its lifetime
+IDENTITY = os.environ.get("POD_NAME") or socket.gethostname()
+MEMBER_LABEL = "chromium-api-member"
+RING_REPLICAS = 64
+
+is_leader_gauge = Gauge("chromium_controller_leader", "1 while this replica holds the leader Lease")
+members_gauge = Gauge("chromium_controller_members", "Live API replicas sharing per-session work")
+queue_depth = Gauge("chromium_workqueue_depth", "Items waiting in a work queue", ["queue"])
+queue_results = Counter("chromium_workqueue_items_total", "Work queue items processed", ["queue", "result"])
+
+
+def lease_time(when: float) -> str:
+    # MicroTime: RFC 3339 with microseconds
+    return datetime.fromtimestamp(when, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def lease_expired(lease, now: float) -> bool:
+    spec = lease.spec
+    if not spec.holder_identity or not spec.renew_time:
+        return True
+    return spec.renew_time.timestamp() + (spec.lease_duration_seconds or LEASE_DURATION_SECONDS) < now
+
+
+class HashRing:
+    def __init__(self, members):
+        self.points = sorted(
+            (self._hash(f"{member}#{i}"), member) for member in members for i in range(RING_REPLICAS)
+        )
+        self.keys = [point for point, _ in self.points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def owner(self, key: str):
+        if not self.points:
+            return None
+        index = bisect.bisect(self.keys, self._hash(key)) % len(self.points)
+        return self.points[index][1]
+
+
+class Coordinator:
+    """Leader election and membership over coordination.k8s.io Leases.
+
+    Updates carry the resourceVersion that was read, so two replicas racing for an
+    expired Lease cannot both win: the loser gets a 409. A replica that cannot renew
+    within LEASE_DURATION_SECONDS steps down on its own, before another can take over.
+    """
+
+    def __init__(self, coordination_api=None, identity=IDENTITY, namespace=LEASE_NAMESPACE):
+        self.api = coordination_api or client.CoordinationV1Api()
+        self.identity = identity
+        self.namespace = namespace
+        self.leader = False
+        self.renewed_at = 0.0
+        self.members = [identity]
+        self.ring = HashRing(self.members)
+
+    def is_leader(self) -> bool:
+        # Stale when renewals keep failing; stop a third of the Lease early, before anyone can take over
+        return self.leader and time.time() - self.renewed_at < LEASE_DURATION_SECONDS * 2 / 3
+
+    def owns(self, key: str) -> bool:
+        return self.ring.owner(key) == self.identity
+
+    def lease_body(self, name, now, labels=None, transitions=0, acquired=None, resource_version=None):
+        return {
+            "apiVersion": "coordination.k8s.io/v1",
+            "kind": "Lease",
+            "metadata": {
+                "name": name,
+                "namespace": self.namespace,
+                "labels": labels or {},
+                **({"resourceVersion": resource_version} if resource_version else {})
+            },
+            "spec": {
+                "holderIdentity": self.identity,
+                "leaseDurationSeconds": LEASE_DURATION_SECONDS,
+                "acquireTime": lease_time(acquired or now),
+                "renewTime": lease_time(now),
+                "leaseTransitions": transitions
+            }
+        }
+
+    def elect(self, now: float):
+        try:
+            lease = self.api.read_namespaced_lease(name=LEADER_LEASE, namespace=self.namespace)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            self.api.create_namespaced_lease(namespace=self.namespace, body=self.lease_body(LEADER_LEASE, now))
+            self._became(True, now)
+            return
+        mine = lease.spec.holder_identity == self.identity
+        if not mine and not lease_expired(lease, now):
+            self._became(False, now)
+            return
+        transitions = (lease.spec.lease_transitions or 0) + (0 if mine else 1)
+        acquired = lease.spec.acquire_time.timestamp() if mine and lease.spec.acquire_time else now
+        try:
+            self.api.replace_namespaced_lease(
+                name=LEADER_LEASE, namespace=self.namespace,
+                body=self.lease_body(LEADER_LEASE, now, None, transitions, acquired, lease.metadata.resource_version)
+            )
+        except ApiException as e:
+            if e.status != 409:
+                raise
+            self._became(False, now)
+            return
+        self._became(True, now)
+
+    def _became(self, leader: bool, now: float):
+        if leader:
+            self.renewed_at = now
+        if leader != self.leader:
+            print(f"Controllers: {self.identity} {'acquired' if leader else 'does not hold'} {LEADER_LEASE}")
+        self.leader = leader
+        is_leader_gauge.set(1 if leader else 0)
+
+    def heartbeat(self, now: float):
+        name = f"{MEMBER_LABEL}-{self.identity}"
+        body = self.lease_body(name, now, {MEMBER_LABEL: "true"})
+        try:
+            self.api.replace_namespaced_lease(name=name, namespace=self.namespace, body=body)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            self.api.create_namespaced_lease(namespace=self.namespace, body=body)
+
+    def refresh_members(self, now: float):
+        leases = self.api.list_namespaced_lease(namespace=self.namespace, label_selector=f"{MEMBER_LABEL}=true")
+        live = []
+        for lease in leases.items:
+            if not lease_expired(lease, now):
+                live.append(lease.spec.holder_identity)
+            elif self.is_leader():
+                # Replicas that went away without releasing their Lease
+                try:
+                    self.api.delete_namespaced_lease(name=lease.metadata.name, namespace=self.namespace)
+                except ApiException as e:
+                    if e.status != 404:
+                        raise
+        members = sorted(set(live) | {self.identity})
+        if members != self.members:
+            print(f"Controllers: members {', '.join(members)}")
+            self.members = members
+            self.ring = HashRing(members)
+        members_gauge.set(len(members))
+
+    def tick(self):
+        now = time.time()
+        self.heartbeat(now)
+        self.elect(now)
+        self.refresh_members(now)
+
+    def release(self):
+        """Give up the leader Lease and membership so others take over without waiting for expiry"""
+        try:
+            self.api.delete_namespaced_lease(name=f"{MEMBER_LABEL}-{self.identity}", namespace=self.namespace)
+            if self.leader:
+                lease = self.api.read_namespaced_lease(name=LEADER_LEASE, namespace=self.namespace)
+                if lease.spec.holder_identity == self.identity:
+                    lease.spec.holder_identity = None
+                    self.api.replace_namespaced_lease(name=LEADER_LEASE, namespace=self.namespace, body=lease)
+        except ApiException as e:
+            print(f"Controllers: release failed: {e.reason}")
+        self.leader = False
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.tick)
+            except Exception as e:
+                print(f"Controllers: lease renewal failed: {e}")
+            await asyncio.sleep(RENEW_SECONDS)
+
+
+class WorkQueue:
+    """Keyed work items processed by `workers` tasks calling a blocking handler in a thread.
+
+    A key already queued or in flight is not added twice. Items start at most `rate`
+    per second (bursts up to `burst`); failures are retried after base_delay * 2^n
+    with jitter, up to max_retries.
+    """
+
+    def __init__(self, name, handler, workers=4, rate=10.0, burst=20, max_retries=5,
+                 base_delay=1.0, max_delay=300.0):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.queue = None
+        self.keys = set()
+        self.failures = {}
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+
+    def add(self, key, item):
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        self.queue.put_nowait((key, item))
+        queue_depth.labels(queue=self.name).set(self.queue.qsize())
+
+    def _retry(self, key, item):
+        attempts = self.failures.get(key, 0) + 1
+        self.failures[key] = attempts
+        if attempts > self.max_retries:
+            print(f"Work queue {self.name}: giving up on {key} after {self.max_retries} retries")
+            self.failures.pop(key)
+            self.keys.discard(key)
+            queue_results.labels(queue=self.name, result="dropped").inc()
+            return
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+        queue_results.labels(queue=self.name, result="retried").inc()
+        # The key stays claimed while it backs off, so a rescan cannot skip the delay
+        asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, (key, item))
+
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+            self.refilled_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def _worker(self):
+        while True:
+            key, item = await self.queue.get()
+            queue_depth.labels(queue=self.name).set(self.queue.qsize())
+            await self._take_token()
+            try:
+                await asyncio.to_thread(self.handler, item)
+            except Exception as e:
+                print(f"Work queue {self.name}: {key} failed: {e}")
+                self._retry(key, item)
+                continue
+            self.keys.discard(key)
+            self.failures.pop(key, None)
+            queue_results.labels(queue=self.name, result="done").inc()
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        for _ in range(self.workers):
+            asyncio.create_task(self._worker())
+
+    def status(self):
+        return {
+            "depth": self.queue.qsize() if self.queue else 0,
+            "in_flight_or_queued": len(self.keys),
+            "retrying": len(self.failures)
+        }
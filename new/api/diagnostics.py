@@ -0,0 +1,139 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+from prometheus_client import Counter
+
+LOG_TAIL_LINES = int(os.environ.get("LOG_TAIL_LINES", "200"))
+# Largest tail a client may ask the log stream for
+LOG_MAX_TAIL_LINES = int(os.environ.get("LOG_MAX_TAIL_LINES", "10000"))
+LOG_LIMIT_BYTES = int(os.environ.get("LOG_LIMIT_BYTES", str(64 * 1024)))
+# Error lines returned with a pod's status
+ERROR_LINES = int(os.environ.get("LOG_ERROR_LINES", "20"))
+LOG_CACHE_ENTRIES = int(os.environ.get("LOG_CACHE_ENTRIES", "256"))
+STREAM_CHUNK_BYTES = 4096
+
+ERROR_RE = re.compile(
+    r"error|fail|fatal|traceback|exception|denied|no such file|not found|killed|timed out|✗",
+    re.IGNORECASE
+)
+
+log_reads = Counter("chromium_log_reads_total", "Container log reads", ["source"])
+
+
+def error_lines(text: str, limit: int = ERROR_LINES) -> list:
+    """The last `limit` lines that look like errors, with a Python traceback kept whole"""
+    lines = text.splitlines()
+    picked = []
+    in_traceback = False
+    for line in lines:
+        if line.startswith("Traceback"):
+            in_traceback = True
+        if in_traceback or ERROR_RE.search(line):
+            picked.append(line)
+        if in_traceback and line and not line.startswith((" ", "Traceback")):
+            in_traceback = False
+    return picked[-limit:]
+
+
+class LogCache:
+    """LRU of terminated containers' logs, keyed by container ID: they never change"""
+
+    def __init__(self, size=LOG_CACHE_ENTRIES):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class Diagnostics:
+    """Bounded log reads for session pods.
+
+    Every read is capped at LOG_TAIL_LINES and LOG_LIMIT_BYTES. Logs of
+    terminated containers are cached, so polling a failed pod costs one read.
+    """
+
+    def __init__(self, core_api=None):
+        self.v1 = core_api or client.CoreV1Api()
+        self.cache = LogCache()
+
+    def read(self, pod, container: str, terminated_id: str = None) -> str:
+        if terminated_id:
+            cached = self.cache.get(terminated_id)
+            if cached is not None:
+                log_reads.labels(source="cache").inc()
+                return cached
+        text = self.v1.read_namespaced_pod_log(
+            name=pod.metadata.name,
+            namespace=pod.metadata.namespace,
+            container=container,
+            tail_lines=LOG_TAIL_LINES,
+            limit_bytes=LOG_LIMIT_BYTES
+        )
+        log_reads.labels(source="api").inc()
+        if terminated_id:
+            self.cache.put(terminated_id, text)
+        return text
+
+    def failures(self, pod, tail: bool = False) -> list:
+        """Containers that exited non-zero, with their error lines (and log tail if asked)"""
+        statuses = (pod.status.init_container_statuses or []) + (pod.status.container_statuses or [])
+        found = []
+        for status in statuses:
+            terminated = status.state.terminated if status.state else None
+            if not terminated or terminated.exit_code == 0:
+                continue
+            try:
+                text = self.read(pod, status.name, terminated.container_id)
+            except ApiException as e:
+                text = f"Logs unavailable: {e.reason}"
+            failure = {
+                "container": status.name,
+                "exit_code": terminated.exit_code,
+                "reason": terminated.reason,
+                "error_lines": error_lines(text)
+            }
+            if tail:
+                failure["tail"] = text.splitlines()
+            found.append(failure)
+        return found
+
+    def stream(self, namespace: str, pod_name: str, container: str, follow: bool, tail_lines: int):
+        """Open the log stream and return an iterator of raw chunks.
+
+        Opening is eager so that a missing pod or container raises here, before a
+        response has started; follow keeps the connection open until the container stops.
+        """
+        response = self.v1.read_namespaced_pod_log(
+            name=pod_name,
+            namespace=namespace,
+            container=container,
+            follow=follow,
+            tail_lines=tail_lines,
+            _preload_content=False
+        )
+        log_reads.labels(source="stream").inc()
+
+        def chunks():
+            try:
+                yield from response.stream(STREAM_CHUNK_BYTES)
+            finally:
+                response.release_conn()
+
+        return chunks()
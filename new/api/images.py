@@ -0,0 +1,180 @@
+import asyncio
+import os
+import time
+
+import boto3
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+from prometheus_client import Counter
+
+ECR_REGISTRY = os.environ.get("ECR_REGISTRY", "your-account.dkr.ecr.us-east-1.amazonaws.com")
+IMAGE_TAG = os.environ.get("SESSION_IMAGE_TAG", "latest")
+# Repositories whose tag is resolved to a digest for session pods
+PINNED_REPOSITORIES = [r for r in os.environ.get("PINNED_REPOSITORIES", "chromium-vnc").split(",") if r]
+PIN_DIGESTS = os.environ.get("PIN_IMAGE_DIGESTS", "1") == "1"
+IMAGE_REFRESH_SECONDS = int(os.environ.get("IMAGE_REFRESH_SECONDS", "300"))
+ROLLOUT_CHECK_SECONDS = int(os.environ.get("IMAGE_ROLLOUT_CHECK_SECONDS", "10"))
+PREPULL_DAEMONSET = os.environ.get("PREPULL_DAEMONSET", "chromium-image-prepull")
+PREPULL_NAMESPACE = os.environ.get("PREPULL_NAMESPACE", "default")
+
+digest_changes = Counter(
+    "chromium_image_digest_changes_total", "Session image digests promoted", ["repository"]
+)
+
+
+def ecr_region(registry: str) -> str:
+    # <account>.dkr.ecr.<region>.amazonaws.com
+    parts = registry.split(".")
+    return parts[3] if len(parts) > 3 else os.environ.get("AWS_REGION", "us-east-1")
+
+
+class ImageResolver:
+    """Pins session images to digests that are already on every node.
+
+    Tags are resolved against ECR every IMAGE_REFRESH_SECONDS (needs
+    ecr:DescribeImages). A new digest is first rolled out to the pre-pull
+    DaemonSet; session pods switch to it only once every node has pulled it, so
+    they start with IfNotPresent and never wait on the registry. Until a digest is
+    known the tag is used with Always, as before.
+    """
+
+    def __init__(self, apps_api=None, ecr=None, is_leader=lambda: True):
+        self.apps = apps_api or client.AppsV1Api()
+        self.ecr = ecr
+        # The leader resolves and rolls out digests; the other replicas follow the DaemonSet
+        self.is_leader = is_leader
+        self.current = {}
+        self.pending = {}
+        self.last_refresh = None
+
+    def tagged(self, repository: str) -> str:
+        return f"{ECR_REGISTRY}/{repository}:{IMAGE_TAG}"
+
+    def image(self, repository: str):
+        """(image, imagePullPolicy) for a session pod container"""
+        digest = self.current.get(repository)
+        if digest:
+            return f"{ECR_REGISTRY}/{repository}@{digest}", "IfNotPresent"
+        return self.tagged(repository), "Always"
+
+    def resolve(self, repository: str) -> str:
+        if self.ecr is None:
+            self.ecr = boto3.client("ecr", region_name=ecr_region(ECR_REGISTRY))
+        response = self.ecr.describe_images(
+            registryId=ECR_REGISTRY.split(".")[0],
+            repositoryName=repository,
+            imageIds=[{"imageTag": IMAGE_TAG}]
+        )
+        return response["imageDetails"][0]["imageDigest"]
+
+    def adopt_prepulled(self):
+        """After a restart, keep serving whatever the DaemonSet already has on the nodes"""
+        try:
+            daemonset = self.apps.read_namespaced_daemon_set(name=PREPULL_DAEMONSET, namespace=PREPULL_NAMESPACE)
+        except ApiException as e:
+            print(f"Images: pre-pull DaemonSet unavailable: {e.reason}")
+            return
+        if not self.rolled_out(daemonset):
+            return
+        for container in daemonset.spec.template.spec.init_containers or []:
+            if container.name in PINNED_REPOSITORIES and "@" in container.image:
+                self.current[container.name] = container.image.split("@", 1)[1]
+
+    @staticmethod
+    def rolled_out(daemonset) -> bool:
+        status = daemonset.status
+        return (
+            (status.observed_generation or 0) >= daemonset.metadata.generation
+            and (status.updated_number_scheduled or 0) == status.desired_number_scheduled
+            and (status.number_ready or 0) == status.desired_number_scheduled
+        )
+
+    def prepull(self, repository: str, digest: str) -> bool:
+        """Point the DaemonSet at digest; False if there is no DaemonSet to wait for"""
+        try:
+            self.apps.patch_namespaced_daemon_set(
+                name=PREPULL_DAEMONSET,
+                namespace=PREPULL_NAMESPACE,
+                body={"spec": {"template": {"spec": {"initContainers": [
+                    {"name": repository, "image": f"{ECR_REGISTRY}/{repository}@{digest}"}
+                ]}}}}
+            )
+        except ApiException as e:
+            if e.status == 404:
+                return False
+            raise
+        return True
+
+    def promote(self, repository: str, digest: str):
+        print(f"Images: {repository} pinned to {digest}")
+        self.current[repository] = digest
+        self.pending.pop(repository, None)
+        digest_changes.labels(repository=repository).inc()
+
+    def refresh(self):
+        for repository in PINNED_REPOSITORIES:
+            try:
+                digest = self.resolve(repository)
+            except Exception as e:
+                print(f"Images: failed to resolve {self.tagged(repository)}: {e}")
+                continue
+            if digest in (self.current.get(repository), self.pending.get(repository)):
+                continue
+            if self.prepull(repository, digest):
+                print(f"Images: pre-pulling {repository}@{digest} on all nodes")
+                self.pending[repository] = digest
+            else:
+                self.promote(repository, digest)
+        self.last_refresh = time.time()
+
+    def check_rollout(self):
+        try:
+            daemonset = self.apps.read_namespaced_daemon_set(name=PREPULL_DAEMONSET, namespace=PREPULL_NAMESPACE)
+        except ApiException as e:
+            print(f"Images: failed to read {PREPULL_DAEMONSET}: {e.reason}")
+            return
+        if not self.rolled_out(daemonset):
+            return
+        images = {c.name: c.image for c in daemonset.spec.template.spec.init_containers or []}
+        for repository, digest in list(self.pending.items()):
+            if images.get(repository, "").endswith(f"@{digest}"):
+                self.promote(repository, digest)
+
+    def status(self):
+        return {
+            "pinning": PIN_DIGESTS,
+            "last_refresh": self.last_refresh,
+            "images": {
+                repository: {
+                    "image": self.image(repository)[0],
+                    "pull_policy": self.image(repository)[1],
+                    "pending_digest": self.pending.get(repository)
+                }
+                for repository in PINNED_REPOSITORIES
+            }
+        }
+
+    async def run(self):
+        if not PIN_DIGESTS:
+            return
+        await asyncio.to_thread(self.adopt_prepulled)
+        next_refresh = 0.0
+        while True:
+            if not self.is_leader():
+                self.pending.clear()
+                next_refresh = 0.0
+                try:
+                    await asyncio.to_thread(self.adopt_prepulled)
+                except Exception as e:
+                    print(f"Images: failed to follow {PREPULL_DAEMONSET}: {e}")
+                await asyncio.sleep(ROLLOUT_CHECK_SECONDS)
+                continue
+            try:
+                if time.monotonic() >= next_refresh:
+                    await asyncio.to_thread(self.refresh)
+                    next_refresh = time.monotonic() + IMAGE_REFRESH_SECONDS
+                if self.pending:
+                    await asyncio.to_thread(self.check_rollout)
+            except Exception as e:
+                print(f"Images: refresh failed: {e}")
+            await asyncio.sleep(ROLLOUT_CHECK_SECONDS if self.pending else IMAGE_REFRESH_SECONDS)
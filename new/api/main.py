@@ -1,24 +1,134 @@
-from fastapi import FastAPI, HTTPException
+from brotli_asgi import BrotliMiddleware
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from kubernetes import client, config
 from kubernetes.client.rest import ApiException
+from kubernetes.utils import parse_quantity
+from prometheus_client import make_asgi_app
+import asyncio
+import hashlib
+import hmac
+import json
 import os
+import re
+import shutil
+import urllib.error
+import urllib.request
 import uuid
-from typing import Optional
+from datetime import datetime, timezone
+from typing import Dict, Optional
 import time
 
-app = FastAPI(title="Chromium Pod Manager with Display", version="2.0.0")
+from admission import AdmissionQueue, AdmissionRejected
+from capacity import CapacityController
+from controllers import Coordinator, WorkQueue
+from diagnostics import LOG_MAX_TAIL_LINES, LOG_TAIL_LINES
+from images import ImageResolver
+from placement import Placement, PlacementFull, load_shards
+from provisioning import PROVISION_WAIT_SECONDS, ProvisioningFailed, VersionProvisioner
+from registry import open_store
+from sizing import DEFAULT_PROFILE, DEFAULT_RESOURCES, SESSION_PROFILES, SizingRecommender
+
+app = FastAPI(
+    title="Chromium Pod Manager with Display",
+    version="2.0.0",
+    default_response_class=ORJSONResponse
+)
+# br for clients that accept it, gzip otherwise; followed log streams must not be buffered
+app.add_middleware(
+    BrotliMiddleware, minimum_size=1024, gzip_fallback=True, excluded_handlers=[r"^/pods/[^/]+/[^/]+/logs$"]
+)
 
 try:
     config.load_incluster_config()
 except:
     config.load_kube_config()
 
-v1 = client.CoreV1Api()
+admission = AdmissionQueue()
+sessions = open_store()
+# Every per-session call goes through the shard its name routes to
+placement = Placement(load_shards(), sessions)
+# Replicas elect a leader for cluster-wide loops and split per-session work on a hash ring
+coordinator = Coordinator(client.CoordinationV1Api())
+# Headroom, pre-pull and provisioning run in the cluster the API runs in
+capacity = CapacityController(client.AppsV1Api(), is_leader=coordinator.is_leader)
+images = ImageResolver(client.AppsV1Api(), is_leader=coordinator.is_leader)
+
+# 0 disables the limit / default expiry
+MAX_SESSIONS_PER_OWNER = int(os.environ.get("MAX_SESSIONS_PER_OWNER", "0"))
+DEFAULT_SESSION_TTL_SECONDS = int(os.environ.get("DEFAULT_SESSION_TTL_SECONDS", "0"))
+REAP_INTERVAL_SECONDS = int(os.environ.get("REAP_INTERVAL_SECONDS", "30"))
+REAP_WORKERS = int(os.environ.get("REAP_WORKERS", "4"))
+# Per replica; API-server deletes per second spent on reaping
+REAP_RATE_PER_SECOND = float(os.environ.get("REAP_RATE_PER_SECOND", "10"))
+# session-agent.py in each runner pod serves Chrome health and usage on this port
+SESSION_AGENT_PORT = int(os.environ.get("SESSION_AGENT_PORT", "8090"))
+SESSION_AGENT_TIMEOUT_SECONDS = float(os.environ.get("SESSION_AGENT_TIMEOUT_SECONDS", "1"))
+# Each session's agent only accepts POST /hibernate with HMAC(secret, pod name), so a
+# pod knows its own token and never the secret; unset disables hibernation
+SESSION_AGENT_SECRET = os.environ.get("SESSION_AGENT_SECRET", "")
+# Hibernated profiles: one directory per session on the profiles volume
+PROFILES_PATH = os.environ.get("PROFILES_PATH", "/mnt/profiles")
+# Stopping Chrome and archiving a large profile can take a while
+HIBERNATE_TIMEOUT_SECONDS = float(os.environ.get("HIBERNATE_TIMEOUT_SECONDS", "120"))
+# Pod names per label selector in an age-filtered bulk delete, to keep the URL short
+BULK_DELETE_CHUNK = int(os.environ.get("BULK_DELETE_CHUNK", "100"))
+# Display tuning profiles baked into the session image (docker/vnc-profiles.json)
+VNC_PROFILES = [p for p in os.environ.get("VNC_PROFILES", "balanced,low-latency,low-bandwidth,low-cpu").split(",") if p]
+DEFAULT_VNC_PROFILE = os.environ.get("DEFAULT_VNC_PROFILE", "balanced")
+
+def etag_for(*parts) -> str:
+    # Weak: the compression middleware changes the bytes, not the representation
+    return 'W/"' + hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()[:20] + '"'
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    tags = {t.strip().removeprefix("W/") for t in request.headers.get("if-none-match", "").split(",")}
+    if etag.removeprefix("W/") in tags:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+def project(rows: list, fields: Optional[str]) -> list:
+    """Keep only the comma-separated fields of each row"""
+    if not fields or not rows:
+        return rows
+    wanted = [f for f in fields.split(",") if f]
+    unknown = set(wanted) - set(rows[0])
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {sorted(unknown)}")
+    return [{f: row[f] for f in wanted} for row in rows]
+
+def agent_token(pod_name: str) -> str:
+    return hmac.new(SESSION_AGENT_SECRET.encode(), pod_name.encode(), hashlib.sha256).hexdigest()
+
+def read_agent_stats(pod_ip: str) -> Optional[dict]:
+    try:
+        with urllib.request.urlopen(
+            f"http://{pod_ip}:{SESSION_AGENT_PORT}/stats", timeout=SESSION_AGENT_TIMEOUT_SECONDS
+        ) as response:
+            return json.load(response)
+    except (OSError, ValueError):
+        return None
+
+sizing = SizingRecommender(sessions, read_agent_stats, owns=coordinator.owns, identity=coordinator.identity)
+
+app.mount("/metrics", make_asgi_app())
+
+class ResourceOverride(BaseModel):
+    requests: Dict[str, str] = {}
+    limits: Dict[str, str] = {}
 
 class PodRequest(BaseModel):
     chromium_version: str
     namespace: str = "default"
+    owner: Optional[str] = None
+    ttl_seconds: Optional[int] = None
+    # Workload class used to learn resource recommendations, one of SESSION_PROFILES
+    profile: Optional[str] = None
+    # Explicit requests/limits; bypasses the recommender
+    resources: Optional[ResourceOverride] = None
+    # Display tuning: bandwidth vs. CPU vs. latency, one of VNC_PROFILES
+    vnc_profile: Optional[str] = None
 
 class PodResponse(BaseModel):
     pod_name: str
@@ -28,6 +138,8 @@ class PodResponse(BaseModel):
     namespace: str
     vnc_url: Optional[str] = None
     message: Optional[str] = None
+    queue_position: Optional[int] = None
+    queue_wait_seconds: Optional[float] = None
 
 # Only include versions we know exist (update this list based on what's actually downloaded)
 AVAILABLE_VERSIONS = [
@@ -41,53 +153,61 @@ AVAILABLE_VERSIONS = [
     "102.0.5005.61"
 ]
 
-def create_pod_manifest(chromium_version: str, namespace: str, pod_name: str):
-    ecr_registry = os.environ.get('ECR_REGISTRY', 'your-account.dkr.ecr.us-east-1.amazonaws.com')
-    
+# Versions outside the list are served once published on the versions volume,
+# and fetched on demand when a session asks for one that is missing
+provisioner = VersionProvisioner(client.BatchV1Api(), AVAILABLE_VERSIONS)
+
+def label_value(value: str) -> str:
+    """Squeeze an arbitrary string into a valid Kubernetes label value."""
+    return re.sub(r"[^A-Za-z0-9._-]", "-", value)[:63].strip("-._")
+
+def create_pod_manifest(chromium_version: str, namespace: str, pod_name: str,
+                        owner: Optional[str] = None, expires_at: Optional[float] = None,
+                        wait_seconds: int = 0, profile: str = DEFAULT_PROFILE,
+                        resources: Optional[dict] = None, sizing_source: str = "default",
+                        vnc_profile: str = DEFAULT_VNC_PROFILE):
+    # Digest-pinned once the pre-pull DaemonSet has it on every node
+    image, pull_policy = images.image("chromium-vnc")
+    resources = resources or DEFAULT_RESOURCES
+
+    labels = {
+        "app": "chromium-runner",
+        "pod-name": pod_name,  # Add specific pod name label
+        "chromium-version": chromium_version.replace(".", "-"),
+        "session-profile": profile,
+        "vnc-profile": vnc_profile
+    }
+    annotations = {
+        "chromium-version": chromium_version,
+        "session-sizing": sizing_source
+    }
+    if owner:
+        labels["owner"] = owner
+    if expires_at:
+        annotations["session-expires-at"] = str(int(expires_at))
+    if wait_seconds:
+        annotations["chromium-provisioning"] = "true"
+
     return {
         "apiVersion": "v1",
         "kind": "Pod",
         "metadata": {
             "name": pod_name,
             "namespace": namespace,
-            "labels": {
-                "app": "chromium-runner",
-                "pod-name": pod_name,  # Add specific pod name label
-                "chromium-version": chromium_version.replace(".", "-")
-            },
-            "annotations": {
-                "chromium-version": chromium_version
-            }
+            "labels": labels,
+            "annotations": annotations
         },
         "spec": {
             "initContainers": [{
+                # Copies only the hot set; the rest is linked to the read-only volume and
+                # hydrated in the background by the main container
                 "name": "copy-chromium",
-                "image": "busybox:latest",
-                "command": ["/bin/sh"],
-                "args": [
-                    "-c",
-                    f"echo 'Starting copy process...' && "
-                    f"echo 'Checking for version {chromium_version}' && "
-                    f"ls -la /mnt/source/ && "
-                    f"if [ ! -d /mnt/source/{chromium_version} ]; then "
-                    f"  echo 'ERROR: Version {chromium_version} not found!' && "
-                    f"  echo 'Available versions:' && ls -1 /mnt/source/ && "
-                    f"  exit 1; "
-                    f"fi && "
-                    f"echo 'Found version {chromium_version}, copying...' && "
-                    f"cp -rv /mnt/source/{chromium_version}/* /mnt/dest/ && "
-                    f"echo 'Setting permissions...' && "
-                    f"chmod -R 755 /mnt/dest/ && "
-                    f"if [ -f /mnt/dest/chrome ]; then "
-                    f"  chmod +x /mnt/dest/chrome && "
-                    f"  echo '✓ Chrome binary ready at /mnt/dest/chrome'; "
-                    f"else "
-                    f"  echo '⚠ Chrome binary not found, checking subdirectories...' && "
-                    f"  find /mnt/dest -name chrome -type f && "
-                    f"  exit 1; "
-                    f"fi && "
-                    f"echo '✓ Copy complete'"
-                ],
+                "image": image,
+                "imagePullPolicy": pull_policy,
+                "command": ["python3", "/usr/local/bin/chromium-prefetch.py"],
+                "args": ["stage", f"/mnt/source/{chromium_version}", "/mnt/dest"],
+                # On-demand versions: block until the downloader Job publishes the image
+                "env": [{"name": "CHROMIUM_WAIT_SECONDS", "value": str(wait_seconds)}],
                 "volumeMounts": [
                     {
                         "name": "all-chromium-versions",
@@ -102,24 +222,47 @@ def create_pod_manifest(chromium_version: str, namespace: str, pod_name: str):
             }],
             "containers": [{
                 "name": "chromium-vnc",
-                "image": f"{ecr_registry}/chromium-vnc:latest",
-                "imagePullPolicy": "Always",
+                "image": image,
+                "imagePullPolicy": pull_policy,
                 "ports": [
                     {"containerPort": 5900, "name": "vnc", "protocol": "TCP"},
-                    {"containerPort": 6080, "name": "novnc", "protocol": "TCP"}
+                    {"containerPort": 6080, "name": "novnc", "protocol": "TCP"},
+                    {"containerPort": SESSION_AGENT_PORT, "name": "agent", "protocol": "TCP"}
                 ],
+                # Out of the VNC service until Chrome is actually running
+                "readinessProbe": {
+                    "httpGet": {"path": "/healthz", "port": SESSION_AGENT_PORT},
+                    "periodSeconds": 5,
+                    "failureThreshold": 2
+                },
                 "env": [
                     {"name": "CHROMIUM_VERSION", "value": chromium_version},
-                    {"name": "DISPLAY", "value": ":99"}
+                    {"name": "CHROMIUM_SOURCE", "value": f"/mnt/source/{chromium_version}"},
+                    {"name": "DISPLAY", "value": ":99"},
+                    # Xvfb depth and x11vnc options, applied by vnc-launch.py
+                    {"name": "VNC_PROFILE", "value": vnc_profile},
+                    # Written on hibernate, restored by the agent when the session resumes
+                    {"name": "PROFILE_ARCHIVE", "value": "/mnt/profile/profile.tar.zst"}
+                ] + ([{"name": "AGENT_TOKEN", "value": agent_token(pod_name)}] if SESSION_AGENT_SECRET else []),
+                "volumeMounts": [
+                    {
+                        "name": "chromium-runtime",
+                        "mountPath": "/opt/chromium"
+                    },
+                    {
+                        # Cold files are symlinks into here until hydrated
+                        "name": "all-chromium-versions",
+                        "mountPath": "/mnt/source",
+                        "readOnly": True
+                    },
+                    {
+                        # Only this session's directory, never another session's profile
+                        "name": "session-profiles",
+                        "mountPath": "/mnt/profile",
+                        "subPath": f"{namespace}/{pod_name}"
+                    }
                 ],
-                "volumeMounts": [{
-                    "name": "chromium-runtime",
-                    "mountPath": "/opt/chromium"
-                }],
-                "resources": {
-                    "requests": {"memory": "1Gi", "cpu": "500m"},
-                    "limits": {"memory": "4Gi", "cpu": "2000m"}
-                }
+                "resources": resources
             }],
             "volumes": [
                 {
@@ -129,12 +272,72 @@ def create_pod_manifest(chromium_version: str, namespace: str, pod_name: str):
                 {
                     "name": "chromium-runtime",
                     "emptyDir": {"sizeLimit": "1Gi"}
+                },
+                {
+                    "name": "session-profiles",
+                    "persistentVolumeClaim": {"claimName": "chromium-profiles-pvc"}
                 }
             ],
             "restartPolicy": "Never"
         }
     }
 
+@app.on_event("startup")
+async def start_controllers():
+    loop = asyncio.get_running_loop()
+
+    def record_arrival(session):
+        # Watch thread: every replica forecasts from all arrivals, not just its own creates
+        loop.call_soon_threadsafe(capacity.record, session["version"])
+
+    for watcher in placement.watchers(on_local_created=record_arrival):
+        watcher.start()
+    asyncio.create_task(coordinator.run())
+    asyncio.create_task(capacity.run())
+    reap_queue.start()
+    asyncio.create_task(reap_expired_sessions())
+    asyncio.create_task(sizing.run())
+    asyncio.create_task(images.run())
+
+def forget_session(namespace: str, pod_name: str):
+    sessions.delete(namespace, pod_name)
+    sessions.set_hibernated(namespace, pod_name, None)
+    shutil.rmtree(os.path.join(PROFILES_PATH, namespace, pod_name), ignore_errors=True)
+
+def delete_session_resources(namespace: str, pod_name: str) -> list:
+    """Delete a session's service and pod; returns the names that existed"""
+    v1 = placement.for_session(pod_name).v1
+    deleted = []
+    for delete, name in ((v1.delete_namespaced_service, f"{pod_name}-vnc"),
+                         (v1.delete_namespaced_pod, pod_name)):
+        try:
+            delete(name=name, namespace=namespace, propagation_policy="Background")
+            deleted.append(name)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+    forget_session(namespace, pod_name)
+    return deleted
+
+@app.on_event("shutdown")
+async def stop_controllers():
+    await asyncio.to_thread(coordinator.release)
+
+def reap_session(session: dict):
+    delete_session_resources(session["namespace"], session["pod_name"])
+    print(f"Reaped expired session {session['namespace']}/{session['pod_name']}")
+
+reap_queue = WorkQueue("reap", reap_session, workers=REAP_WORKERS, rate=REAP_RATE_PER_SECOND)
+
+async def reap_expired_sessions():
+    while True:
+        for session in sessions.query(expires_before=time.time()):
+            key = f"{session['namespace']}/{session['pod_name']}"
+            # Each expired session is reaped by exactly one live replica
+            if coordinator.owns(key):
+                reap_queue.add(key, session)
+        await asyncio.sleep(REAP_INTERVAL_SECONDS)
+
 @app.get("/")
 async def root():
     return {
@@ -142,100 +345,266 @@ async def root():
         "version": "2.0.0",
         "endpoints": {
             "versions": "/versions",
+            "version_status": "/versions/{version}",
+            "provision_version": "POST /versions/{version}",
             "create_pod": "POST /pods",
-            "list_pods": "/pods",
+            "list_pods": "/pods?fields=name,status",
             "get_pod": "/pods/{namespace}/{pod_name}",
-            "delete_pod": "DELETE /pods/{namespace}/{pod_name}"
+            "pod_diagnostics": "/pods/{namespace}/{pod_name}/diagnostics",
+            "pod_logs": "/pods/{namespace}/{pod_name}/logs?container=&follow=",
+            "delete_pod": "DELETE /pods/{namespace}/{pod_name}",
+            "delete_pods": "DELETE /pods?version=&owner=&older_than_seconds=",
+            "hibernate_pod": "POST /pods/{namespace}/{pod_name}/hibernate",
+            "resume_pod": "POST /pods/{namespace}/{pod_name}/resume",
+            "capacity": "/capacity",
+            "controllers": "/controllers",
+            "admission": "/admission",
+            "sizing": "/sizing",
+            "images": "/images",
+            "placement": "/placement",
+            "metrics": "/metrics"
         }
     }
 
 @app.get("/versions")
-async def list_versions():
-    return {
-        "available_versions": AVAILABLE_VERSIONS,
-        "count": len(AVAILABLE_VERSIONS),
+async def list_versions(request: Request):
+    versions = await asyncio.to_thread(provisioner.versions)
+    etag = etag_for(*versions)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    return ORJSONResponse({
+        "available_versions": versions,
+        "count": len(versions),
         "note": "These versions have been verified to exist in storage"
+    }, headers={"ETag": etag})
+
+@app.get("/versions/{version}")
+async def version_status(version: str):
+    return await asyncio.to_thread(provisioner.status, version)
+
+@app.post("/versions/{version}", status_code=202)
+async def provision_version(version: str):
+    if provisioner.available(version):
+        return provisioner.status(version)
+    if not provisioner.can_provision(version):
+        raise HTTPException(status_code=400, detail=f"Version {version} cannot be provisioned on demand")
+    try:
+        await asyncio.to_thread(provisioner.request, version)
+    except ProvisioningFailed as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return await asyncio.to_thread(provisioner.status, version)
+
+@app.get("/capacity")
+async def capacity_status():
+    return capacity.status()
+
+@app.get("/controllers")
+async def controllers_status():
+    return {
+        "identity": coordinator.identity,
+        "leader": coordinator.is_leader(),
+        "members": coordinator.members,
+        "reap_queue": reap_queue.status()
     }
 
+@app.get("/admission")
+async def admission_status():
+    return admission.snapshot()
+
+@app.get("/placement")
+async def placement_status():
+    return placement.status()
+
+@app.get("/images")
+async def image_status():
+    return images.status()
+
+@app.get("/sizing")
+async def sizing_status():
+    return sizing.status()
+
+@app.get("/sizing/{version}")
+async def sizing_recommendation(version: str, profile: str = DEFAULT_PROFILE):
+    if profile not in SESSION_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile {profile}. Available profiles: {SESSION_PROFILES}")
+    return {"version": version, "profile": profile, "mode": sizing.mode, **sizing.recommend(version, profile)}
+
+def create_session_resources(request: PodRequest, shard, namespace: str, pod_name: str, service_name: str,
+                             owner: Optional[str], expires_at: Optional[float], wait_seconds: int = 0,
+                             profile: str = DEFAULT_PROFILE, resources: Optional[dict] = None,
+                             sizing_source: str = "default"):
+    # Create pod
+    pod_manifest = create_pod_manifest(
+        request.chromium_version, namespace, pod_name, owner, expires_at, wait_seconds,
+        profile, resources, sizing_source, request.vnc_profile or DEFAULT_VNC_PROFILE
+    )
+    shard.v1.create_namespaced_pod(namespace=namespace, body=pod_manifest)
+    # Write through so quota checks on this replica see the session before the watch does
+    sessions.upsert({
+        "namespace": namespace,
+        "pod_name": pod_name,
+        "owner": owner,
+        "version": request.chromium_version,
+        "state": "Pending",
+        "created_at": time.time(),
+        "expires_at": expires_at,
+        "profile": profile,
+        "shard": shard.name
+    })
+
+    # Create service with specific pod selector; labels are set at creation, so no wait is needed
+    service_manifest = {
+        "apiVersion": "v1",
+        "kind": "Service",
+        "metadata": {
+            "name": service_name,
+            "namespace": namespace,
+            # Same session labels as the pod, so bulk deletes select both
+            "labels": {
+                "app": "chromium-vnc-service",
+                "pod-name": pod_name,
+                "chromium-version": request.chromium_version.replace(".", "-"),
+                **({"owner": owner} if owner else {})
+            }
+        },
+        "spec": {
+            "type": "LoadBalancer",
+            "selector": {
+                "pod-name": pod_name  # Use specific pod name
+            },
+            "ports": [{
+                "name": "novnc",
+                "port": 80,
+                "targetPort": 6080,
+                "protocol": "TCP"
+            }]
+        }
+    }
+
+    shard.v1.create_namespaced_service(namespace=namespace, body=service_manifest)
+
 @app.post("/pods", response_model=PodResponse)
 async def create_pod(request: PodRequest):
-    if request.chromium_version not in AVAILABLE_VERSIONS:
+    try:
+        shard = placement.choose(request.chromium_version)
+    except PlacementFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    namespace = shard.namespace_for(request.namespace)
+    # Shards that list their versions publish them themselves; the rest share this volume
+    provisioning = shard.versions is None and not provisioner.available(request.chromium_version)
+    if provisioning and not provisioner.can_provision(request.chromium_version):
         raise HTTPException(
             status_code=400,
             detail=f"Version {request.chromium_version} not available. Available versions: {AVAILABLE_VERSIONS}"
         )
-    
-    pod_name = f"chromium-{request.chromium_version.replace('.', '-')}-{uuid.uuid4().hex[:8]}"
+    if request.resources:
+        unknown = {k for section in (request.resources.requests, request.resources.limits) for k in section}
+        unknown -= {"memory", "cpu"}
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unsupported resource keys: {sorted(unknown)}")
+        # Caught here rather than as a 422 from the API server after admission and placement
+        quantities = {}
+        for section in ("requests", "limits"):
+            for key, value in getattr(request.resources, section).items():
+                try:
+                    quantity = parse_quantity(value)
+                except ValueError:
+                    quantity = None
+                if quantity is None or quantity < 0:
+                    raise HTTPException(status_code=422, detail=f"Invalid {key} {section[:-1]}: {value!r}")
+                quantities[section, key] = quantity
+        over = [
+            key for key in ("memory", "cpu")
+            if ("requests", key) in quantities and ("limits", key) in quantities
+            and quantities["requests", key] > quantities["limits", key]
+        ]
+        if over:
+            raise HTTPException(status_code=422, detail=f"Requests exceed limits for: {over}")
+    if request.vnc_profile and request.vnc_profile not in VNC_PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown VNC profile {request.vnc_profile}. Available profiles: {VNC_PROFILES}"
+        )
+    if request.profile and request.profile not in SESSION_PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown profile {request.profile}. Available profiles: {SESSION_PROFILES}"
+        )
+    owner = label_value(request.owner) if request.owner else None
+    if owner and MAX_SESSIONS_PER_OWNER and sessions.count(owner=owner) >= MAX_SESSIONS_PER_OWNER:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Owner {owner} already has {MAX_SESSIONS_PER_OWNER} active sessions"
+        )
+
+    pod_name = placement.session_name(shard, request.chromium_version, uuid.uuid4().hex[:8])
     service_name = f"{pod_name}-vnc"
-    
+    tenant = owner or namespace
+    ttl = request.ttl_seconds or DEFAULT_SESSION_TTL_SECONDS
+    expires_at = time.time() + ttl if ttl else None
+
+    if provisioning:
+        try:
+            await asyncio.to_thread(provisioner.request, request.chromium_version)
+        except ProvisioningFailed as e:
+            raise HTTPException(status_code=502, detail=str(e))
+        except ApiException as e:
+            raise HTTPException(status_code=500, detail=f"Failed to provision version: {e.reason}")
+    wait_seconds = PROVISION_WAIT_SECONDS if provisioning else 0
+    profile = request.profile or DEFAULT_PROFILE
+    override = request.resources.model_dump() if request.resources else None
+    # On the event loop: the sampler updates the usage history here too
+    resources, sizing_source = sizing.resources_for(request.chromium_version, profile, override)
+
     try:
-        # Create pod
-        pod_manifest = create_pod_manifest(request.chromium_version, request.namespace, pod_name)
-        v1.create_namespaced_pod(namespace=request.namespace, body=pod_manifest)
-        
-        # Wait for pod to get its labels
-        time.sleep(2)
-        
-        # Create service with specific pod selector
-        service_manifest = {
-            "apiVersion": "v1",
-            "kind": "Service",
-            "metadata": {
-                "name": service_name,
-                "namespace": request.namespace,
-                "labels": {
-                    "app": "chromium-vnc-service"
-                }
-            },
-            "spec": {
-                "type": "LoadBalancer",
-                "selector": {
-                    "pod-name": pod_name  # Use specific pod name
-                },
-                "ports": [{
-                    "name": "novnc",
-                    "port": 80,
-                    "targetPort": 6080,
-                    "protocol": "TCP"
-                }]
+        async with admission.admit(tenant) as ticket:
+            await asyncio.to_thread(
+                create_session_resources, request, shard, namespace, pod_name, service_name, owner, expires_at,
+                wait_seconds, profile, resources, sizing_source
+            )
+    except AdmissionRejected as e:
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(max(1, int(e.eta_seconds - admission.slo_seconds)))},
+            content={
+                "detail": f"Session creation backlog is past its SLO ({admission.slo_seconds:.0f}s). Retry later.",
+                "queue_position": e.position,
+                "eta_seconds": round(e.eta_seconds, 1)
             }
-        }
-        
-        v1.create_namespaced_service(namespace=request.namespace, body=service_manifest)
-        
-        return PodResponse(
-            pod_name=pod_name,
-            service_name=service_name,
-            status="Creating",
-            chromium_version=request.chromium_version,
-            namespace=request.namespace,
-            message=f"Pod and service created. Check status with GET /pods/{request.namespace}/{pod_name}"
         )
-        
     except ApiException as e:
         raise HTTPException(
             status_code=500,
             detail=f"Failed to create resources: {e.reason}. Error: {str(e)}"
         )
 
+    message = f"Pod and service created. Check status with GET /pods/{namespace}/{pod_name}"
+    if provisioning:
+        message = (f"Chromium {request.chromium_version} is being fetched; the session starts once it is "
+                   f"published. Check status with GET /pods/{namespace}/{pod_name}")
+
+    return PodResponse(
+        pod_name=pod_name,
+        service_name=service_name,
+        status="Provisioning" if provisioning else "Creating",
+        chromium_version=request.chromium_version,
+        namespace=namespace,
+        message=message,
+        queue_position=ticket.position,
+        queue_wait_seconds=round(ticket.wait_seconds, 3)
+    )
+
 @app.get("/pods/{namespace}/{pod_name}")
 async def get_pod_status(namespace: str, pod_name: str):
+    shard = placement.for_session(pod_name)
+    v1 = shard.v1
     try:
         pod = v1.read_namespaced_pod(name=pod_name, namespace=namespace)
         
-        # Get init container logs if failed
-        init_logs = None
-        if pod.status.init_container_statuses:
-            for init_status in pod.status.init_container_statuses:
-                if init_status.state.terminated and init_status.state.terminated.exit_code != 0:
-                    try:
-                        init_logs = v1.read_namespaced_pod_log(
-                            name=pod_name,
-                            namespace=namespace,
-                            container="copy-chromium"
-                        )
-                    except:
-                        pass
+        # Error lines only, from a bounded and (once terminated) cached log read
+        failures = await asyncio.to_thread(shard.diagnostics.failures, pod)
+        init_logs = "\n".join(line for f in failures for line in f["error_lines"])
         
         # Get service
         service_name = f"{pod_name}-vnc"
@@ -249,67 +618,346 @@ async def get_pod_status(namespace: str, pod_name: str):
                 vnc_url = "LoadBalancer provisioning... (wait 2-3 minutes)"
         except:
             vnc_url = "Service not found or still creating"
+
+        version = pod.metadata.annotations.get("chromium-version", "unknown")
+        provisioning = None
+        if pod.metadata.annotations.get("chromium-provisioning") == "true" and pod.status.phase == "Pending":
+            provisioning = provisioner.status(version)
+
+        # One short request to the in-pod agent; None if it is not reachable yet
+        session = None
+        if pod.status.phase == "Running" and pod.status.pod_ip:
+            session = await asyncio.to_thread(read_agent_stats, pod.status.pod_ip)
         
         return {
             "pod_name": pod.metadata.name,
             "status": pod.status.phase,
-            "chromium_version": pod.metadata.annotations.get("chromium-version", "unknown"),
+            "chromium_version": version,
             "created_at": str(pod.metadata.creation_timestamp),
             "pod_ip": pod.status.pod_ip,
             "vnc_url": vnc_url,
             "vnc_password": "chromium",
-            "init_container_logs": init_logs if init_logs else "No errors"
+            "vnc_profile": (pod.metadata.labels or {}).get("vnc-profile", DEFAULT_VNC_PROFILE),
+            "init_container_logs": init_logs if init_logs else "No errors",
+            "failures": failures,
+            "provisioning": provisioning,
+            "browser_running": session["chrome"]["running"] if session else None,
+            "session": session
         }
+    except ApiException as e:
+        hibernated = sessions.get(namespace, pod_name)
+        if e.status == 404 and hibernated and hibernated["state"] == "Hibernated":
+            return {
+                "pod_name": pod_name,
+                "status": "Hibernated",
+                "chromium_version": hibernated["version"],
+                "created_at": str(datetime.fromtimestamp(hibernated["created_at"], timezone.utc)),
+                "vnc_url": hibernated["vnc_url"],
+                "message": f"Resume with POST /pods/{namespace}/{pod_name}/resume"
+            }
+        raise HTTPException(status_code=404, detail=f"Pod not found: {e.reason}")
+
+@app.get("/pods/{namespace}/{pod_name}/diagnostics")
+async def pod_diagnostics(namespace: str, pod_name: str):
+    shard = placement.for_session(pod_name)
+    try:
+        pod = await asyncio.to_thread(shard.v1.read_namespaced_pod, name=pod_name, namespace=namespace)
     except ApiException as e:
         raise HTTPException(status_code=404, detail=f"Pod not found: {e.reason}")
+    return {
+        "pod_name": pod_name,
+        "status": pod.status.phase,
+        "failures": await asyncio.to_thread(shard.diagnostics.failures, pod, True)
+    }
+
+@app.get("/pods/{namespace}/{pod_name}/logs")
+async def pod_logs(namespace: str, pod_name: str, container: str = "chromium-vnc",
+                   follow: bool = False,
+                   tail_lines: int = Query(LOG_TAIL_LINES, ge=1, le=LOG_MAX_TAIL_LINES)):
+    try:
+        chunks = await asyncio.to_thread(
+            placement.for_session(pod_name).diagnostics.stream, namespace, pod_name, container, follow, tail_lines
+        )
+    except ApiException as e:
+        raise HTTPException(status_code=e.status if e.status in (400, 404) else 500,
+                            detail=f"Logs unavailable: {e.reason}")
+    # Sync iterator: Starlette pulls it from a worker thread
+    return StreamingResponse(chunks, media_type="text/plain; charset=utf-8")
 
 @app.delete("/pods/{namespace}/{pod_name}")
 async def delete_pod(namespace: str, pod_name: str):
     try:
-        # Delete service first
-        service_name = f"{pod_name}-vnc"
-        try:
-            v1.delete_namespaced_service(name=service_name, namespace=namespace)
-        except:
-            pass
-        
-        # Delete pod
-        v1.delete_namespaced_pod(name=pod_name, namespace=namespace)
-        
-        return {"message": f"Pod {pod_name} and service {service_name} deleted"}
+        deleted = await asyncio.to_thread(delete_session_resources, namespace, pod_name)
     except ApiException as e:
-        raise HTTPException(status_code=404, detail=f"Failed to delete: {e.reason}")
+        raise HTTPException(status_code=500, detail=f"Failed to delete: {e.reason}")
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Session {pod_name} not found")
+    return {"message": f"Deleted {' and '.join(deleted)}"}
 
-@app.get("/pods")
-async def list_pods(namespace: str = "default"):
+def selector(*terms) -> str:
+    return ",".join(t for t in terms if t)
+
+def find_orphaned_services(v1, namespace: str) -> list:
+    """VNC services whose pod is gone and that are not hibernated"""
+    pods = v1.list_namespaced_pod(namespace=namespace, label_selector="app=chromium-runner")
+    services = v1.list_namespaced_service(namespace=namespace, label_selector="app=chromium-vnc-service")
+    live = {p.metadata.name for p in pods.items}
+    return sorted(
+        s.metadata.name for s in services.items
+        if s.metadata.name[:-len("-vnc")] not in live
+        and "session-hibernated-at" not in (s.metadata.annotations or {})
+    )
+
+def delete_sessions(namespace: str, version: Optional[str], owner: Optional[str],
+                    older_than_seconds: Optional[int], delete_orphans: bool) -> dict:
+    """Collection deletes per shard: one call per kind, or per BULK_DELETE_CHUNK sessions with an age filter"""
+    matched = sessions.query(
+        namespace=namespace, owner=owner, version=version,
+        created_before=time.time() - older_than_seconds if older_than_seconds else None
+    )
+    terms = (
+        f"chromium-version={version.replace('.', '-')}" if version else None,
+        f"owner={owner}" if owner else None
+    )
+    orphans = []
+    for shard in placement.in_namespace(namespace):
+        v1 = shard.v1
+        if older_than_seconds:
+            # Age is not a label; select the matched pods by name instead
+            names = [s["pod_name"] for s in matched if placement.for_session(s["pod_name"]) is shard]
+            selectors = [
+                selector(*terms, f"pod-name in ({','.join(names[i:i + BULK_DELETE_CHUNK])})")
+                for i in range(0, len(names), BULK_DELETE_CHUNK)
+            ]
+        else:
+            selectors = [selector(*terms)]
+        for terms_selector in selectors:
+            v1.delete_collection_namespaced_service(
+                namespace=namespace, label_selector=selector("app=chromium-vnc-service", terms_selector),
+                propagation_policy="Background"
+            )
+            v1.delete_collection_namespaced_pod(
+                namespace=namespace, label_selector=selector("app=chromium-runner", terms_selector),
+                propagation_policy="Background"
+            )
+
+        # Services from before they carried session labels, or left behind by failed creates
+        shard_orphans = find_orphaned_services(v1, namespace)
+        if delete_orphans:
+            for name in shard_orphans:
+                try:
+                    v1.delete_namespaced_service(name=name, namespace=namespace)
+                except ApiException as e:
+                    if e.status != 404:
+                        raise
+        orphans += shard_orphans
+    for session in matched:
+        forget_session(namespace, session["pod_name"])
+    return {
+        "deleted": [s["pod_name"] for s in matched],
+        "count": len(matched),
+        "orphaned_services": orphans,
+        "orphans_deleted": delete_orphans
+    }
+
+@app.delete("/pods")
+async def delete_pods(namespace: str = "default", version: Optional[str] = None, owner: Optional[str] = None,
+                      older_than_seconds: Optional[int] = None,
+                      all_sessions: bool = Query(False, alias="all"), delete_orphans: bool = False):
+    if not (version or owner or older_than_seconds or all_sessions):
+        raise HTTPException(
+            status_code=400,
+            detail="Pass version, owner or older_than_seconds, or all=true to delete every session"
+        )
+    owner = label_value(owner) if owner else None
     try:
-        pods = v1.list_namespaced_pod(namespace=namespace, label_selector="app=chromium-runner")
-        
-        pod_list = []
-        for pod in pods.items:
-            service_name = f"{pod.metadata.name}-vnc"
-            vnc_url = None
-            try:
-                service = v1.read_namespaced_service(name=service_name, namespace=namespace)
-                if service.status.load_balancer.ingress:
-                    lb = service.status.load_balancer.ingress[0].hostname
-                    vnc_url = f"http://{lb}/vnc.html"
-                else:
-                    vnc_url = "Provisioning..."
-            except:
-                vnc_url = "No service"
-            
-            pod_list.append({
-                "name": pod.metadata.name,
-                "status": pod.status.phase,
-                "chromium_version": pod.metadata.annotations.get("chromium-version", "unknown"),
-                "created_at": str(pod.metadata.creation_timestamp),
-                "vnc_url": vnc_url
-            })
-        
-        return {"count": len(pod_list), "pods": pod_list}
+        return await asyncio.to_thread(
+            delete_sessions, namespace, version, owner, older_than_seconds, delete_orphans
+        )
+    except ApiException as e:
+        raise HTTPException(status_code=500, detail=f"Failed to delete sessions: {e.reason}")
+
+def hibernate_session(namespace: str, pod_name: str) -> dict:
+    v1 = placement.for_session(pod_name).v1
+    pod = v1.read_namespaced_pod(name=pod_name, namespace=namespace)
+    if pod.status.phase != "Running" or not pod.status.pod_ip:
+        raise HTTPException(status_code=409, detail=f"Pod {pod_name} is {pod.status.phase}, not Running")
+    if not SESSION_AGENT_SECRET:
+        raise HTTPException(status_code=409, detail="Hibernation is disabled: SESSION_AGENT_SECRET is not set")
+    # The agent stops Chrome cleanly, then archives the profile to the profiles volume
+    agent_request = urllib.request.Request(
+        f"http://{pod.status.pod_ip}:{SESSION_AGENT_PORT}/hibernate", method="POST",
+        headers={"Authorization": f"Bearer {agent_token(pod_name)}"}
+    )
+    try:
+        with urllib.request.urlopen(agent_request, timeout=HIBERNATE_TIMEOUT_SECONDS) as response:
+            archive = json.load(response)
+    except urllib.error.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Session agent refused to hibernate: {e.read().decode(errors='replace')}")
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=502, detail=f"Session agent unreachable: {e}")
+
+    labels = pod.metadata.labels or {}
+    annotations = pod.metadata.annotations or {}
+    resources = pod.spec.containers[0].resources
+    # The service outlives the pod, so the VNC URL survives; it carries what resume needs
+    hibernation = {
+        "session-hibernated-at": str(int(time.time())),
+        "session-created-at": str(pod.metadata.creation_timestamp.timestamp()),
+        "chromium-version": annotations.get("chromium-version", "unknown"),
+        "session-owner": labels.get("owner", ""),
+        "session-profile": labels.get("session-profile", DEFAULT_PROFILE),
+        "session-vnc-profile": labels.get("vnc-profile", DEFAULT_VNC_PROFILE),
+        "session-expires-at": annotations.get("session-expires-at", ""),
+        "session-resources": json.dumps({"requests": resources.requests or {}, "limits": resources.limits or {}}),
+        "session-archive-bytes": str(archive["bytes"])
+    }
+    v1.patch_namespaced_service(
+        name=f"{pod_name}-vnc", namespace=namespace, body={"metadata": {"annotations": hibernation}}
+    )
+    v1.delete_namespaced_pod(name=pod_name, namespace=namespace)
+    session = sessions.get(namespace, pod_name) or {}
+    sessions.set_hibernated(namespace, pod_name, {
+        **session,
+        "namespace": namespace,
+        "pod_name": pod_name,
+        "owner": labels.get("owner"),
+        "version": hibernation["chromium-version"],
+        "state": "Hibernated",
+        "pod_ip": None
+    })
+    return archive
+
+@app.post("/pods/{namespace}/{pod_name}/hibernate")
+async def hibernate_pod(namespace: str, pod_name: str):
+    try:
+        archive = await asyncio.to_thread(hibernate_session, namespace, pod_name)
+    except ApiException as e:
+        raise HTTPException(status_code=404 if e.status == 404 else 500, detail=f"Failed to hibernate: {e.reason}")
+    return {
+        "pod_name": pod_name,
+        "status": "Hibernated",
+        "profile_bytes": archive["bytes"],
+        "archive_seconds": archive["seconds"],
+        "message": f"Resume with POST /pods/{namespace}/{pod_name}/resume"
+    }
+
+def resume_session(namespace: str, pod_name: str, annotations: dict, wait_seconds: int):
+    shard = placement.for_session(pod_name)
+    expires_at = annotations.get("session-expires-at")
+    resources = json.loads(annotations["session-resources"]) if annotations.get("session-resources") else None
+    pod_manifest = create_pod_manifest(
+        annotations["chromium-version"], namespace, pod_name, annotations.get("session-owner") or None,
+        float(expires_at) if expires_at else None, wait_seconds,
+        annotations.get("session-profile") or DEFAULT_PROFILE, resources, "hibernated",
+        annotations.get("session-vnc-profile") or DEFAULT_VNC_PROFILE
+    )
+    # Same name, so the existing service selects the new pod
+    shard.v1.create_namespaced_pod(namespace=namespace, body=pod_manifest)
+    sessions.upsert({
+        "namespace": namespace,
+        "pod_name": pod_name,
+        "owner": annotations.get("session-owner") or None,
+        "version": annotations["chromium-version"],
+        "state": "Pending",
+        "created_at": float(annotations.get("session-created-at") or time.time()),
+        "expires_at": float(expires_at) if expires_at else None,
+        "profile": annotations.get("session-profile") or DEFAULT_PROFILE,
+        "shard": shard.name
+    })
+    # A null in a merge patch removes the key
+    shard.v1.patch_namespaced_service(
+        name=f"{pod_name}-vnc", namespace=namespace,
+        body={"metadata": {"annotations": {
+            key: None for key in annotations
+            if key.startswith("session-") or key == "chromium-version"
+        }}}
+    )
+    sessions.set_hibernated(namespace, pod_name, None)
+
+@app.post("/pods/{namespace}/{pod_name}/resume", response_model=PodResponse)
+async def resume_pod(namespace: str, pod_name: str):
+    try:
+        service = await asyncio.to_thread(
+            placement.for_session(pod_name).v1.read_namespaced_service, name=f"{pod_name}-vnc", namespace=namespace
+        )
     except ApiException as e:
-        raise HTTPException(status_code=500, detail=f"Failed to list pods: {e.reason}")
+        raise HTTPException(status_code=404, detail=f"Session not found: {e.reason}")
+    annotations = service.metadata.annotations or {}
+    if "session-hibernated-at" not in annotations:
+        raise HTTPException(status_code=409, detail=f"Session {pod_name} is not hibernated")
+    version = annotations["chromium-version"]
+    owner = annotations.get("session-owner") or None
+    if owner and MAX_SESSIONS_PER_OWNER and sessions.count(owner=owner) >= MAX_SESSIONS_PER_OWNER:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Owner {owner} already has {MAX_SESSIONS_PER_OWNER} active sessions"
+        )
+
+    # The reconciler may have collected the version while the session slept
+    provisioning = placement.for_session(pod_name).versions is None and not provisioner.available(version)
+    if provisioning:
+        try:
+            await asyncio.to_thread(provisioner.request, version)
+        except ProvisioningFailed as e:
+            raise HTTPException(status_code=502, detail=str(e))
+        except ApiException as e:
+            raise HTTPException(status_code=500, detail=f"Failed to provision version: {e.reason}")
+    wait_seconds = PROVISION_WAIT_SECONDS if provisioning else 0
+
+    try:
+        async with admission.admit(owner or namespace) as ticket:
+            await asyncio.to_thread(resume_session, namespace, pod_name, annotations, wait_seconds)
+    except AdmissionRejected as e:
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(max(1, int(e.eta_seconds - admission.slo_seconds)))},
+            content={
+                "detail": f"Session creation backlog is past its SLO ({admission.slo_seconds:.0f}s). Retry later.",
+                "queue_position": e.position,
+                "eta_seconds": round(e.eta_seconds, 1)
+            }
+        )
+    except ApiException as e:
+        if e.status == 409:
+            raise HTTPException(status_code=409, detail=f"Pod {pod_name} is still shutting down; retry shortly")
+        raise HTTPException(status_code=500, detail=f"Failed to resume: {e.reason}")
+
+    return PodResponse(
+        pod_name=pod_name,
+        service_name=f"{pod_name}-vnc",
+        status="Provisioning" if provisioning else "Resuming",
+        chromium_version=version,
+        namespace=namespace,
+        message=f"Profile is restored on start. Check status with GET /pods/{namespace}/{pod_name}",
+        queue_position=ticket.position,
+        queue_wait_seconds=round(ticket.wait_seconds, 3)
+    )
+
+@app.get("/pods")
+async def list_pods(request: Request, namespace: str = "default", owner: Optional[str] = None,
+                    version: Optional[str] = None, state: Optional[str] = None,
+                    fields: Optional[str] = None):
+    # Unchanged registry and query: answered without touching the registry rows
+    etag = etag_for(sessions.revision(), namespace, owner, version, state, fields)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    # Served from the session registry; no API-server list per call
+    pod_list = []
+    for session in sessions.query(namespace=namespace, owner=owner, version=version, state=state):
+        pod_list.append({
+            "name": session["pod_name"],
+            "status": session["state"],
+            "chromium_version": session["version"],
+            "owner": session["owner"],
+            "created_at": str(datetime.fromtimestamp(session["created_at"], timezone.utc)),
+            "expires_at": session["expires_at"],
+            "vnc_url": session["vnc_url"] or "No service"
+        })
+
+    return ORJSONResponse({"count": len(pod_list), "pods": project(pod_list, fields)}, headers={"ETag": etag})
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,167 @@
+"""Session placement across cluster/namespace shards.
+
+Shards come from SHARDS_FILE, a JSON list such as
+
+    [{"name": "use1a", "namespace": "sessions", "max_sessions": 400},
+     {"name": "use1b", "kubeconfig": "/etc/chromium-shards/use1b.yaml", "context": "use1b",
+      "namespace": "sessions", "max_sessions": 400, "versions": ["120.0.6099.109"]}]
+
+A shard without a kubeconfig is the cluster the API runs in. The first shard is the
+default and owns session names created before sharding. Without SHARDS_FILE there is
+one in-cluster shard that uses the namespace each request names, as before.
+"""
+import json
+import os
+import re
+
+from kubernetes import client, config
+from prometheus_client import Counter
+
+from diagnostics import Diagnostics
+from registry import WATCH_NAMESPACES, RegistryWatcher
+
+SHARDS_FILE = os.environ.get("SHARDS_FILE", "/etc/chromium-shards/shards.json")
+# Concurrent HTTP connections per shard's API client
+CONNECTION_POOL_SIZE = int(os.environ.get("SHARD_CONNECTION_POOL_SIZE", "32"))
+LOCAL_SHARD = "local"
+
+# Shard names are embedded in session names, where they must not look like a version part
+SHARD_NAME_RE = re.compile(r"^[a-z][a-z0-9]{0,11}$")
+
+placements = Counter("chromium_placements_total", "Sessions placed per shard", ["shard", "reason"])
+
+
+class PlacementFull(Exception):
+    pass
+
+
+class Shard:
+    """One cluster/namespace backend with its own pooled API client"""
+
+    def __init__(self, name, api_client=None, namespace=None, max_sessions=0, versions=None, local=True):
+        self.name = name
+        # The cluster the API runs in, where headroom and image pre-pull apply
+        self.local = local
+        self.api_client = api_client
+        self.v1 = client.CoreV1Api(api_client)
+        self.diagnostics = Diagnostics(self.v1)
+        # None: the namespace named by the request
+        self.namespace = namespace
+        self.max_sessions = max_sessions
+        self.versions = set(versions) if versions is not None else None
+
+    def namespace_for(self, requested: str) -> str:
+        return self.namespace or requested
+
+    def serves(self, version: str) -> bool:
+        return self.versions is None or version in self.versions
+
+    def describe(self, load: int) -> dict:
+        return {
+            "name": self.name,
+            "namespace": self.namespace,
+            "max_sessions": self.max_sessions or None,
+            "sessions": load,
+            "versions": sorted(self.versions) if self.versions is not None else "any"
+        }
+
+
+def api_client_for(spec: dict):
+    configuration = client.Configuration()
+    if spec.get("kubeconfig"):
+        config.load_kube_config(
+            config_file=spec["kubeconfig"], context=spec.get("context"), client_configuration=configuration
+        )
+    else:
+        configuration = client.Configuration.get_default_copy()
+    configuration.connection_pool_maxsize = CONNECTION_POOL_SIZE
+    return client.ApiClient(configuration)
+
+
+def load_shards(path: str = SHARDS_FILE) -> list:
+    if not path or not os.path.exists(path):
+        return [Shard(LOCAL_SHARD, api_client_for({}))]
+    with open(path) as f:
+        specs = json.load(f)
+    shards = []
+    for spec in specs:
+        if not SHARD_NAME_RE.match(spec["name"]):
+            raise ValueError(f"Invalid shard name {spec['name']!r}: lowercase letters and digits, letter first")
+        shards.append(Shard(
+            spec["name"],
+            api_client_for(spec),
+            spec.get("namespace"),
+            spec.get("max_sessions", 0),
+            spec.get("versions"),
+            not spec.get("kubeconfig")
+        ))
+    if not shards:
+        raise ValueError(f"{path} defines no shards")
+    print(f"Placement: {len(shards)} shards: {', '.join(s.name for s in shards)}")
+    return shards
+
+
+class Placement:
+    """Chooses a shard for new sessions and routes existing ones by session name.
+
+    Session names end in -<shard>-<id> when more than one shard is configured. New
+    sessions go to a shard that serves the version and has room, preferring one that
+    already runs the version (warm nodes and page cache), then the most free capacity.
+    """
+
+    def __init__(self, shards: list, store):
+        self.shards = {s.name: s for s in shards}
+        self.default = shards[0]
+        self.store = store
+
+    def for_session(self, pod_name: str) -> Shard:
+        parts = pod_name.rsplit("-", 2)
+        return self.shards.get(parts[1], self.default) if len(parts) == 3 else self.default
+
+    def session_name(self, shard: Shard, version: str, suffix: str) -> str:
+        if len(self.shards) == 1:
+            return f"chromium-{version.replace('.', '-')}-{suffix}"
+        return f"chromium-{version.replace('.', '-')}-{shard.name}-{suffix}"
+
+    def in_namespace(self, namespace: str) -> list:
+        return [s for s in self.shards.values() if s.namespace in (None, namespace)]
+
+    def loads(self):
+        by_version = self.store.load()
+        totals = {}
+        for (shard, _), count in by_version.items():
+            totals[shard] = totals.get(shard, 0) + count
+        return totals, by_version
+
+    def choose(self, version: str) -> Shard:
+        totals, by_version = self.loads()
+
+        def free(shard):
+            if not shard.max_sessions:
+                return 1.0
+            return (shard.max_sessions - totals.get(shard.name, 0)) / shard.max_sessions
+
+        candidates = [s for s in self.shards.values() if s.serves(version) and free(s) > 0]
+        if not candidates:
+            raise PlacementFull(f"No shard has room for a Chromium {version} session")
+        shard = max(candidates, key=lambda s: (by_version.get((s.name, version), 0) > 0, free(s)))
+        placements.labels(
+            shard=shard.name,
+            reason="locality" if by_version.get((shard.name, version)) else "capacity"
+        ).inc()
+        return shard
+
+    def watchers(self, on_local_created=None) -> list:
+        return [
+            RegistryWatcher(
+                self.store, shard.v1,
+                [shard.namespace] if shard.namespace else WATCH_NAMESPACES,
+                shard.name,
+                on_local_created if shard.local else None
+            )
+            for shard in self.shards.values()
+        ]
+
+    def status(self) -> dict:
+        totals, _ = self.loads()
+        return {"shards": [s.describe(totals.get(s.name, 0)) for s in self.shards.values()]}
@@ -0,0 +1,162 @@
+import os
+import re
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+from prometheus_client import Counter
+
+# The versions volume, mounted read-only: a version is servable once the downloader
+# has published its image index there
+VERSIONS_PATH = os.environ.get("CHROMIUM_VERSIONS_PATH", "/opt/chromium-versions")
+ON_DEMAND_ENABLED = os.environ.get("ON_DEMAND_VERSIONS", "1") == "1"
+PROVISION_NAMESPACE = os.environ.get("PROVISION_NAMESPACE", "default")
+DOWNLOADER_IMAGE = os.environ.get(
+    "DOWNLOADER_IMAGE",
+    f"{os.environ.get('ECR_REGISTRY', 'your-account.dkr.ecr.us-east-1.amazonaws.com')}/chromium-downloader:latest"
+)
+SNAPSHOT_MIRROR = os.environ.get("SNAPSHOT_MIRROR", "")
+# How long a session's init container waits for its version to be published
+PROVISION_WAIT_SECONDS = int(os.environ.get("PROVISION_WAIT_SECONDS", "900"))
+JOB_TTL_SECONDS = int(os.environ.get("PROVISION_JOB_TTL_SECONDS", "300"))
+
+VERSION_RE = re.compile(r"^\d+\.\d+\.\d+\.\d+$")
+
+provision_requests = Counter(
+    "chromium_provision_requests_total", "On-demand version fetches", ["result"]
+)
+
+
+class ProvisioningFailed(Exception):
+    pass
+
+
+def job_name(version: str) -> str:
+    # Deterministic, so concurrent requests on any replica collide on create
+    return f"chromium-fetch-{version.replace('.', '-')}"
+
+
+class VersionProvisioner:
+    """Fetches missing Chromium versions with one downloader Job per version.
+
+    The Job runs the downloader image with --version, so the fetch, delta and
+    image publishing logic is the same code path as the full sync. Sessions for
+    the version are created right away; their init container waits for the
+    image index to appear.
+    """
+
+    def __init__(self, batch_api=None, static_versions=()):
+        self.batch = batch_api or client.BatchV1Api()
+        self.static_versions = set(static_versions)
+
+    def index_path(self, version: str) -> str:
+        return os.path.join(VERSIONS_PATH, ".images", f"{version}.index.json")
+
+    def available(self, version: str) -> bool:
+        # Not cached: the reconciler garbage-collects versions that are no longer wanted
+        return version in self.static_versions or os.path.exists(self.index_path(version))
+
+    def versions(self) -> list:
+        images = os.path.join(VERSIONS_PATH, ".images")
+        try:
+            names = os.listdir(images)
+        except OSError:
+            names = []
+        on_disk = {n[:-len(".index.json")] for n in names if n.endswith(".index.json")}
+        return sorted(
+            self.static_versions | on_disk,
+            key=lambda v: [int(p) if p.isdigit() else 0 for p in v.split(".")],
+            reverse=True
+        )
+
+    def can_provision(self, version: str) -> bool:
+        return ON_DEMAND_ENABLED and bool(VERSION_RE.match(version))
+
+    def job_manifest(self, version: str) -> dict:
+        env = [{"name": "SNAPSHOT_MIRROR", "value": SNAPSHOT_MIRROR}] if SNAPSHOT_MIRROR else []
+        return {
+            "apiVersion": "batch/v1",
+            "kind": "Job",
+            "metadata": {
+                "name": job_name(version),
+                "namespace": PROVISION_NAMESPACE,
+                "labels": {
+                    "app": "chromium-downloader",
+                    "chromium-version": version.replace(".", "-")
+                },
+                "annotations": {"chromium-version": version}
+            },
+            "spec": {
+                "backoffLimit": 2,
+                "ttlSecondsAfterFinished": JOB_TTL_SECONDS,
+                "template": {
+                    "metadata": {"labels": {"app": "chromium-downloader"}},
+                    "spec": {
+                        "containers": [{
+                            "name": "downloader",
+                            "image": DOWNLOADER_IMAGE,
+                            "imagePullPolicy": "Always",
+                            "command": ["python3", "download-chromium.py"],
+                            "args": ["--version", version],
+                            "env": env,
+                            "volumeMounts": [{
+                                "name": "chromium-storage",
+                                "mountPath": "/opt/chromium-versions"
+                            }],
+                            "resources": {
+                                "requests": {"memory": "2Gi", "cpu": "1000m"},
+                                "limits": {"memory": "4Gi", "cpu": "2000m"}
+                            }
+                        }],
+                        "volumes": [{
+                            "name": "chromium-storage",
+                            "persistentVolumeClaim": {"claimName": "chromium-versions-pvc"}
+                        }],
+                        "restartPolicy": "Never"
+                    }
+                }
+            }
+        }
+
+    def request(self, version: str) -> str:
+        """Make sure a fetch Job for version exists; returns "created" or "in_progress".
+
+        Raises ProvisioningFailed if the last Job for the version failed and has not
+        been cleaned up yet.
+        """
+        try:
+            self.batch.create_namespaced_job(namespace=PROVISION_NAMESPACE, body=self.job_manifest(version))
+            print(f"Provisioning Chromium {version} with Job {job_name(version)}")
+            provision_requests.labels(result="created").inc()
+            return "created"
+        except ApiException as e:
+            if e.status != 409:
+                raise
+        # Another request (here or on another replica) already started it
+        status = self.status(version)
+        if status["state"] == "failed":
+            provision_requests.labels(result="failed").inc()
+            raise ProvisioningFailed(
+                f"Fetching Chromium {version} failed; Job {job_name(version)} is kept for "
+                f"{JOB_TTL_SECONDS}s for inspection"
+            )
+        provision_requests.labels(result="deduplicated").inc()
+        return "in_progress"
+
+    def status(self, version: str) -> dict:
+        if self.available(version):
+            return {"version": version, "state": "available", "job": None}
+        try:
+            job = self.batch.read_namespaced_job(name=job_name(version), namespace=PROVISION_NAMESPACE)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            return {"version": version, "state": "missing", "job": None}
+        conditions = {c.type: c.status for c in job.status.conditions or []}
+        if conditions.get("Failed") == "True":
+            state = "failed"
+        elif conditions.get("Complete") == "True":
+            # Finished, but the index is not visible on this mount yet
+            state = "publishing"
+        else:
+            state = "downloading"
+        return {"version": version, "state": state, "job": job.metadata.name}
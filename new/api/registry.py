@@ -0,0 +1,445 @@
+"""Session registry: an indexed local view of chromium-runner pods.
+
+The API server stays the source of truth. Every replica keeps its own store, fed by a
+pod/service watch plus write-through on create/delete, so replicas agree within watch
+latency without sharing a database file (SQLite over EFS/NFS is not safe).
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from kubernetes import client, watch
+from kubernetes.client.rest import ApiException
+
+SESSION_STORE = os.environ.get("SESSION_STORE", "sqlite:///var/lib/chromium-api/sessions.db")
+WATCH_NAMESPACES = [n for n in os.environ.get("WATCH_NAMESPACES", "default").split(",") if n]
+
+ACTIVE_STATES = ("Pending", "Running")
+
+COLUMNS = (
+    "namespace", "pod_name", "owner", "version", "state",
+    "created_at", "expires_at", "pod_ip", "profile", "shard"
+)
+TABLE_COLUMNS = {
+    "sessions": COLUMNS,
+    "hibernated": COLUMNS,
+    "vnc_services": ("namespace", "pod_name", "vnc_url", "shard")
+}
+
+
+class SessionStore(ABC):
+    """Backend interface; rows are plain dicts keyed by COLUMNS plus vnc_url.
+
+    Hibernated sessions have no pod; they come from their annotated VNC service and
+    are listed with state "Hibernated" until a pod with the same name exists again.
+    """
+
+    @abstractmethod
+    def upsert(self, session: dict):
+        ...
+
+    @abstractmethod
+    def update(self, namespace: str, pod_name: str, **fields):
+        ...
+
+    @abstractmethod
+    def set_vnc_url(self, namespace: str, pod_name: str, vnc_url: Optional[str], shard: Optional[str] = None):
+        ...
+
+    @abstractmethod
+    def delete(self, namespace: str, pod_name: str):
+        ...
+
+    @abstractmethod
+    def set_hibernated(self, namespace: str, pod_name: str, session: Optional[dict]):
+        ...
+
+    @abstractmethod
+    def replace_namespace(self, namespace: str, sessions: list, shard: Optional[str] = None):
+        """Replace one shard's view of a namespace; other shards may use the same name"""
+
+    @abstractmethod
+    def replace_services(self, namespace: str, vnc_urls: dict, hibernated: list, shard: Optional[str] = None):
+        """Replace one shard's VNC URLs (keyed by pod name) and hibernated sessions in a namespace"""
+
+    @abstractmethod
+    def get(self, namespace: str, pod_name: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def query(self, namespace=None, owner=None, version=None, state=None,
+              expires_before=None, created_before=None, limit=None) -> list:
+        ...
+
+    @abstractmethod
+    def count(self, owner=None, states=ACTIVE_STATES) -> int:
+        ...
+
+    @abstractmethod
+    def load(self, states=ACTIVE_STATES) -> dict:
+        """Session counts keyed by (shard, version)"""
+
+    @abstractmethod
+    def revision(self) -> int:
+        """Fingerprint of the stored rows: it changes only when a row does, and replicas
+        holding the same rows agree on it, so equal revisions mean equal query results"""
+
+
+class SQLiteSessionStore(SessionStore):
+    SELECT = (
+        f"SELECT s.*, v.vnc_url FROM ("
+        f"SELECT {', '.join(COLUMNS)} FROM sessions "
+        f"UNION ALL "
+        f"SELECT {', '.join('h.' + c for c in COLUMNS)} FROM hibernated h WHERE NOT EXISTS "
+        f"(SELECT 1 FROM sessions p WHERE p.namespace = h.namespace AND p.pod_name = h.pod_name)"
+        f") s "
+        "LEFT JOIN vnc_services v ON v.namespace = s.namespace AND v.pod_name = s.pod_name"
+    )
+
+    def __init__(self, path: str):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                namespace TEXT NOT NULL,
+                pod_name TEXT NOT NULL,
+                owner TEXT,
+                version TEXT,
+                state TEXT,
+                created_at REAL,
+                expires_at REAL,
+                pod_ip TEXT,
+                profile TEXT,
+                shard TEXT,
+                PRIMARY KEY (namespace, pod_name)
+            );
+            CREATE TABLE IF NOT EXISTS hibernated (
+                namespace TEXT NOT NULL,
+                pod_name TEXT NOT NULL,
+                owner TEXT,
+                version TEXT,
+                state TEXT,
+                created_at REAL,
+                expires_at REAL,
+                pod_ip TEXT,
+                profile TEXT,
+                shard TEXT,
+                PRIMARY KEY (namespace, pod_name)
+            );
+            CREATE TABLE IF NOT EXISTS vnc_services (
+                namespace TEXT NOT NULL,
+                pod_name TEXT NOT NULL,
+                vnc_url TEXT,
+                shard TEXT,
+                PRIMARY KEY (namespace, pod_name)
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_owner ON sessions (owner, state);
+            CREATE INDEX IF NOT EXISTS idx_sessions_version ON sessions (version, state);
+            CREATE INDEX IF NOT EXISTS idx_sessions_state ON sessions (state);
+            CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)
+                WHERE expires_at IS NOT NULL;
+        """)
+        # Stores created before the profile and shard columns existed
+        for table in TABLE_COLUMNS:
+            columns = {row["name"] for row in self.db.execute(f"PRAGMA table_info({table})")}
+            for column in set(TABLE_COLUMNS[table]) & {"profile", "shard"}:
+                if column not in columns:
+                    self.db.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+        self.fingerprint = 0
+        for table, columns in TABLE_COLUMNS.items():
+            for row in self.db.execute(f"SELECT {', '.join(columns)} FROM {table}"):
+                self.fingerprint ^= self._row_hash(table, tuple(row))
+
+    @staticmethod
+    def _row_hash(table, values) -> int:
+        return int.from_bytes(hashlib.blake2b(repr((table, values)).encode(), digest_size=8).digest(), "big")
+
+    def _read(self, table, namespace, pod_name):
+        row = self.db.execute(
+            f"SELECT {', '.join(TABLE_COLUMNS[table])} FROM {table} WHERE namespace = ? AND pod_name = ?",
+            (namespace, pod_name)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def _write(self, table, namespace, pod_name, row):
+        """Insert, replace or (row None) delete one row; a no-op when nothing differs.
+
+        Caller holds the lock. The fingerprint is XORed out for the old row and in for
+        the row as stored, so it does not depend on the order of writes.
+        """
+        columns = TABLE_COLUMNS[table]
+        old = self._read(table, namespace, pod_name)
+        if row is None:
+            if old is None:
+                return
+            self.db.execute(f"DELETE FROM {table} WHERE namespace = ? AND pod_name = ?", (namespace, pod_name))
+            self.fingerprint ^= self._row_hash(table, old)
+            return
+        values = {**{c: row.get(c) for c in columns}, "namespace": namespace, "pod_name": pod_name}
+        if old == tuple(values[c] for c in columns):
+            return
+        self.db.execute(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})",
+            values
+        )
+        if old is not None:
+            self.fingerprint ^= self._row_hash(table, old)
+        # As read back: SQLite may store a value in another type (5 as 5.0 in a REAL column)
+        self.fingerprint ^= self._row_hash(table, self._read(table, namespace, pod_name))
+
+    def upsert(self, session):
+        with self.lock:
+            self._write("sessions", session["namespace"], session["pod_name"], session)
+
+    def update(self, namespace, pod_name, **fields):
+        fields = {c: v for c, v in fields.items() if c in COLUMNS}
+        if not fields:
+            return
+        with self.lock:
+            old = self._read("sessions", namespace, pod_name)
+            if old is not None:
+                self._write("sessions", namespace, pod_name, {**dict(zip(COLUMNS, old)), **fields})
+
+    def set_vnc_url(self, namespace, pod_name, vnc_url, shard=None):
+        with self.lock:
+            self._write(
+                "vnc_services", namespace, pod_name, None if vnc_url is None else {"vnc_url": vnc_url, "shard": shard}
+            )
+
+    def delete(self, namespace, pod_name):
+        with self.lock:
+            self._write("sessions", namespace, pod_name, None)
+
+    def set_hibernated(self, namespace, pod_name, session):
+        with self.lock:
+            self._write("hibernated", namespace, pod_name, session)
+
+    def _replace(self, table, namespace, rows, shard):
+        """Write rows (keyed by pod name) and delete the shard's others; caller holds the lock"""
+        stale = {
+            pod_name for (pod_name,) in self.db.execute(
+                f"SELECT pod_name FROM {table} WHERE namespace = ? AND shard IS ?", (namespace, shard)
+            )
+        }
+        for pod_name, row in rows.items():
+            stale.discard(pod_name)
+            self._write(table, namespace, pod_name, row)
+        for pod_name in stale:
+            self._write(table, namespace, pod_name, None)
+
+    def _transaction(self, writes):
+        with self.lock:
+            fingerprint = self.fingerprint
+            self.db.execute("BEGIN")
+            try:
+                writes()
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                self.fingerprint = fingerprint
+                raise
+
+    def replace_namespace(self, namespace, sessions, shard=None):
+        self._transaction(lambda: self._replace(
+            "sessions", namespace, {session["pod_name"]: session for session in sessions}, shard
+        ))
+
+    def replace_services(self, namespace, vnc_urls, hibernated, shard=None):
+        def writes():
+            self._replace(
+                "vnc_services", namespace,
+                {pod_name: {"vnc_url": vnc_url, "shard": shard} for pod_name, vnc_url in vnc_urls.items()}, shard
+            )
+            self._replace("hibernated", namespace, {session["pod_name"]: session for session in hibernated}, shard)
+        self._transaction(writes)
+
+    def revision(self):
+        with self.lock:
+            return self.fingerprint
+
+    def get(self, namespace, pod_name):
+        with self.lock:
+            row = self.db.execute(
+                f"{self.SELECT} WHERE s.namespace = ? AND s.pod_name = ?", (namespace, pod_name)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def query(self, namespace=None, owner=None, version=None, state=None,
+              expires_before=None, created_before=None, limit=None):
+        clauses, params = [], []
+        for column, value in (("namespace", namespace), ("owner", owner),
+                              ("version", version), ("state", state)):
+            if value is not None:
+                clauses.append(f"s.{column} = ?")
+                params.append(value)
+        if expires_before is not None:
+            clauses.append("s.expires_at IS NOT NULL AND s.expires_at < ?")
+            params.append(expires_before)
+        if created_before is not None:
+            clauses.append("s.created_at < ?")
+            params.append(created_before)
+        sql = self.SELECT
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY s.created_at"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self.lock:
+            return [dict(r) for r in self.db.execute(sql, params)]
+
+    def count(self, owner=None, states=ACTIVE_STATES):
+        sql = f"SELECT COUNT(*) FROM sessions WHERE state IN ({', '.join('?' for _ in states)})"
+        params = list(states)
+        if owner is not None:
+            sql += " AND owner = ?"
+            params.append(owner)
+        with self.lock:
+            return self.db.execute(sql, params).fetchone()[0]
+
+    def load(self, states=ACTIVE_STATES):
+        sql = (
+            f"SELECT shard, version, COUNT(*) FROM sessions "
+            f"WHERE state IN ({', '.join('?' for _ in states)}) GROUP BY shard, version"
+        )
+        with self.lock:
+            return {(shard, version): n for shard, version, n in self.db.execute(sql, list(states))}
+
+
+def open_store(url: str = SESSION_STORE) -> SessionStore:
+    if url.startswith("sqlite://"):
+        return SQLiteSessionStore(url[len("sqlite://"):] or ":memory:")
+    raise ValueError(f"Unsupported SESSION_STORE backend: {url}")
+
+
+def session_from_pod(pod) -> dict:
+    labels = pod.metadata.labels or {}
+    annotations = pod.metadata.annotations or {}
+    state = "Terminating" if pod.metadata.deletion_timestamp else pod.status.phase
+    expires_at = annotations.get("session-expires-at")
+    return {
+        "namespace": pod.metadata.namespace,
+        "pod_name": pod.metadata.name,
+        "owner": labels.get("owner"),
+        "version": annotations.get("chromium-version", "unknown"),
+        "state": state,
+        "created_at": pod.metadata.creation_timestamp.timestamp() if pod.metadata.creation_timestamp else time.time(),
+        "expires_at": float(expires_at) if expires_at else None,
+        "pod_ip": pod.status.pod_ip,
+        "profile": labels.get("session-profile")
+    }
+
+
+def hibernated_from_service(service) -> Optional[dict]:
+    """Session row for a hibernated session, from the annotations on its VNC service"""
+    annotations = service.metadata.annotations or {}
+    hibernated_at = annotations.get("session-hibernated-at")
+    if not hibernated_at:
+        return None
+    expires_at = annotations.get("session-expires-at")
+    return {
+        "namespace": service.metadata.namespace,
+        "pod_name": service.metadata.name[:-len("-vnc")],
+        "owner": annotations.get("session-owner") or None,
+        "version": annotations.get("chromium-version", "unknown"),
+        "state": "Hibernated",
+        "created_at": float(annotations.get("session-created-at", hibernated_at)),
+        "expires_at": float(expires_at) if expires_at else None,
+        "pod_ip": None,
+        "profile": annotations.get("session-profile") or None
+    }
+
+
+def vnc_url_from_service(service) -> str:
+    ingress = service.status.load_balancer.ingress if service.status.load_balancer else None
+    if ingress:
+        return f"http://{ingress[0].hostname}/vnc.html"
+    return "LoadBalancer provisioning... (wait 2-3 minutes)"
+
+
+class RegistryWatcher:
+    """Keeps a SessionStore in sync with pods and VNC services in the watched namespaces."""
+
+    def __init__(self, store: SessionStore, core_api=None, namespaces=WATCH_NAMESPACES, shard=None,
+                 on_created=None):
+        self.store = store
+        # Called from the watch thread for every new pod, on whichever replica created it
+        self.on_created = on_created
+        self.core = core_api or client.CoreV1Api()
+        self.namespaces = namespaces
+        # Stamped on every row, so each cluster's relist only replaces its own sessions
+        self.shard = shard
+
+    def start(self):
+        for namespace in self.namespaces:
+            for target in (self._watch_pods, self._watch_services):
+                threading.Thread(target=self._loop, args=(target, namespace), daemon=True).start()
+
+    def _loop(self, target, namespace):
+        while True:
+            try:
+                target(namespace)
+            except Exception as e:
+                print(f"Registry: {target.__name__} in {namespace} restarting after error: {e}")
+                time.sleep(2)
+
+    def _watch_pods(self, namespace):
+        pods = self.core.list_namespaced_pod(namespace=namespace, label_selector="app=chromium-runner")
+        self.store.replace_namespace(
+            namespace, [{**session_from_pod(p), "shard": self.shard} for p in pods.items], self.shard
+        )
+        self._stream(
+            self.core.list_namespaced_pod, namespace, "app=chromium-runner",
+            pods.metadata.resource_version, self._on_pod
+        )
+
+    def _watch_services(self, namespace):
+        services = self.core.list_namespaced_service(namespace=namespace, label_selector="app=chromium-vnc-service")
+        hibernated = [hibernated_from_service(s) for s in services.items]
+        self.store.replace_services(
+            namespace,
+            {s.metadata.name[:-len("-vnc")]: vnc_url_from_service(s) for s in services.items},
+            [{**h, "shard": self.shard} for h in hibernated if h],
+            self.shard
+        )
+        self._stream(
+            self.core.list_namespaced_service, namespace, "app=chromium-vnc-service",
+            services.metadata.resource_version, self._on_service
+        )
+
+    def _stream(self, list_fn, namespace, selector, resource_version, handler):
+        w = watch.Watch()
+        try:
+            for event in w.stream(list_fn, namespace=namespace, label_selector=selector,
+                                  resource_version=resource_version, timeout_seconds=300):
+                handler(event["type"], event["object"])
+        except ApiException as e:
+            # 410 Gone: our resourceVersion expired; the caller relists
+            if e.status != 410:
+                raise
+
+    def _on_pod(self, event_type, pod):
+        if event_type == "DELETED":
+            self.store.delete(pod.metadata.namespace, pod.metadata.name)
+        else:
+            session = {**session_from_pod(pod), "shard": self.shard}
+            self.store.upsert(session)
+            if event_type == "ADDED" and self.on_created:
+                self.on_created(session)
+
+    def _on_service(self, event_type, service):
+        pod_name = service.metadata.name[:-len("-vnc")]
+        vnc_url = None if event_type == "DELETED" else vnc_url_from_service(service)
+        self.store.set_vnc_url(service.metadata.namespace, pod_name, vnc_url, self.shard)
+        hibernated = None if event_type == "DELETED" else hibernated_from_service(service)
+        if hibernated:
+            hibernated["shard"] = self.shard
+        self.store.set_hibernated(service.metadata.namespace, pod_name, hibernated)
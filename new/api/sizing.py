@@ -0,0 +1,266 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import defaultdict, deque
+
+from prometheus_client import Gauge
+
+# off: always DEFAULT_RESOURCES; recommend: report only; auto: apply to new sessions
+SIZING_MODE = os.environ.get("SIZING_MODE", "auto")
+SAMPLE_INTERVAL_SECONDS = int(os.environ.get("SIZING_SAMPLE_INTERVAL_SECONDS", "60"))
+HISTORY_SAMPLES = int(os.environ.get("SIZING_HISTORY_SAMPLES", "5000"))
+# A recommendation is only trusted once this much history exists for its key
+MIN_SAMPLES = int(os.environ.get("SIZING_MIN_SAMPLES", "60"))
+MIN_SESSIONS = int(os.environ.get("SIZING_MIN_SESSIONS", "3"))
+REQUEST_PERCENTILE = float(os.environ.get("SIZING_REQUEST_PERCENTILE", "90"))
+LIMIT_PERCENTILE = float(os.environ.get("SIZING_LIMIT_PERCENTILE", "99"))
+MARGIN = float(os.environ.get("SIZING_MARGIN", "1.2"))
+# Limits absorb spikes (page loads, devtools) past the percentile the request covers
+LIMIT_MARGIN = float(os.environ.get("SIZING_LIMIT_MARGIN", "1.5"))
+CPU_LIMIT_RATIO = float(os.environ.get("SIZING_CPU_LIMIT_RATIO", "4"))
+
+MIB = 1024 * 1024
+# The agent measures Chrome's process tree; Xvfb, x11vnc, noVNC and supervisord share the container
+OVERHEAD_BYTES = int(os.environ.get("SIZING_OVERHEAD_MIB", "256")) * MIB
+# Guard rails: (min, max) for requests and limits, in bytes and cores
+MEMORY_BOUNDS = (
+    int(os.environ.get("SIZING_MIN_MEMORY_MIB", "256")) * MIB,
+    int(os.environ.get("SIZING_MAX_MEMORY_MIB", "8192")) * MIB
+)
+CPU_BOUNDS = (
+    float(os.environ.get("SIZING_MIN_CPU", "0.1")),
+    float(os.environ.get("SIZING_MAX_CPU", "4"))
+)
+
+DEFAULT_RESOURCES = {
+    "requests": {"memory": "1Gi", "cpu": "500m"},
+    "limits": {"memory": "4Gi", "cpu": "2000m"}
+}
+DEFAULT_PROFILE = "default"
+# The profile is a pod label, a history key and a metric label, so only these names
+# are kept apart; anything else is sized as DEFAULT_PROFILE
+SESSION_PROFILES = sorted({DEFAULT_PROFILE, *(p for p in os.environ.get("SESSION_PROFILES", "").split(",") if p)})
+# On the profiles volume every replica mounts: each replica writes the samples it took
+# to <identity>.json and sizes from all the files, so recommendations cover every
+# session rather than the replica's share of the hash ring
+HISTORY_PATH = os.environ.get("SIZING_HISTORY_PATH", "/mnt/profiles/.sizing")
+# History files of replicas gone for this long are deleted
+HISTORY_MAX_AGE_SECONDS = int(os.environ.get("SIZING_HISTORY_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+
+recommended_memory = Gauge(
+    "chromium_sizing_recommended_memory_bytes", "Recommended memory request", ["version", "profile"]
+)
+recommended_cpu = Gauge(
+    "chromium_sizing_recommended_cpu_cores", "Recommended CPU request", ["version", "profile"]
+)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def clamp(value, bounds):
+    return min(max(value, bounds[0]), bounds[1])
+
+
+def memory_quantity(value: float) -> str:
+    return f"{math.ceil(value / MIB)}Mi"
+
+
+def cpu_quantity(value: float) -> str:
+    return f"{math.ceil(value * 1000)}m"
+
+
+def known_profile(profile):
+    return profile if profile in SESSION_PROFILES else DEFAULT_PROFILE
+
+
+def cpu_rate(previous, current):
+    """Cores used between two (pid, cpu_seconds, sampled_at) marks, or None"""
+    if not previous or previous[0] != current[0] or current[2] <= previous[2]:
+        # First sample, or Chrome restarted and its counters began again
+        return None
+    return max(0.0, (current[1] - previous[1]) / (current[2] - previous[2]))
+
+
+class SizingRecommender:
+    """Percentile-based requests/limits per (version, profile), learned from session agents.
+
+    Every SAMPLE_INTERVAL_SECONDS the agent's /stats of each running session is
+    sampled for Chrome's RSS and CPU; CPU is the rate between a pod's successive
+    cpu_seconds readings, so the first sample of a pod has no CPU value. Requests
+    cover REQUEST_PERCENTILE of samples with MARGIN on top, memory limits
+    LIMIT_PERCENTILE with LIMIT_MARGIN, all clamped to the guard rails. Keys without
+    enough history fall back to the profile across versions, then to DEFAULT_RESOURCES.
+
+    Each replica samples its share of sessions, and the shares are merged through
+    HISTORY_PATH after every round, which also keeps the history across restarts.
+    """
+
+    def __init__(self, store, fetch_stats, mode=SIZING_MODE, owns=lambda key: True,
+                 identity="local", history_path=HISTORY_PATH):
+        self.store = store
+        self.fetch_stats = fetch_stats
+        self.mode = mode
+        self.owns = owns
+        self.history_file = os.path.join(history_path, f"{identity}.json") if history_path else None
+        # The samples this replica took, and those merged with every replica's file
+        self.samples = defaultdict(lambda: deque(maxlen=HISTORY_SAMPLES))
+        self.merged = {}
+        # pod -> (chrome pid, cpu_seconds, sampled_at) from its previous sample
+        self.cpu_marks = {}
+        self.last_run = None
+
+    def record(self, version, profile, pod_name, rss_bytes, cpu_cores):
+        profile = known_profile(profile)
+        for key in ((version, profile), (None, profile)):
+            self.samples[key].append((pod_name, rss_bytes + OVERHEAD_BYTES, cpu_cores))
+
+    def sessions(self, key):
+        return len({pod for pod, _, _ in self.merged.get(key, ())})
+
+    def _compute(self, key):
+        samples = self.merged.get(key)
+        if not samples or len(samples) < MIN_SAMPLES or self.sessions(key) < MIN_SESSIONS:
+            return None
+        memory = [m for _, m, _ in samples]
+        cpu = [c for _, _, c in samples if c is not None]
+        memory_request = clamp(percentile(memory, REQUEST_PERCENTILE) * MARGIN, MEMORY_BOUNDS)
+        memory_limit = clamp(max(percentile(memory, LIMIT_PERCENTILE) * LIMIT_MARGIN, memory_request), MEMORY_BOUNDS)
+        cpu_request = clamp(percentile(cpu, REQUEST_PERCENTILE) * MARGIN if cpu else CPU_BOUNDS[0], CPU_BOUNDS)
+        cpu_limit = clamp(cpu_request * CPU_LIMIT_RATIO, CPU_BOUNDS)
+        return {
+            "requests": {"memory": memory_quantity(memory_request), "cpu": cpu_quantity(cpu_request)},
+            "limits": {"memory": memory_quantity(memory_limit), "cpu": cpu_quantity(cpu_limit)}
+        }, memory_request, cpu_request
+
+    def recommend(self, version, profile=DEFAULT_PROFILE) -> dict:
+        profile = known_profile(profile)
+        for key, basis in (((version, profile), "version"), ((None, profile), "profile")):
+            result = self._compute(key)
+            if result:
+                resources, memory, cpu = result
+                if basis == "version":
+                    # Only versions sessions ran, not whatever a caller asked about
+                    recommended_memory.labels(version=version, profile=profile).set(memory)
+                    recommended_cpu.labels(version=version, profile=profile).set(cpu)
+                return {
+                    "resources": resources,
+                    "basis": basis,
+                    "samples": len(self.merged[key]),
+                    "sessions": self.sessions(key)
+                }
+        return {
+            "resources": DEFAULT_RESOURCES,
+            "basis": "default",
+            "samples": len(self.merged.get((version, profile), ())),
+            "sessions": self.sessions((version, profile))
+        }
+
+    def resources_for(self, version, profile=DEFAULT_PROFILE, override=None):
+        """(resources, source) for a new session manifest"""
+        if override:
+            return override, "override"
+        if self.mode != "auto":
+            return DEFAULT_RESOURCES, "default"
+        recommendation = self.recommend(version, profile)
+        source = "recommended" if recommendation["basis"] != "default" else "default"
+        return recommendation["resources"], source
+
+    def status(self):
+        keys = sorted(
+            (k for k in self.merged if k[0] is not None),
+            key=lambda k: (k[1], k[0])
+        )
+        return {
+            "mode": self.mode,
+            "last_sample_at": self.last_run,
+            "defaults": DEFAULT_RESOURCES,
+            "recommendations": [
+                {"version": version, "profile": profile, **self.recommend(version, profile)}
+                for version, profile in keys
+            ]
+        }
+
+    async def sample(self):
+        running = [
+            s for s in self.store.query(state="Running")
+            if s.get("pod_ip") and self.owns(f"{s['namespace']}/{s['pod_name']}")
+        ]
+        stats = await asyncio.gather(*(asyncio.to_thread(self.fetch_stats, s["pod_ip"]) for s in running))
+        marks = {}
+        for session, stat in zip(running, stats):
+            chrome = stat and stat.get("chrome")
+            if not chrome or not chrome.get("running"):
+                continue
+            pod = f"{session['namespace']}/{session['pod_name']}"
+            marks[pod] = (chrome["pid"], chrome["cpu_seconds"], chrome["sampled_at"])
+            cpu = cpu_rate(self.cpu_marks.get(pod), marks[pod])
+            self.record(session["version"], session.get("profile") or DEFAULT_PROFILE,
+                        session["pod_name"], chrome["rss_bytes"], cpu)
+        # Pods that stopped or moved to another replica drop out here
+        self.cpu_marks = marks
+        own = {key: list(samples) for key, samples in self.samples.items()}
+        self.merged = await asyncio.to_thread(self.share_history, own)
+        self.last_run = time.time()
+
+    def share_history(self, own):
+        """Write this replica's samples and return them merged with every other replica's"""
+        merged = defaultdict(list)
+        for key, samples in own.items():
+            merged[key].extend(samples)
+        if not self.history_file:
+            return dict(merged)
+        directory = os.path.dirname(self.history_file)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(f"{self.history_file}.tmp", "w") as f:
+                json.dump([[version, profile, samples] for (version, profile), samples in own.items()], f)
+            os.replace(f"{self.history_file}.tmp", self.history_file)
+            names = os.listdir(directory)
+        except OSError as e:
+            print(f"Sizing: cannot share history in {directory}: {e}")
+            return dict(merged)
+        for name in names:
+            path = os.path.join(directory, name)
+            if not name.endswith(".json") or path == self.history_file:
+                continue
+            try:
+                if time.time() - os.path.getmtime(path) > HISTORY_MAX_AGE_SECONDS:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    for version, profile, samples in json.load(f):
+                        if profile in SESSION_PROFILES:
+                            merged[(version, profile)].extend(tuple(s) for s in samples)
+            except (OSError, ValueError, TypeError) as e:
+                # Another replica may be replacing or removing it right now
+                print(f"Sizing: skipping history {name}: {e}")
+        return dict(merged)
+
+    def load_history(self):
+        """Pick up this replica's own samples after a container restart"""
+        try:
+            with open(self.history_file) as f:
+                for version, profile, samples in json.load(f):
+                    if profile in SESSION_PROFILES:
+                        self.samples[(version, profile)].extend(tuple(s) for s in samples)
+        except (OSError, ValueError, TypeError):
+            pass
+
+    async def run(self):
+        if self.mode == "off":
+            return
+        if self.history_file:
+            await asyncio.to_thread(self.load_history)
+        while True:
+            try:
+                await self.sample()
+            except Exception as e:
+                print(f"Sizing: sampling failed: {e}")
+            await asyncio.sleep(SAMPLE_INTERVAL_SECONDS)
@@ -0,0 +1,105 @@
+"""In-memory stand-in for a shard's CoreV1Api, for exercising placement without a cluster.
+
+Pods and services created through it are kept as kubernetes model objects, so
+registry.session_from_pod reads them the way the watchers do. A backend marked
+unavailable fails every call like an unreachable API server.
+"""
+import itertools
+from datetime import datetime, timezone
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+
+from diagnostics import Diagnostics
+from placement import Shard
+from registry import session_from_pod
+
+
+class FakeCoreV1Api:
+    def __init__(self):
+        self.pods = {}
+        self.services = {}
+        self.available = True
+        self.ips = (f"10.0.0.{i}" for i in itertools.count(1))
+
+    def _check(self):
+        if not self.available:
+            raise ApiException(status=503, reason="Service Unavailable")
+
+    @staticmethod
+    def _metadata(namespace, body):
+        metadata = body["metadata"]
+        return client.V1ObjectMeta(
+            name=metadata["name"],
+            namespace=namespace,
+            labels=dict(metadata.get("labels") or {}),
+            annotations=dict(metadata.get("annotations") or {}),
+            creation_timestamp=datetime.now(timezone.utc)
+        )
+
+    @staticmethod
+    def _selected(objects, namespace, label_selector):
+        wanted = dict(term.split("=", 1) for term in (label_selector or "").split(",") if term)
+        return [
+            o for (ns, _), o in sorted(objects.items())
+            if ns == namespace and all((o.metadata.labels or {}).get(k) == v for k, v in wanted.items())
+        ]
+
+    def create_namespaced_pod(self, namespace, body, **kwargs):
+        self._check()
+        key = (namespace, body["metadata"]["name"])
+        if key in self.pods:
+            raise ApiException(status=409, reason="AlreadyExists")
+        self.pods[key] = client.V1Pod(
+            metadata=self._metadata(namespace, body),
+            status=client.V1PodStatus(phase="Running", pod_ip=next(self.ips))
+        )
+        return self.pods[key]
+
+    def read_namespaced_pod(self, name, namespace, **kwargs):
+        self._check()
+        if (namespace, name) not in self.pods:
+            raise ApiException(status=404, reason="Not Found")
+        return self.pods[(namespace, name)]
+
+    def delete_namespaced_pod(self, name, namespace, **kwargs):
+        self._check()
+        if self.pods.pop((namespace, name), None) is None:
+            raise ApiException(status=404, reason="Not Found")
+
+    def list_namespaced_pod(self, namespace, label_selector=None, **kwargs):
+        self._check()
+        return client.V1PodList(items=self._selected(self.pods, namespace, label_selector),
+                                metadata=client.V1ListMeta(resource_version="1"))
+
+    def create_namespaced_service(self, namespace, body, **kwargs):
+        self._check()
+        key = (namespace, body["metadata"]["name"])
+        if key in self.services:
+            raise ApiException(status=409, reason="AlreadyExists")
+        self.services[key] = client.V1Service(metadata=self._metadata(namespace, body),
+                                              status=client.V1ServiceStatus())
+        return self.services[key]
+
+    def delete_namespaced_service(self, name, namespace, **kwargs):
+        self._check()
+        if self.services.pop((namespace, name), None) is None:
+            raise ApiException(status=404, reason="Not Found")
+
+    def list_namespaced_service(self, namespace, label_selector=None, **kwargs):
+        self._check()
+        return client.V1ServiceList(items=self._selected(self.services, namespace, label_selector),
+                                    metadata=client.V1ListMeta(resource_version="1"))
+
+
+def fake_shard(name, **kwargs) -> Shard:
+    shard = Shard(name, **kwargs)
+    shard.v1 = FakeCoreV1Api()
+    shard.diagnostics = Diagnostics(shard.v1)
+    return shard
+
+
+def sync(store, shard, namespace):
+    """What the shard's RegistryWatcher does on relist"""
+    pods = shard.v1.list_namespaced_pod(namespace, label_selector="app=chromium-runner").items
+    store.replace_namespace(namespace, [{**session_from_pod(p), "shard": shard.name} for p in pods], shard.name)
@@ -0,0 +1,135 @@
+import json
+import uuid
+
+import pytest
+from kubernetes.client.rest import ApiException
+
+from fake_backend import fake_shard, sync
+from placement import Placement, PlacementFull, load_shards
+from registry import SQLiteSessionStore
+
+V120 = "120.0.6099.109"
+V119 = "119.0.6045.105"
+
+
+@pytest.fixture
+def store():
+    return SQLiteSessionStore(":memory:")
+
+
+def start_session(placement, store, version, namespace="default"):
+    """Create a session the way POST /pods does, then let the watcher record it"""
+    shard = placement.choose(version)
+    name = placement.session_name(shard, version, uuid.uuid4().hex[:8])
+    namespace = shard.namespace_for(namespace)
+    shard.v1.create_namespaced_pod(namespace=namespace, body={"metadata": {
+        "name": name,
+        "labels": {"app": "chromium-runner", "chromium-version": version.replace(".", "-")},
+        "annotations": {"chromium-version": version}
+    }})
+    sync(store, shard, namespace)
+    return shard, name
+
+
+def test_prefers_shard_already_running_the_version(store):
+    east = fake_shard("east", namespace="sessions", max_sessions=10)
+    west = fake_shard("west", namespace="sessions", max_sessions=100)
+    placement = Placement([east, west], store)
+    # West has more room, but only east has the version warm
+    east.v1.create_namespaced_pod(namespace="sessions", body={"metadata": {
+        "name": "chromium-120-0-6099-109-east-00000000",
+        "labels": {"app": "chromium-runner"},
+        "annotations": {"chromium-version": V120}
+    }})
+    sync(store, east, "sessions")
+    assert placement.choose(V120) is east
+    assert placement.choose(V119) is west
+
+
+def test_spreads_by_free_capacity(store):
+    east = fake_shard("east", max_sessions=4)
+    west = fake_shard("west", max_sessions=4)
+    placement = Placement([east, west], store)
+    versions = [V120, V119, "118.0.5993.70", "117.0.5938.92"]
+    shards = [start_session(placement, store, v)[0].name for v in versions]
+    assert sorted(shards) == ["east", "east", "west", "west"]
+
+
+def test_skips_shards_that_do_not_serve_the_version(store):
+    pinned = fake_shard("pinned", versions=[V120])
+    anything = fake_shard("any", max_sessions=1)
+    placement = Placement([pinned, anything], store)
+    assert placement.choose(V119) is anything
+    start_session(placement, store, V119)
+    with pytest.raises(PlacementFull):
+        placement.choose(V119)
+    assert placement.choose(V120) is pinned
+
+
+def test_fails_over_when_the_preferred_shard_is_full(store):
+    east = fake_shard("east", namespace="sessions", max_sessions=2)
+    west = fake_shard("west", namespace="sessions", max_sessions=2)
+    placement = Placement([east, west], store)
+    first, _ = start_session(placement, store, V120)
+    placed = [start_session(placement, store, V120)[0] for _ in range(3)]
+    # Locality keeps the version on one shard until it is full, then the other takes over
+    assert placed[0] is first
+    assert placed[1:] == [west if first is east else east] * 2
+    with pytest.raises(PlacementFull):
+        placement.choose(V120)
+    assert {s["shard"] for s in store.query(namespace="sessions")} == {"east", "west"}
+
+
+def test_routes_existing_sessions_by_name_suffix(store):
+    east = fake_shard("east", namespace="sessions")
+    west = fake_shard("west", namespace="sessions")
+    placement = Placement([east, west], store)
+    shard, name = start_session(placement, store, V120)
+    assert name.rsplit("-", 2)[1] == shard.name
+    assert placement.for_session(name) is shard
+    assert placement.for_session("chromium-120-0-6099-109-west-abcdef12") is west
+    # Names from before sharding, and unknown shards, belong to the default shard
+    assert placement.for_session("chromium-120-0-6099-109-abcdef12") is east
+    assert placement.for_session("chromium-120-0-6099-109-gone-abcdef12") is east
+
+
+def test_single_shard_keeps_unsuffixed_names(store):
+    local = fake_shard("local")
+    placement = Placement([local], store)
+    shard, name = start_session(placement, store, V120, namespace="team-a")
+    assert name.startswith("chromium-120-0-6099-109-") and name.count("-") == 5
+    assert placement.for_session(name) is local
+    assert store.get("team-a", name)["shard"] == "local"
+
+
+def test_shards_sharing_a_namespace_keep_separate_views(store):
+    east = fake_shard("east", namespace="sessions")
+    west = fake_shard("west", namespace="sessions")
+    placement = Placement([east, west], store)
+    for _ in range(2):
+        start_session(placement, store, V120)
+    west.v1.pods.clear()
+    sync(store, west, "sessions")
+    totals, _ = placement.loads()
+    assert totals.get("west", 0) == 0
+    assert totals["east"] == len(east.v1.pods)
+
+
+def test_unavailable_backend_fails_the_create(store):
+    east = fake_shard("east", max_sessions=1)
+    placement = Placement([east], store)
+    east.v1.available = False
+    with pytest.raises(ApiException) as error:
+        start_session(placement, store, V120)
+    assert error.value.status == 503
+
+
+def test_load_shards_rejects_names_that_look_like_versions(tmp_path):
+    path = tmp_path / "shards.json"
+    path.write_text(json.dumps([{"name": "120"}]))
+    with pytest.raises(ValueError):
+        load_shards(str(path))
+    path.write_text(json.dumps([{"name": "use1a", "namespace": "sessions", "max_sessions": 5}]))
+    (shard,) = load_shards(str(path))
+    assert (shard.name, shard.namespace, shard.max_sessions, shard.local) == ("use1a", "sessions", 5, True)
+    assert [s.name for s in load_shards(str(tmp_path / "missing.json"))] == ["local"]
@@ -0,0 +1,38 @@
+from fake_backend import FakeCoreV1Api
+from registry import RegistryWatcher, SQLiteSessionStore
+
+
+def vnc_service(core, namespace, pod_name, hibernated_at=None):
+    annotations = {"session-hibernated-at": hibernated_at, "chromium-version": "120.0.6099.109"} if hibernated_at else {}
+    core.create_namespaced_service(namespace=namespace, body={"metadata": {
+        "name": f"{pod_name}-vnc", "labels": {"app": "chromium-vnc-service"}, "annotations": annotations
+    }})
+
+
+def relist(store, core, shard):
+    watcher = RegistryWatcher(store, core, ["default"], shard)
+    watcher._stream = lambda *args: None
+    watcher._watch_services("default")
+
+
+def test_service_relist_drops_rows_deleted_while_the_watch_was_down():
+    store = SQLiteSessionStore(":memory:")
+    east, west = FakeCoreV1Api(), FakeCoreV1Api()
+    vnc_service(east, "default", "kept")
+    vnc_service(east, "default", "gone", hibernated_at="1700000000")
+    vnc_service(west, "default", "other", hibernated_at="1700000000")
+    relist(store, east, "east")
+    relist(store, west, "west")
+    assert {s["pod_name"] for s in store.query(state="Hibernated")} == {"gone", "other"}
+
+    # Deleted during a watch gap: only the 410 relist will ever show it
+    east.delete_namespaced_service(name="gone-vnc", namespace="default")
+    revision = store.revision()
+    relist(store, east, "east")
+    assert {s["pod_name"] for s in store.query(state="Hibernated")} == {"other"}
+    assert store.get("default", "gone") is None
+    # Same rows as a replica that never saw the stale service
+    fresh = SQLiteSessionStore(":memory:")
+    relist(fresh, east, "east")
+    relist(fresh, west, "west")
+    assert store.revision() == fresh.revision() != revision
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""Stage a Chromium version tree so Chrome can start before the full copy finishes.
+
+  stage   <source> <dest>   copy the hot set, symlink everything else back to <source>
+  hydrate <source> <dest>   replace the remaining symlinks with local copies, in the background
+
+With CHROMIUM_WAIT_SECONDS set (sessions for a version that is still being fetched on
+demand), stage first waits up to that long for the version's image to be published.
+
+The hot set comes from <source>/.prefetch.json (written by profile-chromium.py) when
+present, or from DEFAULT_HOT_SET. Cold files stay readable the whole time: until
+hydrate gets to them they are symlinks into the read-only version volume.
+
+When the downloader has published an image for the version (.images/<version>.tar.zst
+next to the version trees), stage unpacks only its hot frame in one sequential read and
+hydrate unpacks the cold frame. Images without frames are unpacked whole by stage.
+"""
+import fnmatch
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST_NAME = ".prefetch.json"
+STAGED_MARKER = ".staged"
+HYDRATED_MARKER = ".hydrated"
+IMAGES_DIR = ".images"
+WORKERS = int(os.environ.get("PREFETCH_WORKERS", "8"))
+WAIT_SECONDS = int(os.environ.get("CHROMIUM_WAIT_SECONDS", "0"))
+WAIT_POLL_SECONDS = 5
+
+# Used when a version has no profiled manifest yet: the binary, its shared
+# libraries, the top-level resource packs and snapshots, and the default locale
+DEFAULT_HOT_SET = [
+    "chrome",
+    "chrome_crashpad_handler",
+    "*.so",
+    "*.pak",
+    "*.bin",
+    "*.json",
+    "icudtl.dat",
+    "locales/en-US.pak",
+]
+
+
+def load_manifest(source):
+    path = os.path.join(source, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠ Ignoring unreadable manifest {path}: {e}")
+        return None
+
+
+def list_tree(source):
+    files = []
+    for root, dirs, names in os.walk(source):
+        for name in names:
+            rel = os.path.relpath(os.path.join(root, name), source)
+            if rel != MANIFEST_NAME:
+                files.append(rel)
+    return files
+
+
+def matches_default_hot_set(rel):
+    # Patterns only match at their own depth, so "*.pak" does not pull in every locale
+    return any(
+        fnmatch.fnmatch(rel, pattern) and rel.count("/") == pattern.count("/")
+        for pattern in DEFAULT_HOT_SET
+    )
+
+
+def plan(source, files=None):
+    """Return (hot, cold) relative paths, each in the order they should be fetched.
+
+    files defaults to a walk of source; the image path passes its index instead, so
+    the version tree on the shared volume is never listed file by file.
+    """
+    if files is None:
+        files = list_tree(source)
+    present = set(files)
+    manifest = load_manifest(source)
+    if manifest:
+        ordered = [e["path"] for e in manifest.get("files", []) if e["path"] in present]
+        hot = ordered[:manifest.get("hot_count", len(ordered))]
+        hot_set = set(hot)
+        cold = [p for p in ordered if p not in hot_set]
+        seen = hot_set | set(cold)
+        cold += sorted(p for p in files if p not in seen)
+        if "chrome" not in hot_set and "chrome" in present:
+            hot.insert(0, "chrome")
+            cold.remove("chrome")
+        return hot, cold
+    hot = sorted(p for p in files if matches_default_hot_set(p))
+    hot_set = set(hot)
+    return hot, sorted(p for p in files if p not in hot_set)
+
+
+def copy_file(source, dest, rel):
+    src = os.path.join(source, rel)
+    dst = os.path.join(dest, rel)
+    tmp = f"{dst}.part"
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    shutil.copyfile(src, tmp)
+    shutil.copymode(src, tmp)
+    # Atomic swap: a reader sees either the symlink or the complete file
+    os.replace(tmp, dst)
+    return os.path.getsize(dst)
+
+
+def image_paths(source):
+    base, version = os.path.split(source.rstrip("/"))
+    images = os.path.join(base, IMAGES_DIR)
+    return os.path.join(images, f"{version}.tar.zst"), os.path.join(images, f"{version}.index.json")
+
+
+def load_index(index):
+    try:
+        with open(index) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠ Ignoring image without a readable index: {e}")
+        return None
+
+
+def unpack_frame(image, frame, dest):
+    """Extract one zstd frame of an image: a run of whole tar members, read on its own"""
+    os.makedirs(dest, exist_ok=True)
+    zstd = subprocess.Popen(["zstd", "-d", "-q", "-c"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    tar = subprocess.Popen(["tar", "-xf", "-", "-C", dest], stdin=zstd.stdout, stderr=subprocess.PIPE)
+    zstd.stdout.close()
+    try:
+        with open(image, "rb") as f:
+            f.seek(frame["offset"])
+            remaining = frame["length"]
+            while remaining:
+                chunk = f.read(min(remaining, 4 * 1024 * 1024))
+                if not chunk:
+                    raise OSError(f"{image} is shorter than its index")
+                zstd.stdin.write(chunk)
+                remaining -= len(chunk)
+        zstd.stdin.close()
+    except OSError as e:
+        zstd.kill()
+        tar.kill()
+        zstd.wait()
+        tar.wait()
+        print(f"⚠ Image unpack failed: {e}")
+        return False
+    stderr = tar.stderr.read().decode(errors="replace")
+    if zstd.wait() != 0 or tar.wait() != 0:
+        print(f"⚠ Image unpack failed: {stderr}")
+        return False
+    return True
+
+
+def unpack_image(image, expected, dest):
+    """Extract a whole image without frames; returns False if it cannot be used."""
+    started = time.monotonic()
+    result = subprocess.run(
+        ["tar", "-I", "zstd -d -T0", "-xf", image, "-C", dest],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        print(f"⚠ Image unpack failed, falling back to per-file staging: {result.stderr}")
+        return False
+
+    with open(os.path.join(dest, STAGED_MARKER), "w") as f:
+        json.dump({"image": image, "files": expected["files"], "bytes": expected["unpacked_bytes"]}, f)
+    # Nothing is linked, so there is nothing for hydrate to do
+    open(os.path.join(dest, HYDRATED_MARKER), "w").close()
+    elapsed = time.monotonic() - started
+    print(f"✓ Unpacked {expected['files']} files, "
+          f"{expected['unpacked_bytes'] // (1024*1024)}MB from {image} in {elapsed:.1f}s")
+    return True
+
+
+def wait_for_image(source, timeout):
+    """Block until the downloader writes the version's image index (it is written last)"""
+    _, index = image_paths(source)
+    if os.path.exists(index):
+        return True
+    print(f"Waiting up to {timeout}s for {os.path.basename(source)} to be published...")
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        time.sleep(WAIT_POLL_SECONDS)
+        if os.path.exists(index):
+            print(f"✓ Published after {time.monotonic() - started:.0f}s")
+            return True
+    print(f"⚠ {os.path.basename(source)} not published after {timeout}s")
+    return False
+
+
+def image_files(expected):
+    return [e["path"] for e in expected["entries"] if e["path"] != MANIFEST_NAME]
+
+
+def stage_from_image(source, dest, image, expected):
+    """Unpack the image's hot frame, copy hot files it lacks, link everything else"""
+    started = time.monotonic()
+    hot_frame = expected["frames"][0]
+    if not unpack_frame(image, hot_frame, dest):
+        return False
+    unpacked = {e["path"] for e in expected["entries"][:hot_frame["files"]]}
+
+    # A manifest profiled after the image was published can name files outside its hot frame
+    hot, cold = plan(source, image_files(expected))
+    extra = [rel for rel in hot if rel not in unpacked]
+    for rel in cold:
+        if rel not in unpacked:
+            link(source, dest, rel)
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        copied = sum(pool.map(lambda rel: copy_file(source, dest, rel), extra))
+
+    with open(os.path.join(dest, STAGED_MARKER), "w") as f:
+        json.dump({"image": image, "hot": len(unpacked) + len(extra), "cold": len(cold),
+                   "hot_bytes": copied + sum(e["size"] for e in expected["entries"][:hot_frame["files"]])}, f)
+    elapsed = time.monotonic() - started
+    print(f"✓ Hot set ready: {len(unpacked)} files from the image frame "
+          f"({hot_frame['length'] // (1024*1024)}MB), {len(extra)} copied, in {elapsed:.1f}s")
+    return True
+
+
+def link(source, dest, rel):
+    dst = os.path.join(dest, rel)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+    os.symlink(os.path.join(source, rel), dst)
+
+
+def stage(source, dest):
+    if WAIT_SECONDS:
+        wait_for_image(source, WAIT_SECONDS)
+    if not os.path.isdir(source):
+        parent = os.path.dirname(source.rstrip("/"))
+        print(f"ERROR: Version directory {source} not found!")
+        print("Available versions:")
+        for name in sorted(os.listdir(parent)) if os.path.isdir(parent) else []:
+            if not name.startswith("."):
+                print(f"  {name}")
+        sys.exit(1)
+
+    image, index = image_paths(source)
+    expected = load_index(index) if os.path.exists(index) else None
+    if expected and expected.get("frames"):
+        staged = stage_from_image(source, dest, image, expected)
+    else:
+        staged = expected is not None and unpack_image(image, expected, dest)
+    if staged:
+        os.chmod(os.path.join(dest, "chrome"), 0o755)
+        return
+
+    started = time.monotonic()
+    hot, cold = plan(source)
+    print(f"Staging {len(hot)} hot files, linking {len(cold)} cold files from {source}")
+
+    for rel in cold:
+        link(source, dest, rel)
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        total = sum(pool.map(lambda rel: copy_file(source, dest, rel), hot))
+
+    chrome = os.path.join(dest, "chrome")
+    if not os.path.isfile(chrome):
+        print("⚠ Chrome binary not found in staged tree")
+        sys.exit(1)
+    os.chmod(chrome, 0o755)
+
+    with open(os.path.join(dest, STAGED_MARKER), "w") as f:
+        json.dump({"hot": len(hot), "cold": len(cold), "hot_bytes": total}, f)
+    elapsed = time.monotonic() - started
+    print(f"✓ Hot set ready: {len(hot)} files, {total // (1024*1024)}MB in {elapsed:.1f}s")
+
+
+def hydrate(source, dest):
+    if os.path.exists(os.path.join(dest, HYDRATED_MARKER)):
+        print("✓ Nothing to hydrate")
+        return
+    started = time.monotonic()
+    image, index = image_paths(source)
+    expected = load_index(index) if os.path.exists(index) else None
+    if expected and expected.get("frames"):
+        hydrate_from_image(dest, image, expected)
+        _, cold = plan(source, image_files(expected))
+    else:
+        _, cold = plan(source)
+    pending = [
+        rel for rel in cold
+        if os.path.islink(os.path.join(dest, rel))
+    ]
+    print(f"Hydrating {len(pending)} linked files into {dest}")
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        results = list(pool.map(lambda rel: _try_copy(source, dest, rel), pending))
+    failed = results.count(None)
+
+    if failed:
+        print(f"⚠ {failed} files left as links to {source}")
+    else:
+        open(os.path.join(dest, HYDRATED_MARKER), "w").close()
+    print(f"✓ Hydration finished in {time.monotonic() - started:.1f}s")
+
+
+def hydrate_from_image(dest, image, expected):
+    """Unpack the cold frame beside dest, then swap each file over its symlink"""
+    scratch = os.path.join(dest, ".hydrate")
+    shutil.rmtree(scratch, ignore_errors=True)
+    try:
+        if not unpack_frame(image, expected["frames"][1], scratch):
+            return
+        swapped = 0
+        for entry in expected["entries"][expected["frames"][0]["files"]:]:
+            dst = os.path.join(dest, entry["path"])
+            # Files stage copied are already local; only links are replaced
+            if os.path.islink(dst):
+                os.replace(os.path.join(scratch, entry["path"]), dst)
+                swapped += 1
+        print(f"✓ Unpacked {swapped} cold files from {image}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _try_copy(source, dest, rel):
+    try:
+        return copy_file(source, dest, rel)
+    except OSError as e:
+        print(f"✗ {rel}: {e}")
+        return None
+
+
+def main():
+    if len(sys.argv) != 4 or sys.argv[1] not in ("stage", "hydrate"):
+        print(__doc__)
+        sys.exit(2)
+    command = sys.argv[1]
+    # Symlinks must be absolute to resolve from inside dest
+    source, dest = os.path.abspath(sys.argv[2]), os.path.abspath(sys.argv[3])
+    if command == "stage":
+        stage(source, dest)
+    else:
+        hydrate(source, dest)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Profile which files each Chromium version reads at startup.
+
+Runs every version under BASE_PATH once in headless mode under strace, records the
+order in which files of the version tree are opened and how many bytes are read from
+each, and writes <version>/.prefetch.json for chromium-prefetch.py to stage from.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_PATH = "/opt/chromium-versions"
+MANIFEST_NAME = ".prefetch.json"
+
+# strace -f -ttt -y: "<pid> <epoch> call(args) = result"
+OPEN_RE = re.compile(r'^\d+\s+([\d.]+)\s+(?:openat|open|execve)\(.*?"([^"]+)".*\)\s+=\s+(\d+)')
+READ_RE = re.compile(r'^\d+\s+[\d.]+\s+p?read(?:64)?\(\d+<([^>]+)>.*\)\s+=\s+(\d+)')
+# A call interrupted by another thread: "<pid> <epoch> openat(... <unfinished ...>" and later
+# "<pid> <epoch> <... openat resumed>...) = 5"
+UNFINISHED_SUFFIX = " <unfinished ...>"
+RESUMED_RE = re.compile(r'^(\d+)\s+[\d.]+\s+<\.\.\. \w+ resumed>(.*)$')
+
+
+def join_resumed(lines):
+    """Stitch split calls back into one line each, stamped with the time the call started"""
+    unfinished = {}
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.endswith(UNFINISHED_SUFFIX):
+            unfinished[line.split(None, 1)[0]] = line[:-len(UNFINISHED_SUFFIX)]
+            continue
+        match = RESUMED_RE.match(line)
+        if match:
+            start = unfinished.pop(match.group(1), None)
+            if start is not None:
+                yield start + match.group(2)
+            continue
+        yield line
+
+
+def chrome_command(chrome, url, user_data_dir):
+    return [
+        chrome,
+        "--headless=new",
+        "--no-sandbox",
+        "--disable-gpu",
+        "--disable-dev-shm-usage",
+        "--no-first-run",
+        f"--user-data-dir={user_data_dir}",
+        "--dump-dom",
+        url
+    ]
+
+
+def trace_startup(version_path, url, timeout):
+    """Run Chrome under strace and return the raw trace lines."""
+    workdir = tempfile.mkdtemp(prefix="chromium-profile-")
+    trace_file = os.path.join(workdir, "strace.log")
+    command = [
+        "strace", "-f", "-qq", "-ttt", "-y",
+        "-e", "trace=execve,open,openat,read,pread64",
+        "-o", trace_file
+    ] + chrome_command(os.path.join(version_path, "chrome"), url, os.path.join(workdir, "user-data"))
+    try:
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        print(f"⚠ Chrome did not exit within {timeout}s, using the partial trace")
+    try:
+        with open(trace_file, errors="replace") as f:
+            return f.readlines()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def build_manifest(version, version_path, lines):
+    root = os.path.realpath(version_path) + "/"
+    order = {}
+    bytes_read = {}
+    started = None
+
+    for line in join_resumed(lines):
+        match = OPEN_RE.match(line)
+        if match:
+            ts, path, _ = match.groups()
+            started = started or float(ts)
+            path = os.path.realpath(path)
+            if path.startswith(root) and os.path.isfile(path):
+                rel = path[len(root):]
+                order.setdefault(rel, float(ts) - started)
+            continue
+        match = READ_RE.match(line)
+        if match:
+            path, count = match.groups()
+            if path.startswith(root):
+                rel = path[len(root):]
+                bytes_read[rel] = bytes_read.get(rel, 0) + int(count)
+
+    files = [
+        {
+            "path": rel,
+            "size": os.path.getsize(os.path.join(version_path, rel)),
+            "bytes_read": bytes_read.get(rel, 0),
+            "first_access_ms": round(offset * 1000, 1)
+        }
+        for rel, offset in sorted(order.items(), key=lambda item: item[1])
+        if rel != MANIFEST_NAME
+    ]
+    return {
+        "version": version,
+        "generated_at": int(time.time()),
+        "hot_count": len(files),
+        "hot_bytes": sum(f["size"] for f in files),
+        "files": files
+    }
+
+
+def write_manifest(version_path, manifest):
+    path = os.path.join(version_path, MANIFEST_NAME)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(tmp, path)
+    return path
+
+
+def profile_version(version, base_path, url, timeout, force):
+    version_path = os.path.join(base_path, version)
+    if not os.path.isfile(os.path.join(version_path, "chrome")):
+        print(f"✗ {version}: no chrome binary, skipping")
+        return False
+    if os.path.exists(os.path.join(version_path, MANIFEST_NAME)) and not force:
+        print(f"✓ {version}: manifest exists, skipping")
+        return True
+
+    print(f"Profiling {version}...")
+    lines = trace_startup(version_path, url, timeout)
+    manifest = build_manifest(version, version_path, lines)
+    if not manifest["files"]:
+        print(f"✗ {version}: trace recorded no file access")
+        return False
+    path = write_manifest(version_path, manifest)
+    print(f"✓ {version}: {manifest['hot_count']} files, "
+          f"{manifest['hot_bytes'] // (1024*1024)}MB hot set -> {path}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("versions", nargs="*", help="versions to profile (default: all under --base-path)")
+    parser.add_argument("--base-path", default=BASE_PATH)
+    parser.add_argument("--url", default="about:blank")
+    parser.add_argument("--timeout", type=int, default=60)
+    parser.add_argument("--force", action="store_true", help="re-profile versions that already have a manifest")
+    args = parser.parse_args()
+
+    versions = args.versions or sorted(
+        v for v in os.listdir(args.base_path)
+        if not v.startswith(".") and os.path.isdir(os.path.join(args.base_path, v))
+    )
+    if not versions:
+        print(f"✗ No versions to profile under {args.base_path}")
+        sys.exit(1)
+    failed = [v for v in versions if not profile_version(v, args.base_path, args.url, args.timeout, args.force)]
+    print(f"\nProfiled {len(versions) - len(failed)}/{len(versions)} versions")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        # The profiler Job must not report success for versions left without a manifest
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
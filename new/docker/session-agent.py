@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""In-pod session agent: starts and supervises Chrome, and reports session health.
+
+Chrome is launched as soon as the staged binary exists and Xvfb accepts connections
+on its socket, and is restarted with a short backoff whenever it exits. A small
+HTTP server on AGENT_PORT serves:
+
+  /healthz         200 when the display is up and Chrome is running, else 503
+  /stats           Chrome process tree RSS/CPU, renderer count, VNC clients, hydration
+  POST /hibernate  stop Chrome cleanly and archive its profile to PROFILE_ARCHIVE;
+                   needs "Authorization: Bearer <AGENT_TOKEN>", set by the API
+
+When PROFILE_ARCHIVE exists at startup (a resumed session), the profile is restored
+from it and Chrome reopens the tabs of its last session.
+"""
+import ctypes
+import ctypes.util
+import hmac
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHROME_BINARY = os.environ.get("CHROME_BINARY", "/opt/chromium/chrome")
+CHROME_URL = os.environ.get("CHROME_URL", "https://www.google.com")
+CHROME_LOG = os.environ.get("CHROME_LOG", "/var/log/chrome.log")
+DISPLAY = os.environ.get("DISPLAY", ":99")
+AGENT_PORT = int(os.environ.get("AGENT_PORT", "8090"))
+USER_DATA_DIR = "/root/.config/chromium"
+# Set by the API to a per-session path on the profiles volume
+PROFILE_ARCHIVE = os.environ.get("PROFILE_ARCHIVE")
+# This session's token from the API; without one nobody may hibernate the session
+AGENT_TOKEN = os.environ.get("AGENT_TOKEN", "")
+# Rebuilt by Chrome on demand; not worth carrying through a hibernation
+PROFILE_EXCLUDES = ["Cache", "Code Cache", "GPUCache", "GrShaderCache", "ShaderCache", "CacheStorage", "Singleton*"]
+CHROME_STOP_SECONDS = 20
+VNC_PORT = 5900
+NOVNC_PORT = 6080
+# Restart backoff doubles from MIN to MAX; a run longer than STABLE_SECONDS resets it
+RESTART_MIN_SECONDS = 0.5
+RESTART_MAX_SECONDS = 10.0
+STABLE_SECONDS = 60
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+IN_CREATE = 0x100
+IN_MOVED_TO = 0x80
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def chrome_command(restore=False):
+    command = [
+        CHROME_BINARY,
+        "--no-sandbox",
+        "--disable-dev-shm-usage",
+        "--disable-gpu",
+        "--disable-software-rasterizer",
+        "--start-maximized",
+        "--no-first-run",
+        f"--user-data-dir={USER_DATA_DIR}"
+    ]
+    # A restored profile reopens its own tabs instead of the start page
+    return command + ["--restore-last-session"] if restore else command + [CHROME_URL]
+
+
+def restore_profile():
+    if not PROFILE_ARCHIVE or not os.path.exists(PROFILE_ARCHIVE):
+        return False
+    # The agent itself may be restarted in a live pod; never roll the profile back
+    marker = os.path.join(USER_DATA_DIR, ".restored")
+    if os.path.exists(marker):
+        return True
+    started = time.monotonic()
+    os.makedirs(USER_DATA_DIR, exist_ok=True)
+    subprocess.run(["tar", "-I", "zstd -d -T0", "-xf", PROFILE_ARCHIVE, "-C", USER_DATA_DIR], check=True)
+    open(marker, "w").close()
+    print(f"Restored profile from {PROFILE_ARCHIVE} in {time.monotonic() - started:.1f}s")
+    return True
+
+
+def archive_profile():
+    started = time.monotonic()
+    os.makedirs(os.path.dirname(PROFILE_ARCHIVE), exist_ok=True)
+    os.makedirs(USER_DATA_DIR, exist_ok=True)
+    tmp = f"{PROFILE_ARCHIVE}.part"
+    excludes = [f"--exclude={pattern}" for pattern in PROFILE_EXCLUDES]
+    subprocess.run(
+        ["tar", "-I", "zstd -T0 -3", "-cf", tmp, *excludes, "-C", USER_DATA_DIR, "."],
+        check=True, capture_output=True
+    )
+    os.replace(tmp, PROFILE_ARCHIVE)
+    return {
+        "archive": PROFILE_ARCHIVE,
+        "bytes": os.path.getsize(PROFILE_ARCHIVE),
+        "seconds": round(time.monotonic() - started, 2)
+    }
+
+
+def wait_for_path(path, poll=0.2):
+    """Block until path exists: inotify on its directory, polling if that is unavailable"""
+    if os.path.exists(path):
+        return
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    fd = libc.inotify_init1(os.O_CLOEXEC) if hasattr(libc, "inotify_init1") else -1
+    if fd < 0 or libc.inotify_add_watch(fd, directory.encode(), IN_CREATE | IN_MOVED_TO) < 0:
+        if fd >= 0:
+            os.close(fd)
+        while not os.path.exists(path):
+            time.sleep(poll)
+        return
+    try:
+        # Re-check after the watch is in place so a create in between is not missed
+        while not os.path.exists(path):
+            data = os.read(fd, 4096)
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size + length
+    finally:
+        os.close(fd)
+
+
+def wait_for_display(poll=0.1):
+    """Xvfb is ready once its socket accepts connections"""
+    path = f"/tmp/.X11-unix/X{DISPLAY.lstrip(':').split('.')[0]}"
+    wait_for_path(path)
+    while True:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            try:
+                s.connect(path)
+                return
+            except OSError:
+                time.sleep(poll)
+
+
+class ChromeSupervisor:
+    def __init__(self):
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.last_exit_code = None
+        self.display_ready = False
+        self.stopping = False
+        self.hibernated = False
+        # Cleared while hibernate() has Chrome down; the run loop waits on it
+        self.allowed = threading.Event()
+        self.allowed.set()
+        self.terminated = threading.Event()
+        # Reentrant: the SIGTERM handler runs on the main thread, which may hold it
+        self.lock = threading.RLock()
+
+    def run(self):
+        wait_for_path(CHROME_BINARY)
+        print(f"Chrome binary present at {CHROME_BINARY}")
+        wait_for_display()
+        self.display_ready = True
+        print(f"Display {DISPLAY} ready")
+        restore = restore_profile()
+
+        backoff = RESTART_MIN_SECONDS
+        while not self.stopping:
+            if not self.allowed.is_set():
+                self.allowed.wait()
+                # Back from a failed hibernation: Chrome flushed its session on SIGTERM
+                restore = True
+                backoff = RESTART_MIN_SECONDS
+                continue
+            with open(CHROME_LOG, "ab") as log:
+                with self.lock:
+                    if self.stopping or not self.allowed.is_set():
+                        continue
+                    self.process = subprocess.Popen(chrome_command(restore), stdout=log, stderr=subprocess.STDOUT)
+                    self.started_at = time.time()
+                print(f"Chrome started (pid {self.process.pid})")
+                code = self.process.wait()
+            ran = time.time() - self.started_at
+            with self.lock:
+                self.last_exit_code = code
+                self.process = None
+            if self.stopping or not self.allowed.is_set():
+                continue
+            backoff = RESTART_MIN_SECONDS if ran > STABLE_SECONDS else min(backoff * 2, RESTART_MAX_SECONDS)
+            self.restarts += 1
+            print(f"Chrome exited with {code} after {ran:.0f}s, restarting in {backoff:.1f}s")
+            time.sleep(backoff)
+
+    def stop(self, *_):
+        self.stopping = True
+        self.terminated.set()
+        self.allowed.set()
+        with self.lock:
+            if self.process:
+                self.process.terminate()
+
+    def hibernate(self):
+        """Stop Chrome for good (it flushes its session on SIGTERM) and archive the profile"""
+        with self.lock:
+            # The run loop parks instead of restarting Chrome, and resumes if archiving fails
+            self.allowed.clear()
+            process = self.process
+            if process:
+                process.terminate()
+        if process:
+            try:
+                process.wait(timeout=CHROME_STOP_SECONDS)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        try:
+            result = archive_profile()
+        except (OSError, subprocess.CalledProcessError):
+            # Bring the browser back; the session stays as it was
+            self.allowed.set()
+            raise
+        self.hibernated = True
+        print(f"Hibernated: {result['bytes'] // 1024}KB profile archived to {result['archive']}")
+        return result
+
+    def running(self):
+        with self.lock:
+            return self.process is not None and self.process.poll() is None
+
+    def pid(self):
+        with self.lock:
+            return self.process.pid if self.process else None
+
+
+def read_processes():
+    """pid -> (ppid, cpu_ticks, rss_bytes, cmdline) for every process in the pod"""
+    processes = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read().split(b"\0")
+        except OSError:
+            continue
+        # The command name may contain spaces; fields resume after the last ")"
+        fields = stat[stat.rfind(")") + 2:].split()
+        processes[int(entry)] = (
+            int(fields[1]),
+            int(fields[11]) + int(fields[12]),
+            int(fields[21]) * PAGE_SIZE,
+            [part.decode(errors="replace") for part in cmdline if part]
+        )
+    return processes
+
+
+def process_tree(root, processes):
+    children = {}
+    for pid, (ppid, *_) in processes.items():
+        children.setdefault(ppid, []).append(pid)
+    tree, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        if pid in processes:
+            tree.append(pid)
+            stack.extend(children.get(pid, ()))
+    return tree
+
+
+def is_loopback(address):
+    """A /proc/net/tcp{,6} hex address (little-endian words) in 127/8, ::1 or ::ffff:127/104"""
+    if len(address) == 8:
+        return address.endswith("7F")
+    return address == "0" * 24 + "01000000" or (address[:24] == "0" * 16 + "FFFF0000" and address.endswith("7F"))
+
+
+def tcp_clients(port):
+    """ESTABLISHED inbound connections to a local port from other hosts.
+
+    Loopback peers are the pod's own plumbing (noVNC's websockify proxies every
+    browser client to x11vnc over 127.0.0.1), not viewers.
+    """
+    count = 0
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    local_port = int(fields[1].rsplit(":", 1)[1], 16)
+                    remote = fields[2].rsplit(":", 1)[0]
+                    if local_port == port and fields[3] == "01" and not is_loopback(remote):
+                        count += 1
+        except OSError:
+            continue
+    return count
+
+
+class Stats:
+    """Point-in-time readings only: every consumer derives its own rates.
+
+    cpu_seconds is the Chrome tree's cumulative CPU time and sampled_at the node's
+    monotonic clock, so a CPU rate is the delta between two samples of the same pid.
+    """
+
+    def __init__(self, supervisor):
+        self.supervisor = supervisor
+
+    def collect(self):
+        pid = self.supervisor.pid()
+        chrome = {
+            "running": self.supervisor.running(),
+            "pid": pid,
+            "restarts": self.supervisor.restarts,
+            "last_exit_code": self.supervisor.last_exit_code,
+            "uptime_seconds": round(time.time() - self.supervisor.started_at, 1) if pid else 0,
+            "processes": 0,
+            "renderers": 0,
+            "rss_bytes": 0,
+            "cpu_seconds": 0.0,
+            "sampled_at": round(time.monotonic(), 3)
+        }
+        if pid:
+            processes = read_processes()
+            tree = process_tree(pid, processes)
+            ticks = sum(processes[p][1] for p in tree)
+            chrome.update(
+                processes=len(tree),
+                renderers=sum(1 for p in tree if "--type=renderer" in processes[p][3]),
+                rss_bytes=sum(processes[p][2] for p in tree),
+                cpu_seconds=round(ticks / CLOCK_TICKS, 2)
+            )
+        return {
+            "chrome": chrome,
+            "display_ready": self.supervisor.display_ready,
+            "vnc_clients": tcp_clients(VNC_PORT),
+            "novnc_clients": tcp_clients(NOVNC_PORT),
+            "hydrated": os.path.exists(os.path.join(os.path.dirname(CHROME_BINARY), ".hydrated"))
+        }
+
+
+class AgentHandler(BaseHTTPRequestHandler):
+    supervisor = None
+    stats = None
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            healthy = self.supervisor.display_ready and self.supervisor.running()
+            self.reply(200 if healthy else 503, {"healthy": healthy})
+        elif self.path == "/stats":
+            self.reply(200, self.stats.collect())
+        else:
+            self.reply(404, {"detail": "not found"})
+
+    def do_POST(self):
+        if self.path != "/hibernate":
+            self.reply(404, {"detail": "not found"})
+        elif not AGENT_TOKEN or not hmac.compare_digest(
+                self.headers.get("Authorization", ""), f"Bearer {AGENT_TOKEN}"):
+            self.reply(403, {"detail": "missing or wrong agent token"})
+        elif not PROFILE_ARCHIVE:
+            self.reply(409, {"detail": "PROFILE_ARCHIVE is not set for this session"})
+        else:
+            try:
+                self.reply(200, self.supervisor.hibernate())
+            except (OSError, subprocess.CalledProcessError) as e:
+                self.reply(500, {"detail": f"Profile archive failed: {e}"})
+
+    def reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # Probes hit /healthz every few seconds; keep the log for Chrome events
+        pass
+
+
+def main():
+    supervisor = ChromeSupervisor()
+    AgentHandler.supervisor = supervisor
+    AgentHandler.stats = Stats(supervisor)
+    server = ThreadingHTTPServer(("0.0.0.0", AGENT_PORT), AgentHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Session agent listening on :{AGENT_PORT}")
+
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    # Returns only on SIGTERM; after a hibernation it parks and the API is still answered
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""Pull-through HTTP cache for Chromium snapshot downloads.
+
+Point the downloader at it with SNAPSHOT_MIRROR=http://<host>:<port>. Every GET is
+forwarded to UPSTREAM_URL once and served from disk afterwards:
+
+  - concurrent requests for the same object share one upstream fetch
+  - cached objects are revalidated with If-None-Match after REVALIDATE_SECONDS; if
+    upstream cannot be reached the stale copy is served
+  - clients get ETags, 304s and single byte-range (206) responses
+  - the cache is kept under MAX_CACHE_BYTES by evicting least recently used objects
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+UPSTREAM_URL = os.environ.get("UPSTREAM_URL", "https://www.googleapis.com")
+CACHE_DIR = os.environ.get("CACHE_DIR", "/var/cache/snapshot-mirror")
+MAX_CACHE_BYTES = int(os.environ.get("MAX_CACHE_BYTES", str(20 * 1024**3)))
+# Snapshot zips never change for a revision; listings do
+REVALIDATE_SECONDS = int(os.environ.get("REVALIDATE_SECONDS", "3600"))
+PORT = int(os.environ.get("PORT", "8080"))
+BLOCK = 1024 * 1024
+
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class MirrorCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.inflight = {}
+        os.makedirs(root, exist_ok=True)
+
+    def paths(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.root, digest), os.path.join(self.root, f"{digest}.meta")
+
+    def load_meta(self, key):
+        data, meta = self.paths(key)
+        try:
+            with open(meta) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return info if os.path.exists(data) else None
+
+    def get(self, key):
+        """Return cache metadata for key, fetching or revalidating upstream as needed"""
+        info = self.load_meta(key)
+        if info and time.time() - info["checked_at"] < REVALIDATE_SECONDS:
+            self.touch(key)
+            return info
+
+        # One upstream request per key; later callers wait for it
+        with self.lock:
+            event = self.inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self.inflight[key] = threading.Event()
+        if not leader:
+            event.wait()
+            info = self.load_meta(key)
+            if info is None:
+                raise requests.HTTPError(f"Upstream fetch for {key} failed")
+            return info
+        try:
+            return self.fetch(key, info)
+        except requests.RequestException as e:
+            if info is None:
+                raise
+            print(f"⚠ Revalidating {key} failed ({e}), serving the cached copy")
+            return info
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            event.set()
+
+    def open(self, key):
+        """Return (info, open data file) for key.
+
+        The file is opened under the lock evict holds, so an object evicted after this
+        returns stays readable through the handle until the caller closes it.
+        """
+        for attempt in range(2):
+            info = self.get(key)
+            data, _ = self.paths(key)
+            with self.lock:
+                try:
+                    return info, open(data, "rb")
+                except FileNotFoundError:
+                    # Evicted between get() and open(): the next get() fetches it again
+                    if attempt:
+                        raise
+
+    def fetch(self, key, cached):
+        data, meta = self.paths(key)
+        headers = {"If-None-Match": cached["etag"]} if cached and cached.get("etag") else {}
+        response = self.session.get(UPSTREAM_URL + key, headers=headers, stream=True, timeout=60)
+        if response.status_code == 304 and cached:
+            response.close()
+            cached["checked_at"] = time.time()
+            self.write_meta(meta, cached)
+            self.touch(key)
+            return cached
+        response.raise_for_status()
+
+        tmp = f"{data}.{threading.get_ident()}.part"
+        with open(tmp, "wb") as f:
+            for block in response.iter_content(BLOCK):
+                f.write(block)
+        size = os.path.getsize(tmp)
+        with self.lock:
+            self.evict(size)
+            os.replace(tmp, data)
+        info = {
+            "key": key,
+            "etag": response.headers.get("ETag") or f'"{hashlib.sha256(key.encode()).hexdigest()[:16]}-{size}"',
+            "content_type": response.headers.get("Content-Type", "application/octet-stream"),
+            "size": size,
+            "checked_at": time.time()
+        }
+        self.write_meta(meta, info)
+        return info
+
+    @staticmethod
+    def write_meta(meta, info):
+        with open(f"{meta}.tmp", "w") as f:
+            json.dump(info, f)
+        os.replace(f"{meta}.tmp", meta)
+
+    def touch(self, key):
+        data, _ = self.paths(key)
+        try:
+            os.utime(data)
+        except OSError:
+            pass
+
+    def evict(self, incoming):
+        """Delete least recently used objects until incoming bytes fit; call with the lock held"""
+        objects = []
+        for name in os.listdir(self.root):
+            if name.endswith((".meta", ".part", ".tmp")):
+                continue
+            path = os.path.join(self.root, name)
+            stat = os.stat(path)
+            objects.append((stat.st_mtime, stat.st_size, path))
+        used = sum(size for _, size, _ in objects)
+        for _, size, path in sorted(objects):
+            if used + incoming <= self.max_bytes:
+                break
+            for victim in (path, f"{path}.meta"):
+                if os.path.exists(victim):
+                    os.remove(victim)
+            used -= size
+            print(f"Evicted {os.path.basename(path)} ({size // (1024*1024)}MB)")
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    cache = None
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.serve(body=False)
+
+    def do_GET(self):
+        self.serve(body=True)
+
+    def serve(self, body):
+        if self.path == "/healthz":
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        try:
+            info, f = self.cache.open(self.path)
+        except requests.RequestException as e:
+            status = getattr(getattr(e, "response", None), "status_code", None) or 502
+            self.send_error(status, str(e))
+            return
+        with f:
+            self.send_object(info, f, body)
+
+    def send_object(self, info, f, body):
+        if self.headers.get("If-None-Match") == info["etag"]:
+            self.send_response(304)
+            self.send_header("ETag", info["etag"])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        size = info["size"]
+        start, end = 0, size - 1
+        match = RANGE_RE.match(self.headers.get("Range", ""))
+        if match and size:
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last), size - 1) if last else size - 1
+            elif last:
+                start = max(0, size - int(last))
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", info["content_type"])
+        self.send_header("Content-Length", str(end - start + 1 if size else 0))
+        self.send_header("ETag", info["etag"])
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if not body or not size:
+            return
+
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining:
+            block = f.read(min(BLOCK, remaining))
+            if not block:
+                break
+            self.wfile.write(block)
+            remaining -= len(block)
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} {format % args}")
+
+
+def main():
+    MirrorHandler.cache = MirrorCache()
+    server = ThreadingHTTPServer(("0.0.0.0", PORT), MirrorHandler)
+    server.daemon_threads = True
+    print(f"Snapshot mirror on :{PORT} -> {UPSTREAM_URL} (cache {CACHE_DIR}, max {MAX_CACHE_BYTES // 1024**3}GB)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
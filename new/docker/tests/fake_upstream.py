@@ -0,0 +1,59 @@
+"""Local stand-in for the snapshot bucket, for testing snapshot-mirror.py without the network.
+
+Serves in-memory objects with ETags and answers If-None-Match with 304. Counts the
+requests it gets, and can be told to fail so revalidation errors can be exercised.
+"""
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeUpstream:
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.requests = []
+        self.statuses = []
+        self.failing = False
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                upstream.requests.append(self.path)
+                body = upstream.objects.get(self.path)
+                if upstream.failing:
+                    self.reply(503)
+                elif body is None:
+                    self.reply(404)
+                else:
+                    etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        self.reply(304, etag=etag)
+                    else:
+                        self.reply(200, body, etag)
+
+            def reply(self, status, body=b"", etag=None):
+                upstream.statuses.append(status)
+                self.send_response(status)
+                if etag:
+                    self.send_header("ETag", etag)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,88 @@
+import importlib.util
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+import requests
+
+from fake_upstream import FakeUpstream
+
+spec = importlib.util.spec_from_file_location(
+    "snapshot_mirror", os.path.join(os.path.dirname(__file__), "..", "snapshot-mirror.py"))
+mirror = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mirror)
+
+ZIP = "/download/storage/v1/b/chromium-browser-snapshots/o/1234%2Fchrome-linux.zip"
+BODY = bytes(range(256)) * 64
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    with FakeUpstream({ZIP: BODY}) as fake:
+        monkeypatch.setattr(mirror, "UPSTREAM_URL", fake.url)
+        yield fake
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return mirror.MirrorCache(root=str(tmp_path), max_bytes=1024**3)
+
+
+@pytest.fixture
+def url(cache):
+    handler = type("Handler", (mirror.MirrorHandler,), {"cache": cache, "log_message": lambda *a: None})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetches_once_and_serves_ranges_and_304s(upstream, url):
+    first = requests.get(url + ZIP)
+    assert first.status_code == 200 and first.content == BODY
+    ranged = requests.get(url + ZIP, headers={"Range": "bytes=100-199"})
+    assert ranged.status_code == 206
+    assert ranged.content == BODY[100:200]
+    assert ranged.headers["Content-Range"] == f"bytes 100-199/{len(BODY)}"
+    cached = requests.get(url + ZIP, headers={"If-None-Match": first.headers["ETag"]})
+    assert cached.status_code == 304
+    assert upstream.requests == [ZIP]
+
+
+def test_passes_upstream_errors_through(upstream, url):
+    assert requests.get(url + "/missing").status_code == 404
+
+
+def test_serves_stale_copy_when_revalidation_fails(upstream, url, monkeypatch):
+    assert requests.get(url + ZIP).content == BODY
+    monkeypatch.setattr(mirror, "REVALIDATE_SECONDS", 0)
+    upstream.failing = True
+    response = requests.get(url + ZIP)
+    assert response.status_code == 200 and response.content == BODY
+    assert upstream.requests == [ZIP, ZIP]
+
+
+def test_revalidates_with_etag(upstream, url, monkeypatch):
+    requests.get(url + ZIP)
+    monkeypatch.setattr(mirror, "REVALIDATE_SECONDS", 0)
+    assert requests.get(url + ZIP).content == BODY
+    assert upstream.statuses == [200, 304]
+
+
+def test_open_handle_survives_eviction(upstream, cache):
+    info, f = cache.open(ZIP)
+    with f:
+        with cache.lock:
+            cache.max_bytes = 0
+            cache.evict(1)
+        assert cache.load_meta(ZIP) is None
+        assert f.read() == BODY
+    # Evicted objects are fetched again on the next request
+    cache.max_bytes = 1024**3
+    info, f = cache.open(ZIP)
+    with f:
+        assert f.read() == BODY
+    assert upstream.requests == [ZIP, ZIP]
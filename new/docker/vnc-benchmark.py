@@ -0,0 +1,590 @@
+#!/usr/bin/env python3
+"""Benchmark the session display stack: Xvfb -> x11vnc -> websockify -> client.
+
+For every x11vnc variant (the tuning profiles in vnc-profiles.json plus single-option
+probes such as -ncache and the XDAMAGE settings) a private display is started with
+Chrome showing a scripted page. An RFB client connected through websockify, as noVNC
+is, then measures each workload under each client encoding:
+
+  updates_per_second  FramebufferUpdate messages received
+  bytes_per_second    bytes on the websocket, i.e. what the browser downloads
+  latency_ms          p50/p95 from a key or wheel event to the next update
+  cpu_percent         Xvfb, x11vnc, websockify and Chrome, in % of one core
+
+Workloads: scroll (wheel events over a long page), video (full-motion canvas at
+30 fps) and typing (keystrokes into a textarea). Rectangles are length-parsed, not
+decoded, so the client stays cheap next to the components it measures.
+"""
+import argparse
+import base64
+import json
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+
+PROFILES_FILE = "/etc/chromium/vnc-profiles.json"
+DEFAULT_PROFILE = "balanced"
+GEOMETRY = "1920x1080"
+# Private displays and ports, clear of the session's :99, 5900 and 6080
+FIRST_DISPLAY = 150
+RFB_PORT = 5950
+WEBSOCKET_PORT = 6150
+START_TIMEOUT_SECONDS = 15
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+# Single x11vnc options probed on top of the default profile
+PROBES = {
+    "ncache": ["-ncache", "10"],
+    "noxdamage": ["-noxdamage"],
+    # Trust XDAMAGE rectangles of any size instead of re-polling large ones
+    "xd-area-0": ["-xd_area", "0"],
+    "noscr": ["-noscr"],
+    "defer-5": ["-wait", "5", "-defer", "5"],
+    "defer-50": ["-wait", "50", "-defer", "50"]
+}
+
+RAW, COPY_RECT, TIGHT, ZRLE = 0, 1, 7, 16
+DESKTOP_SIZE, LAST_RECT, CURSOR = -223, -224, -239
+
+
+def quality(level):
+    return -32 + level
+
+
+def compression(level):
+    return -256 + level
+
+
+ENCODINGS = {
+    # What noVNC 1.0 (the image's novnc package) asks for: Tight, JPEG quality 6, zlib level 2
+    "novnc": [TIGHT, COPY_RECT, RAW, quality(6), compression(2), CURSOR, LAST_RECT, DESKTOP_SIZE],
+    "tight-lossless": [TIGHT, COPY_RECT, RAW, compression(6), LAST_RECT, DESKTOP_SIZE],
+    "tight-q2": [TIGHT, COPY_RECT, RAW, quality(2), compression(9), LAST_RECT, DESKTOP_SIZE],
+    "zrle": [ZRLE, COPY_RECT, RAW, DESKTOP_SIZE],
+    "raw": [RAW, COPY_RECT, DESKTOP_SIZE]
+}
+
+TYPED_TEXT = "The quick brown fox jumps over the lazy dog 0123456789 "
+WHEEL_UP, WHEEL_DOWN = 1 << 3, 1 << 4
+
+
+def workload_pages(directory):
+    """Write the workload pages and return name -> file URL"""
+    sections = "".join(
+        f"<h2>Section {i}</h2><p>{'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 12}</p>"
+        f"<div style='height:120px;background:linear-gradient(90deg,hsl({i * 37 % 360},70%,50%),#fff)'></div>"
+        for i in range(300)
+    )
+    pages = {
+        "scroll": f"<html><body style='font:16px sans-serif;margin:40px'>{sections}</body></html>",
+        "video": """<html><body style='margin:0;overflow:hidden;background:#000'><canvas></canvas><script>
+const screen = document.querySelector('canvas'), out = screen.getContext('2d');
+const frame = document.createElement('canvas'); frame.width = 320; frame.height = 180;
+const ctx = frame.getContext('2d'), image = ctx.createImageData(320, 180);
+screen.width = innerWidth; screen.height = innerHeight;
+let t = 0;
+setInterval(() => {
+  for (let i = 0, p = 0; i < image.data.length; i += 4, p++) {
+    const x = p % 320, y = (p / 320) | 0;
+    image.data[i] = (x + t * 3) & 255; image.data[i + 1] = (y * 2 + t) & 255;
+    image.data[i + 2] = ((x ^ y) + t * 5) & 255; image.data[i + 3] = 255;
+  }
+  ctx.putImageData(image, 0, 0);
+  out.drawImage(frame, 0, 0, screen.width, screen.height);
+  t++;
+}, 1000 / 30);
+</script></body></html>""",
+        # No caret blink: with nothing else moving, every update follows a keystroke
+        "typing": "<html><body style='margin:40px'><textarea autofocus "
+                  "style='width:90vw;height:80vh;font:20px monospace;caret-color:transparent'></textarea></body></html>"
+    }
+    urls = {}
+    for name, html in pages.items():
+        path = os.path.join(directory, f"{name}.html")
+        with open(path, "w") as f:
+            f.write(html)
+        urls[name] = f"file://{path}"
+    return urls
+
+
+def read_processes():
+    """pid -> (ppid, cpu_ticks)"""
+    processes = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        fields = stat[stat.rfind(")") + 2:].split()
+        processes[int(entry)] = (int(fields[1]), int(fields[11]) + int(fields[12]))
+    return processes
+
+
+def tree_ticks(root, processes):
+    children = {}
+    for pid, (ppid, _) in processes.items():
+        children.setdefault(ppid, []).append(pid)
+    ticks, stack = 0, [root]
+    while stack:
+        pid = stack.pop()
+        if pid in processes:
+            ticks += processes[pid][1]
+            stack.extend(children.get(pid, ()))
+    return ticks
+
+
+def listening(port):
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if int(fields[1].rsplit(":", 1)[1], 16) == port and fields[3] == "0A":
+                        return True
+        except OSError:
+            continue
+    return False
+
+
+def wait_until(check, what, process):
+    deadline = time.monotonic() + START_TIMEOUT_SECONDS
+    while not check():
+        if process.poll() is not None:
+            raise RuntimeError(f"{what} exited with code {process.returncode}")
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{what} did not start within {START_TIMEOUT_SECONDS}s")
+        time.sleep(0.1)
+
+
+class Connection:
+    """Byte stream over a plain socket; counts every byte received on the wire"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.wire_bytes = 0
+        self.send_lock = threading.Lock()
+
+    def _recv(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("connection closed")
+        self.wire_bytes += len(data)
+        return data
+
+    def _payload(self):
+        return self._recv()
+
+    def read(self, count):
+        while len(self.buffer) < count:
+            self.buffer += self._payload()
+        data = bytes(self.buffer[:count])
+        del self.buffer[:count]
+        return data
+
+    def _frame(self, data):
+        return data
+
+    def send(self, data):
+        with self.send_lock:
+            self.sock.sendall(self._frame(data))
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class WebSocketConnection(Connection):
+    """RFC 6455 client for websockify's binary subprotocol, as noVNC connects"""
+
+    def __init__(self, host, port):
+        super().__init__(socket.create_connection((host, port)))
+        self.raw = bytearray()
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall((
+            f"GET / HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\nSec-WebSocket-Protocol: binary\r\n\r\n"
+        ).encode())
+        while b"\r\n\r\n" not in self.raw:
+            self.raw += self._recv()
+        head, _, rest = bytes(self.raw).partition(b"\r\n\r\n")
+        if head.split(b" ", 2)[1:2] != [b"101"]:
+            raise ConnectionError(f"websocket upgrade refused: {head.splitlines()[0].decode(errors='replace')}")
+        self.raw = bytearray(rest)
+
+    def _raw_read(self, count):
+        while len(self.raw) < count:
+            self.raw += self._recv()
+        data = bytes(self.raw[:count])
+        del self.raw[:count]
+        return data
+
+    def _payload(self):
+        first, second = self._raw_read(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self._raw_read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._raw_read(8))[0]
+        if second & 0x80:
+            self._raw_read(4)
+        payload = self._raw_read(length)
+        opcode = first & 0x0F
+        if opcode == 0x8:
+            raise ConnectionError("websocket closed")
+        # Control frames carry no RFB data
+        return payload if opcode in (0x0, 0x1, 0x2) else b""
+
+    def _frame(self, data):
+        mask = os.urandom(4)
+        length = len(data)
+        if length < 126:
+            header = struct.pack("!BB", 0x82, 0x80 | length)
+        elif length < 1 << 16:
+            header = struct.pack("!BBH", 0x82, 0x80 | 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x82, 0x80 | 127, length)
+        return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+
+class RfbClient:
+    """Just enough RFB 3.8 to request updates, send input and size every rectangle"""
+
+    def __init__(self, connection, encodings):
+        self.conn = connection
+        if not self.conn.read(12).startswith(b"RFB 003."):
+            raise ConnectionError("not an RFB server")
+        self.conn.send(b"RFB 003.008\n")
+        types = self.conn.read(self.conn.read(1)[0])
+        if 1 not in types:
+            raise ConnectionError("x11vnc asks for a password; the benchmark runs it with -nopw")
+        self.conn.send(b"\x01")
+        if struct.unpack("!I", self.conn.read(4))[0] != 0:
+            raise ConnectionError("RFB security handshake failed")
+        self.conn.send(b"\x01")  # shared
+        self.width, self.height = struct.unpack("!HH", self.conn.read(4))
+        self.conn.read(16)
+        self.conn.read(struct.unpack("!I", self.conn.read(4))[0])
+        # 32 bpp true colour, as noVNC sets it; Tight then sends 3-byte pixels
+        self.conn.send(struct.pack("!B3xBBBBHHHBBB3x", 0, 32, 24, 0, 1, 255, 255, 255, 16, 8, 0))
+        self.conn.send(struct.pack(f"!BxH{len(encodings)}i", 2, len(encodings), *encodings))
+
+    def request_update(self, incremental=True):
+        self.conn.send(struct.pack("!BBHHHH", 3, 1 if incremental else 0, 0, 0, self.width, self.height))
+
+    def key(self, keysym, down):
+        self.conn.send(struct.pack("!BBxxI", 4, 1 if down else 0, keysym))
+
+    def pointer(self, buttons, x, y):
+        self.conn.send(struct.pack("!BBHH", 5, buttons, x, y))
+
+    def read_message(self):
+        """Consume one server message; True if it was a framebuffer update"""
+        kind = self.conn.read(1)[0]
+        if kind == 0:
+            count = struct.unpack("!xH", self.conn.read(3))[0]
+            for _ in range(count):
+                x, y, w, h, encoding = struct.unpack("!HHHHi", self.conn.read(12))
+                if encoding == LAST_RECT:
+                    break
+                self.skip_rect(w, h, encoding)
+            return True
+        if kind == 1:
+            self.conn.read(6 * struct.unpack("!xHH", self.conn.read(5))[1])
+        elif kind == 3:
+            self.conn.read(struct.unpack("!3xI", self.conn.read(7))[0])
+        elif kind != 2:
+            raise ConnectionError(f"unexpected server message {kind}")
+        return False
+
+    def read_compact_length(self):
+        length = 0
+        for i in range(3):
+            byte = self.conn.read(1)[0]
+            if i == 2:
+                return length | byte << 14
+            length |= (byte & 0x7F) << (7 * i)
+            if not byte & 0x80:
+                break
+        return length
+
+    def skip_rect(self, w, h, encoding):
+        if encoding == RAW:
+            self.conn.read(w * h * 4)
+        elif encoding == COPY_RECT:
+            self.conn.read(4)
+        elif encoding == ZRLE:
+            self.conn.read(struct.unpack("!I", self.conn.read(4))[0])
+        elif encoding == TIGHT:
+            self.skip_tight(w, h)
+        elif encoding == CURSOR:
+            self.conn.read(w * h * 4 + (w + 7) // 8 * h)
+        elif encoding == DESKTOP_SIZE:
+            # -ncache grows the framebuffer below the visible screen
+            self.width, self.height = w, h
+        else:
+            raise ConnectionError(f"unexpected rectangle encoding {encoding}")
+
+    def skip_tight(self, w, h):
+        control = self.conn.read(1)[0] >> 4
+        if control == 0x8:  # fill
+            self.conn.read(3)
+            return
+        if control == 0x9:  # JPEG
+            self.conn.read(self.read_compact_length())
+            return
+        colors = 0
+        if control & 0x4:
+            flt = self.conn.read(1)[0]
+            if flt == 1:  # palette
+                colors = self.conn.read(1)[0] + 1
+                self.conn.read(colors * 3)
+        if colors == 2:
+            size = (w + 7) // 8 * h
+        elif colors:
+            size = w * h
+        else:
+            size = w * h * 3
+        self.conn.read(size if size < 12 else self.read_compact_length())
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 1)
+
+
+def measure(client, workload, duration, components):
+    """Drive one workload for `duration` seconds and return its metrics"""
+    pending, latencies, updates, errors = [], [], [0], []
+    lock = threading.Lock()
+    stopped = threading.Event()
+
+    def receive():
+        try:
+            while True:
+                if client.read_message():
+                    now = time.monotonic()
+                    with lock:
+                        latencies.extend(now - sent for sent in pending)
+                        pending.clear()
+                        updates[0] += 1
+                    client.request_update()
+        except (ConnectionError, OSError) as e:
+            if not stopped.is_set():
+                errors.append(e)
+
+    # Settle on a complete frame before counting
+    client.request_update(incremental=False)
+    while not client.read_message():
+        pass
+    client.request_update()
+    start_bytes = client.conn.wire_bytes
+    start_ticks = {name: tree_ticks(pid, read_processes()) for name, pid in components.items()}
+    started = time.monotonic()
+    receiver = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+
+    # The visible screen; -ncache extends the framebuffer below it
+    x, y = client.width // 2, int(GEOMETRY.split("x")[1]) // 2
+    step = 0
+    while time.monotonic() - started < duration:
+        if workload == "scroll":
+            # Down the page, then back up, ten notches a second
+            button = WHEEL_DOWN if (step // 60) % 2 == 0 else WHEEL_UP
+            with lock:
+                pending.append(time.monotonic())
+            client.pointer(button, x, y)
+            client.pointer(0, x, y)
+            time.sleep(0.1)
+        elif workload == "typing":
+            keysym = ord(TYPED_TEXT[step % len(TYPED_TEXT)])
+            with lock:
+                pending.append(time.monotonic())
+            client.key(keysym, True)
+            client.key(keysym, False)
+            time.sleep(0.125)
+        else:
+            time.sleep(0.1)
+        step += 1
+
+    elapsed = time.monotonic() - started
+    if errors:
+        raise errors[0]
+    processes = read_processes()
+    cpu = {
+        name: round(100 * (tree_ticks(pid, processes) - start_ticks[name]) / CLOCK_TICKS / elapsed, 1)
+        for name, pid in components.items()
+    }
+    with lock:
+        result = {
+            "updates_per_second": round(updates[0] / elapsed, 1),
+            "bytes_per_second": round((client.conn.wire_bytes - start_bytes) / elapsed),
+            "latency_ms": {"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+                           "samples": len(latencies)},
+            "cpu_percent": cpu
+        }
+    stopped.set()
+    client.conn.close()
+    receiver.join(timeout=5)
+    return result
+
+
+class Stack:
+    """A private Xvfb, x11vnc and websockify for one variant, and Chrome for one workload"""
+
+    def __init__(self, index, depth, x11vnc_args, chrome, workdir):
+        self.display = f":{FIRST_DISPLAY + index}"
+        self.depth = depth
+        self.x11vnc_args = x11vnc_args
+        self.chrome = chrome
+        self.workdir = workdir
+        self.processes = {}
+
+    def spawn(self, name, command, env=None):
+        self.processes[name] = subprocess.Popen(
+            command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env, start_new_session=True
+        )
+        return self.processes[name]
+
+    def start(self):
+        socket_path = f"/tmp/.X11-unix/X{self.display[1:]}"
+        xvfb = self.spawn("xvfb", ["Xvfb", self.display, "-screen", "0", f"{GEOMETRY}x{self.depth}"])
+        wait_until(lambda: os.path.exists(socket_path), "Xvfb", xvfb)
+        x11vnc = self.spawn("x11vnc", [
+            "x11vnc", "-display", self.display, "-rfbport", str(RFB_PORT), "-localhost", "-nopw",
+            "-forever", "-shared", "-xkb", "-repeat", "-quiet"
+        ] + self.x11vnc_args)
+        wait_until(lambda: listening(RFB_PORT), "x11vnc", x11vnc)
+        websockify = self.spawn("websockify", ["websockify", f"127.0.0.1:{WEBSOCKET_PORT}", f"127.0.0.1:{RFB_PORT}"])
+        wait_until(lambda: listening(WEBSOCKET_PORT), "websockify", websockify)
+
+    def open_page(self, url, settle):
+        self.stop("chrome")
+        user_data_dir = os.path.join(self.workdir, "user-data")
+        shutil.rmtree(user_data_dir, ignore_errors=True)
+        self.spawn("chrome", [
+            self.chrome, "--no-sandbox", "--disable-dev-shm-usage", "--disable-gpu", "--no-first-run",
+            "--test-type", "--kiosk", f"--user-data-dir={user_data_dir}", url
+        ], env={**os.environ, "DISPLAY": self.display})
+        time.sleep(settle)
+
+    def components(self):
+        return {name: process.pid for name, process in self.processes.items()}
+
+    def stop(self, name):
+        process = self.processes.pop(name, None)
+        if process is None:
+            return
+        try:
+            os.killpg(process.pid, 15)
+            process.wait(timeout=10)
+        except ProcessLookupError:
+            pass
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, 9)
+            process.wait()
+
+    def close(self):
+        for name in ("chrome", "websockify", "x11vnc", "xvfb"):
+            self.stop(name)
+
+
+def load_variants(profiles_file, names):
+    with open(profiles_file) as f:
+        profiles = json.load(f)
+    base = profiles[DEFAULT_PROFILE]
+    variants = {f"profile:{name}": (p["depth"], p["x11vnc"]) for name, p in profiles.items()}
+    variants.update({f"probe:{name}": (base["depth"], base["x11vnc"] + args) for name, args in PROBES.items()})
+    if names:
+        unknown = [n for n in names if n not in variants]
+        if unknown:
+            raise SystemExit(f"Unknown variants {unknown}; choose from {sorted(variants)}")
+        variants = {n: variants[n] for n in names}
+    return variants
+
+
+def print_table(results):
+    print(f"\n{'variant':<22} {'workload':<8} {'encoding':<15} {'upd/s':>6} {'KB/s':>8} "
+          f"{'p50 ms':>7} {'p95 ms':>7} {'Xvfb%':>6} {'x11vnc%':>8} {'wsfy%':>6} {'chrome%':>8}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['variant']:<22} {r['workload']:<8} {r['encoding']:<15} ✗ {r['error']}")
+            continue
+        cpu = r["cpu_percent"]
+        print(f"{r['variant']:<22} {r['workload']:<8} {r['encoding']:<15} {r['updates_per_second']:>6} "
+              f"{r['bytes_per_second'] / 1024:>8.0f} {r['latency_ms']['p50'] or '-':>7} "
+              f"{r['latency_ms']['p95'] or '-':>7} {cpu['xvfb']:>6} {cpu['x11vnc']:>8} "
+              f"{cpu['websockify']:>6} {cpu['chrome']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Xvfb/x11vnc/websockify across profiles and encodings")
+    parser.add_argument("--chrome", required=True, help="Chrome binary, e.g. /opt/chromium-versions/<version>/chrome")
+    parser.add_argument("--profiles", default=PROFILES_FILE)
+    parser.add_argument("--variants", nargs="*", help="Subset such as profile:balanced probe:ncache (default: all)")
+    parser.add_argument("--workloads", nargs="*", default=["scroll", "video", "typing"],
+                        choices=["scroll", "video", "typing"])
+    parser.add_argument("--encodings", nargs="*", default=list(ENCODINGS), choices=list(ENCODINGS))
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per measurement")
+    parser.add_argument("--settle", type=float, default=5.0, help="Seconds for Chrome to load each page")
+    parser.add_argument("--output", default="vnc-benchmark.json")
+    args = parser.parse_args()
+
+    variants = load_variants(args.profiles, args.variants)
+    workdir = tempfile.mkdtemp(prefix="vnc-benchmark-")
+    urls = workload_pages(workdir)
+    results = []
+    try:
+        for index, (variant, (depth, x11vnc_args)) in enumerate(variants.items()):
+            print(f"Variant {variant}: depth {depth}, x11vnc {' '.join(x11vnc_args) or '(defaults)'}")
+            stack = Stack(index, depth, x11vnc_args, args.chrome, workdir)
+            try:
+                stack.start()
+                for workload in args.workloads:
+                    stack.open_page(urls[workload], args.settle)
+                    for encoding in args.encodings:
+                        row = {"variant": variant, "workload": workload, "encoding": encoding}
+                        try:
+                            client = RfbClient(WebSocketConnection("127.0.0.1", WEBSOCKET_PORT), ENCODINGS[encoding])
+                            row.update(measure(client, workload, args.duration, stack.components()))
+                            print(f"  ✓ {workload}/{encoding}: {row['updates_per_second']} upd/s, "
+                                  f"{row['bytes_per_second'] / 1024:.0f} KB/s")
+                        except (ConnectionError, OSError) as e:
+                            row["error"] = str(e)
+                            print(f"  ✗ {workload}/{encoding}: {e}")
+                        results.append(row)
+            except RuntimeError as e:
+                print(f"  ✗ {variant}: {e}")
+                results.append({"variant": variant, "workload": "-", "encoding": "-", "error": str(e)})
+            finally:
+                stack.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(results)
+    with open(args.output, "w") as f:
+        json.dump({
+            "geometry": GEOMETRY,
+            "duration_seconds": args.duration,
+            "variants": {name: {"depth": d, "x11vnc": a} for name, (d, a) in variants.items()},
+            "results": results
+        }, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""Start Xvfb or x11vnc with the display tuning profile named by VNC_PROFILE.
+
+Profiles are defined in PROFILES_FILE: each sets the Xvfb depth and the extra x11vnc
+options that trade bandwidth against CPU and latency (vnc-benchmark.py measures
+them). An unknown name falls back to DEFAULT_PROFILE, so a typo never leaves a
+session without a display. The process is exec'd, so supervisord signals reach it.
+"""
+import json
+import os
+import sys
+
+PROFILES_FILE = os.environ.get("VNC_PROFILES_FILE", "/etc/chromium/vnc-profiles.json")
+DEFAULT_PROFILE = "balanced"
+DISPLAY = ":99"
+GEOMETRY = os.environ.get("VNC_GEOMETRY", "1920x1080")
+
+
+def load_profile(name):
+    with open(PROFILES_FILE) as f:
+        profiles = json.load(f)
+    if name not in profiles:
+        print(f"⚠ Unknown VNC profile {name!r}, using {DEFAULT_PROFILE}; known: {', '.join(sorted(profiles))}")
+        name = DEFAULT_PROFILE
+    return name, profiles[name]
+
+
+def command_for(program, profile):
+    if program == "xvfb":
+        return ["/usr/bin/Xvfb", DISPLAY, "-screen", "0", f"{GEOMETRY}x{profile['depth']}"]
+    return [
+        "/usr/bin/x11vnc", "-display", DISPLAY, "-xkb", "-forever", "-shared", "-repeat",
+        "-rfbauth", "/root/.vnc/passwd", "-rfbport", "5900"
+    ] + profile["x11vnc"]
+
+
+def main():
+    if len(sys.argv) != 2 or sys.argv[1] not in ("xvfb", "x11vnc"):
+        sys.exit(f"usage: {sys.argv[0]} xvfb|x11vnc")
+    name, profile = load_profile(os.environ.get("VNC_PROFILE") or DEFAULT_PROFILE)
+    command = command_for(sys.argv[1], profile)
+    print(f"VNC profile {name}: {' '.join(command)}", flush=True)
+    os.execv(command[0], command)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,24 @@
 #!/usr/bin/env python3
+import argparse
+import bisect
+import fcntl
+import fnmatch
 import os
+import shutil
+import struct
 import subprocess
+import tarfile
+import threading
+import time
 import requests
 import json
+import urllib3
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from requests.adapters import HTTPAdapter
 
 # Chromium versions to download
 CHROMIUM_VERSIONS = [
@@ -31,7 +46,30 @@ CHROMIUM_VERSIONS = [
 
 BASE_PATH = "/opt/chromium-versions"
 
-# Version to revision mapping (simplified - using approximate revisions)
+# One zstd-compressed tar per version, so pods can unpack with one sequential
+# read instead of thousands of per-file NFS round trips
+IMAGES_DIR = os.path.join(BASE_PATH, ".images")
+IMAGE_COMPRESSION = "zstd -T0 -3"
+# Written into a version tree by profile-chromium.py; its hot set leads the image
+PREFETCH_MANIFEST = ".prefetch.json"
+
+# Zip entries are fetched individually with HTTP range requests, in parallel
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "8"))
+# Full-zip fallback: parallel range segments written in place with pwrite. Memory
+# stays at SEGMENT_WORKERS * READ_BUFFER_BYTES however large the object is.
+SEGMENT_WORKERS = int(os.environ.get("SEGMENT_WORKERS", str(DOWNLOAD_WORKERS)))
+MIN_SEGMENT_BYTES = int(os.environ.get("MIN_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+READ_BUFFER_BYTES = int(os.environ.get("READ_BUFFER_BYTES", str(4 * 1024 * 1024)))
+# Build new versions from the closest existing tree, fetching only changed zip entries
+DELTA_ENABLED = os.environ.get("DELTA_ENABLED", "1") == "1"
+ZIP_PREFIX = "chrome-linux/"
+
+# fnmatch patterns on paths inside the version tree. Pods run Chrome with
+# --no-sandbox, so the setuid sandbox helper is never needed.
+INCLUDE_PATTERNS = [p for p in os.environ.get("CHROMIUM_INCLUDE", "").split(",") if p]
+EXCLUDE_PATTERNS = [p for p in os.environ.get("CHROMIUM_EXCLUDE", "chrome_sandbox").split(",") if p]
+
+# Fallback when the resolver cannot reach its sources (approximate revisions)
 VERSION_TO_REVISION = {
     "120.0.6099.109": "1217362",
     "119.0.6045.105": "1204232",
@@ -55,12 +93,1005 @@ VERSION_TO_REVISION = {
     "101.0.4951.41": "970830"
 }
 
+# Version -> snapshot revision table, cached on the volume
+REVISION_CACHE = os.path.join(BASE_PATH, ".revisions.json")
+REVISION_CACHE_MAX_AGE = int(os.environ.get("REVISION_CACHE_MAX_AGE", str(24 * 3600)))
+# auto: refresh when older than REVISION_CACHE_MAX_AGE; always; never (offline)
+REVISION_REFRESH = os.environ.get("REVISION_REFRESH", "auto")
+# Optional local JSON with {"revisions": [...], "positions": {version: position}}
+REVISION_MIRROR = os.environ.get("REVISION_MIRROR")
+# Pull-through cache in front of the snapshot bucket (snapshot-mirror.py), if deployed
+SNAPSHOT_HOST = os.environ.get("SNAPSHOT_MIRROR", "https://www.googleapis.com").rstrip("/")
+SNAPSHOT_LISTING_URL = f"{SNAPSHOT_HOST}/storage/v1/b/chromium-browser-snapshots/o"
+RELEASES_URL = "https://chromiumdash.appspot.com/fetch_releases"
+VERSION_URL = "https://chromiumdash.appspot.com/fetch_version"
+
+# Structured progress: one JSON event per line ("-" for stdout), plus a summary
+# rewritten after every version so the API and dashboards can show sync state
+PROGRESS_LOG = os.environ.get("PROGRESS_LOG", os.path.join(BASE_PATH, ".progress.jsonl"))
+SUMMARY_FILE = os.environ.get("SUMMARY_FILE", os.path.join(BASE_PATH, ".summary.json"))
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", "10"))
+# Per-entry retries for ranged downloads before falling back to the full zip
+ENTRY_RETRIES = int(os.environ.get("ENTRY_RETRIES", "2"))
+MB = 1024 * 1024
+
+# Reconcile mode: what is published on the volume, and what should be
+CATALOG_FILE = os.path.join(BASE_PATH, ".catalog.json")
+# JSON list of versions (e.g. a mounted ConfigMap); CHROMIUM_VERSIONS when unset
+DESIRED_VERSIONS_FILE = os.environ.get("CHROMIUM_VERSIONS_FILE")
+# Unwanted versions are kept until no session pod has used them for this long, so
+# pods still running or hydrating from their tree are not broken
+GC_GRACE_SECONDS = int(os.environ.get("GC_GRACE_SECONDS", str(24 * 3600)))
+# Session pods are listed through the in-cluster API with the Job's service account
+KUBE_API_URL = os.environ.get("KUBE_API_URL", "https://kubernetes.default.svc")
+SESSION_NAMESPACE = os.environ.get("SESSION_NAMESPACE", "default")
+SERVICE_ACCOUNT_DIR = "/var/run/secrets/kubernetes.io/serviceaccount"
+
+
+class SyncReporter:
+    """Progress events and the per-version summary for one downloader run.
+
+    Events are JSON objects with ts, event and version plus event fields:
+    version_start, stage (name, seconds), progress (bytes, total_bytes,
+    bytes_per_second), retry (stage, attempt, error) and version_done (the
+    version's summary entry). Sizes come from the zip directory and image index,
+    so nothing walks the version trees afterwards.
+    """
+
+    def __init__(self, log_path=PROGRESS_LOG, summary_path=SUMMARY_FILE):
+        self.summary_path = summary_path
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.versions = {}
+        self.extra = {}
+        self.clocks = {}
+        if log_path == "-":
+            self.log = None
+        else:
+            os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+            # One log per run: it describes the sync in progress, not history
+            self.log = open(log_path, "w")
+
+    def emit(self, event, version=None, **fields):
+        line = json.dumps({"ts": round(time.time(), 3), "event": event, "version": version, **fields})
+        with self.lock:
+            if self.log:
+                self.log.write(line + "\n")
+                self.log.flush()
+            else:
+                print(line, flush=True)
+
+    def start(self, version):
+        with self.lock:
+            self.versions[version] = {
+                "status": "running",
+                "revision": None,
+                "source": None,
+                "downloaded_bytes": 0,
+                "reused_bytes": 0,
+                "skipped_bytes": 0,
+                "unpacked_bytes": 0,
+                "image_bytes": 0,
+                "seconds": 0.0,
+                "bytes_per_second": 0,
+                "stages": {},
+                "retries": 0,
+                "error": None
+            }
+            self.clocks[version] = {"started": time.monotonic(), "last_progress": 0.0}
+        self.emit("version_start", version)
+
+    def update(self, version, **fields):
+        with self.lock:
+            self.versions[version].update(fields)
+
+    @contextmanager
+    def stage(self, version, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            seconds = round(time.monotonic() - started, 3)
+            with self.lock:
+                self.versions[version]["stages"][name] = seconds
+            self.emit("stage", version, stage=name, seconds=seconds)
+
+    def progress(self, version, done, total, **fields):
+        """Throttled to one event (and one log line) per PROGRESS_INTERVAL per version"""
+        now = time.monotonic()
+        with self.lock:
+            clock = self.clocks[version]
+            if (not total or done < total) and now - clock["last_progress"] < PROGRESS_INTERVAL:
+                return
+            clock["last_progress"] = now
+            elapsed = now - clock["started"]
+        rate = int(done / elapsed) if elapsed > 0 else 0
+        self.emit("progress", version, bytes=done, total_bytes=total, bytes_per_second=rate, **fields)
+        percent = f"{done * 100 // total}% " if total else ""
+        print(f"  {percent}({done // MB}MB / {total // MB}MB, {rate / MB:.1f}MB/s)")
+
+    def retry(self, version, stage, attempt, error):
+        with self.lock:
+            self.versions[version]["retries"] += 1
+        self.emit("retry", version, stage=stage, attempt=attempt, error=str(error))
+
+    def finish(self, version, status, error=None):
+        with self.lock:
+            entry = self.versions[version]
+            seconds = time.monotonic() - self.clocks[version]["started"]
+            entry.update(status=status, error=error, seconds=round(seconds, 3))
+            if entry["downloaded_bytes"] and seconds > 0:
+                entry["bytes_per_second"] = int(entry["downloaded_bytes"] / seconds)
+        self.emit("version_done", version, **entry)
+        self.write_summary()
+
+    def summary(self, finished=False):
+        with self.lock:
+            versions = {v: dict(e) for v, e in self.versions.items()}
+        statuses = [e["status"] for e in versions.values()]
+        return {
+            "started_at": self.started_at,
+            "updated_at": time.time(),
+            "finished_at": time.time() if finished else None,
+            **self.extra,
+            "versions": versions,
+            "totals": {
+                "versions": len(versions),
+                "ok": statuses.count("ok"),
+                "skipped": statuses.count("skipped"),
+                "failed": statuses.count("failed"),
+                "downloaded_bytes": sum(e["downloaded_bytes"] for e in versions.values()),
+                "reused_bytes": sum(e["reused_bytes"] for e in versions.values()),
+                "unpacked_bytes": sum(e["unpacked_bytes"] for e in versions.values()),
+                "image_bytes": sum(e["image_bytes"] for e in versions.values()),
+                "retries": sum(e["retries"] for e in versions.values())
+            }
+        }
+
+    def write_summary(self, finished=False):
+        summary = self.summary(finished)
+        os.makedirs(os.path.dirname(self.summary_path) or ".", exist_ok=True)
+        tmp = f"{self.summary_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(summary, f, indent=2)
+        os.replace(tmp, self.summary_path)
+        return summary
+
+
+_reporter = None
+
+
+def sync_reporter():
+    global _reporter
+    if _reporter is None:
+        _reporter = SyncReporter()
+    return _reporter
+
+
+class RevisionResolver:
+    """Maps a Chromium version to the snapshot revision built closest to it.
+
+    A version's main-branch position comes from Chromium Dash; the snapshot bucket
+    only has builds for some positions, so the nearest one at or below it is found
+    by binary search over the sorted listing.
+    """
+
+    def __init__(self, cache_path=REVISION_CACHE, refresh=REVISION_REFRESH):
+        self.cache_path = cache_path
+        self.refresh = refresh
+        self.revisions = []
+        self.positions = {}
+        self.fetched_at = 0
+        self._load()
+
+    def _load(self):
+        sources = [self.cache_path] + ([REVISION_MIRROR] if REVISION_MIRROR else [])
+        for path in sources:
+            try:
+                with open(path) as f:
+                    table = json.load(f)
+            except (OSError, ValueError):
+                continue
+            self.revisions = sorted(int(r) for r in table.get("revisions", []))
+            self.positions = {v: int(p) for v, p in table.get("positions", {}).items()}
+            self.fetched_at = table.get("fetched_at", 0) if path == self.cache_path else time.time()
+            return
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp = f"{self.cache_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({
+                "fetched_at": self.fetched_at,
+                "revisions": self.revisions,
+                "positions": self.positions
+            }, f)
+        os.replace(tmp, self.cache_path)
+
+    def stale(self):
+        if self.refresh == "never":
+            return False
+        if self.refresh == "always":
+            return True
+        return not self.revisions or time.time() - self.fetched_at > REVISION_CACHE_MAX_AGE
+
+    def refresh_table(self):
+        print("Refreshing snapshot revision listing...")
+        revisions = []
+        params = {"delimiter": "/", "prefix": "Linux_x64/", "fields": "prefixes,nextPageToken"}
+        while True:
+            response = requests.get(SNAPSHOT_LISTING_URL, params=params, timeout=30)
+            response.raise_for_status()
+            page = response.json()
+            for prefix in page.get("prefixes", []):
+                revision = prefix.rstrip("/").rsplit("/", 1)[-1]
+                if revision.isdigit():
+                    revisions.append(int(revision))
+            if "nextPageToken" not in page:
+                break
+            params["pageToken"] = page["nextPageToken"]
+
+        response = requests.get(
+            RELEASES_URL, params={"channel": "Stable", "platform": "Linux", "num": 1000}, timeout=30
+        )
+        response.raise_for_status()
+        for release in response.json():
+            position = release.get("chromium_main_branch_position")
+            if position:
+                self.positions[release["version"]] = int(position)
+
+        self.revisions = sorted(set(revisions))
+        self.fetched_at = time.time()
+        self._save()
+        print(f"✓ {len(self.revisions)} snapshot revisions, {len(self.positions)} version positions cached")
+
+    def position(self, version):
+        if version not in self.positions and self.refresh != "never":
+            response = requests.get(VERSION_URL, params={"version": version}, timeout=30)
+            if response.ok and response.json().get("chromium_main_branch_position"):
+                self.positions[version] = int(response.json()["chromium_main_branch_position"])
+                self._save()
+        return self.positions.get(version)
+
+    def nearest(self, position):
+        """Largest snapshot revision <= position, else the smallest one above it"""
+        i = bisect.bisect_right(self.revisions, position)
+        if i:
+            return self.revisions[i - 1]
+        return self.revisions[0] if self.revisions else None
+
+    def resolve(self, version):
+        if self.stale():
+            try:
+                self.refresh_table()
+            except (requests.RequestException, ValueError) as e:
+                print(f"⚠ Revision listing refresh failed: {e}")
+        try:
+            position = self.position(version)
+        except (requests.RequestException, ValueError) as e:
+            print(f"⚠ Position lookup for {version} failed: {e}")
+            position = None
+        if position is not None and self.revisions:
+            return str(self.nearest(position))
+        return VERSION_TO_REVISION.get(version)
+
+
+_resolver = None
+
+
+def resolve_revision(version):
+    global _resolver
+    if _resolver is None:
+        _resolver = RevisionResolver()
+    return _resolver.resolve(version)
+
+
+def snapshot_url(revision):
+    return f"{SNAPSHOT_HOST}/download/storage/v1/b/chromium-browser-snapshots/o/Linux_x64%2F{revision}%2Fchrome-linux.zip?alt=media"
+
+
+class RemoteZipError(Exception):
+    pass
+
+
+class RemoteZip:
+    """Read a zip over HTTP range requests: the central directory first, entries on demand"""
+
+    EOCD = struct.Struct("<4s4H2LH")
+    ZIP64_LOCATOR = struct.Struct("<4sLQL")
+    ZIP64_EOCD = struct.Struct("<4sQ2H2L4Q")
+    CENTRAL = struct.Struct("<4s6H3L5H2L")
+    LOCAL = struct.Struct("<4s5H3L2H")
+    TAIL_BYTES = 128 * 1024
+    # Local extra fields may be longer than the central ones; over-fetch by this much
+    LOCAL_EXTRA_SLACK = 1024
+    BLOCK = 1024 * 1024
+
+    def __init__(self, url, session=None):
+        self.url = url
+        self.session = session or requests.Session()
+        self.bytes_fetched = 0
+        self.lock = threading.Lock()
+        self.entries = self._read_central_directory()
+
+    def _get(self, start=None, end=None, suffix=None, stream=False):
+        byte_range = f"bytes=-{suffix}" if suffix else f"bytes={start}-{end}"
+        response = self.session.get(self.url, headers={"Range": byte_range}, stream=stream, timeout=60)
+        response.raise_for_status()
+        if response.status_code != 206:
+            response.close()
+            raise RemoteZipError("Server ignored the Range header")
+        return response
+
+    def _count(self, n):
+        with self.lock:
+            self.bytes_fetched += n
+
+    def fetch(self, start, end):
+        """Bytes [start, end] inclusive"""
+        content = self._get(start, end).content
+        self._count(len(content))
+        return content
+
+    def _read_central_directory(self):
+        tail_response = self._get(suffix=self.TAIL_BYTES)
+        tail = tail_response.content
+        self._count(len(tail))
+        self.size = int(tail_response.headers["Content-Range"].rsplit("/", 1)[1])
+        tail_start = self.size - len(tail)
+
+        pos = tail.rfind(b"PK\x05\x06")
+        if pos < 0:
+            raise RemoteZipError("End of central directory not found")
+        _, _, _, _, count, cd_size, cd_offset, _ = self.EOCD.unpack_from(tail, pos)
+
+        locator = pos - self.ZIP64_LOCATOR.size
+        if locator >= 0 and tail[locator:locator + 4] == b"PK\x06\x07":
+            _, _, eocd64_offset, _ = self.ZIP64_LOCATOR.unpack_from(tail, locator)
+            eocd64 = self.ZIP64_EOCD.unpack_from(tail, eocd64_offset - tail_start)
+            count, cd_size, cd_offset = eocd64[7], eocd64[8], eocd64[9]
+
+        if cd_offset >= tail_start:
+            directory = tail[cd_offset - tail_start:cd_offset - tail_start + cd_size]
+        else:
+            directory = self.fetch(cd_offset, cd_offset + cd_size - 1)
+
+        entries = {}
+        offset = 0
+        for _ in range(count):
+            fields = self.CENTRAL.unpack_from(directory, offset)
+            name_len, extra_len, comment_len = fields[10], fields[11], fields[12]
+            start = offset + self.CENTRAL.size
+            name = directory[start:start + name_len].decode("utf-8")
+            extra = directory[start + name_len:start + name_len + extra_len]
+            entry = {
+                "name": name,
+                "method": fields[4],
+                "crc": fields[7],
+                "compressed_size": fields[8],
+                "size": fields[9],
+                "mode": fields[15] >> 16,
+                "header_offset": fields[16]
+            }
+            self._apply_zip64_extra(entry, extra)
+            entries[name] = entry
+            offset = start + name_len + extra_len + comment_len
+        return entries
+
+    @staticmethod
+    def _apply_zip64_extra(entry, extra):
+        pos = 0
+        while pos + 4 <= len(extra):
+            tag, length = struct.unpack_from("<2H", extra, pos)
+            if tag == 0x0001:
+                values = iter(struct.unpack_from(f"<{length // 8}Q", extra, pos + 4))
+                for key in ("size", "compressed_size", "header_offset"):
+                    if entry[key] == 0xFFFFFFFF:
+                        entry[key] = next(values)
+                return
+            pos += 4 + length
+
+    @staticmethod
+    def _read_exact(raw, n):
+        data = b""
+        while len(data) < n:
+            block = raw.read(n - len(data))
+            if not block:
+                raise RemoteZipError("Short read in local header")
+            data += block
+        return data
+
+    def extract(self, entry, dst):
+        """Stream one entry to dst, decompressing and CRC-checking as it arrives"""
+        if entry["method"] not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise RemoteZipError(f"Unsupported compression method {entry['method']} for {entry['name']}")
+        start = entry["header_offset"]
+        end = min(self.size, start + self.LOCAL.size + len(entry["name"].encode())
+                  + self.LOCAL_EXTRA_SLACK + entry["compressed_size"]) - 1
+        response = self._get(start, end, stream=True)
+        raw = response.raw
+        try:
+            header = self.LOCAL.unpack(self._read_exact(raw, self.LOCAL.size))
+            self._read_exact(raw, header[9] + header[10])
+            inflater = zlib.decompressobj(-15) if entry["method"] == zipfile.ZIP_DEFLATED else None
+            crc = 0
+            remaining = entry["compressed_size"]
+            with open(f"{dst}.part", "wb") as f:
+                while remaining:
+                    block = raw.read(min(self.BLOCK, remaining))
+                    if not block:
+                        raise RemoteZipError(f"Short read for {entry['name']}")
+                    remaining -= len(block)
+                    data = inflater.decompress(block) if inflater else block
+                    crc = zlib.crc32(data, crc)
+                    f.write(data)
+                if inflater:
+                    tail = inflater.flush()
+                    crc = zlib.crc32(tail, crc)
+                    f.write(tail)
+            # Drain the slack so the connection goes back to the pool
+            raw.read()
+        finally:
+            response.close()
+        self._count(end - start + 1)
+        if crc != entry["crc"]:
+            os.remove(f"{dst}.part")
+            raise RemoteZipError(f"CRC mismatch for {entry['name']}")
+        os.replace(f"{dst}.part", dst)
+
+
+def file_crc(path):
+    crc = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+
+def selected(rel):
+    """Apply CHROMIUM_INCLUDE / CHROMIUM_EXCLUDE; the chrome binary is always kept"""
+    if rel == "chrome":
+        return True
+    if INCLUDE_PATTERNS and not any(fnmatch.fnmatch(rel, p) for p in INCLUDE_PATTERNS):
+        return False
+    return not any(fnmatch.fnmatch(rel, p) for p in EXCLUDE_PATTERNS)
+
+
+def closest_base_version(version):
+    """Existing version tree whose revision is nearest to the one being added"""
+    target = int(resolve_revision(version))
+    candidates = {}
+    for v in os.listdir(BASE_PATH):
+        if v != version and not v.startswith(".") and os.path.isfile(os.path.join(BASE_PATH, v, "chrome")):
+            revision = resolve_revision(v)
+            if revision:
+                candidates[v] = int(revision)
+    if not candidates:
+        return None
+    return min(candidates, key=lambda v: abs(candidates[v] - target))
+
+
+def load_crcs(version):
+    """path -> (size, crc) recorded in a version's image index; crc may be None"""
+    index = os.path.join(IMAGES_DIR, f"{version}.index.json")
+    try:
+        with open(index) as f:
+            return {e["path"]: (e["size"], e.get("crc")) for e in json.load(f)["entries"]}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def download_ranged(version, revision, version_path):
+    """Fetch the selected zip entries in parallel byte ranges.
+
+    With DELTA_ENABLED, entries whose size and CRC match the closest existing version
+    are copied from that tree instead. Returns the path -> crc map of the new tree.
+    """
+    remote = RemoteZip(snapshot_url(revision), shared_session())
+    base = closest_base_version(version) if DELTA_ENABLED else None
+    base_path = os.path.join(BASE_PATH, base) if base else None
+    base_crcs = load_crcs(base) if base else {}
+    if base:
+        print(f"Building {version} as a delta against {base}...")
+
+    plan = []
+    skipped = 0
+    for name, entry in remote.entries.items():
+        rel = name[len(ZIP_PREFIX):] if name.startswith(ZIP_PREFIX) else name
+        if not rel or name.endswith("/"):
+            continue
+        if not selected(rel):
+            skipped += entry["size"]
+            continue
+        plan.append((rel, entry))
+
+    def unchanged(rel, entry):
+        src = os.path.join(base_path, rel)
+        if not os.path.isfile(src) or os.path.getsize(src) != entry["size"]:
+            return False
+        crc = base_crcs.get(rel, (None, None))[1]
+        return (crc if crc is not None else file_crc(src)) == entry["crc"]
+
+    reporter = sync_reporter()
+    total = sum(entry["compressed_size"] for _, entry in plan)
+    done = [0]
+    done_lock = threading.Lock()
+
+    def extract_with_retries(entry, dst):
+        for attempt in range(1, ENTRY_RETRIES + 2):
+            try:
+                return remote.extract(entry, dst)
+            # Reads from response.raw surface urllib3 errors, not requests ones
+            except (requests.RequestException, urllib3.exceptions.HTTPError, RemoteZipError, zlib.error) as e:
+                if attempt > ENTRY_RETRIES:
+                    raise
+                reporter.retry(version, "fetch", attempt, f"{entry['name']}: {e}")
+
+    def materialize(item):
+        rel, entry = item
+        dst = os.path.join(version_path, rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if base_path and unchanged(rel, entry):
+            shutil.copyfile(os.path.join(base_path, rel), dst)
+            reused = True
+        else:
+            extract_with_retries(entry, dst)
+            reused = False
+        if entry["mode"]:
+            os.chmod(dst, entry["mode"] & 0o7777)
+        with done_lock:
+            done[0] += entry["compressed_size"]
+            progress = done[0]
+        reporter.progress(version, progress, total, transferred_bytes=remote.bytes_fetched)
+        return reused
+
+    # Largest first so the big binary does not start last and become the tail
+    plan.sort(key=lambda item: item[1]["compressed_size"], reverse=True)
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+        reused_flags = list(pool.map(materialize, plan))
+
+    reused = sum(entry["size"] for (rel, entry), r in zip(plan, reused_flags) if r)
+    fetched = sum(entry["size"] for (rel, entry), r in zip(plan, reused_flags) if not r)
+    reporter.update(
+        version,
+        source="delta" if base else "ranged",
+        downloaded_bytes=remote.bytes_fetched,
+        reused_bytes=reused,
+        skipped_bytes=skipped,
+        unpacked_bytes=reused + fetched
+    )
+    print(f"✓ {len(plan)} entries ready: fetched {fetched // MB}MB"
+          + (f", reused {reused // MB}MB from {base}" if base else "")
+          + (f", skipped {skipped // MB}MB by pattern" if skipped else "")
+          + f" ({remote.bytes_fetched // MB}MB transferred of a {remote.size // MB}MB zip)")
+    return {rel: entry["crc"] for rel, entry in plan}
+
+
+def http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(DOWNLOAD_WORKERS, SEGMENT_WORKERS))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_session = None
+
+
+def shared_session():
+    """One connection pool for the whole run, so versions reuse kept-alive connections"""
+    global _session
+    if _session is None:
+        _session = http_session()
+    return _session
+
+
+def fetch_to_file(version, url, path):
+    """Download url to path in parallel range segments; returns the byte count.
+
+    The file is sized up front, and each worker reads into one reusable buffer with
+    readinto and writes it at its offset with pwrite, so no per-chunk bytes objects
+    are created. A failed segment resumes from the last byte it wrote. Servers
+    without range support get a single stream through the same loop.
+    """
+    session = shared_session()
+    reporter = sync_reporter()
+    identity = {"Accept-Encoding": "identity"}
+    with session.get(url, headers={**identity, "Range": "bytes=0-0"}, stream=True, timeout=60) as probe:
+        probe.raise_for_status()
+        ranged = probe.status_code == 206
+        if ranged:
+            size = int(probe.headers["Content-Range"].rsplit("/", 1)[1])
+        else:
+            size = int(probe.headers.get("Content-Length", 0))
+
+    count = min(SEGMENT_WORKERS, max(1, size // MIN_SEGMENT_BYTES)) if ranged else 1
+    step = -(-size // count) if size else 0
+    if ranged and size:
+        segments = [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+    else:
+        segments = [(0, size - 1)]
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    done = [0]
+    done_lock = threading.Lock()
+
+    def stream(position, end, buffer):
+        """Write from position[0] on, advancing it as each chunk lands on disk"""
+        view = memoryview(buffer)
+        headers = {**identity, "Range": f"bytes={position[0]}-{end}"} if ranged else identity
+        with session.get(url, headers=headers, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            raw = response.raw
+            while True:
+                n = raw.readinto(buffer)
+                if not n:
+                    break
+                written = 0
+                while written < n:
+                    written += os.pwrite(fd, view[written:n], position[0] + written)
+                position[0] += n
+                with done_lock:
+                    done[0] += n
+                    progress = done[0]
+                reporter.progress(version, progress, size)
+
+    def segment(bounds):
+        start, end = bounds
+        # Outside stream, so a retry picks up where the failed attempt stopped
+        position = [start]
+        buffer = bytearray(READ_BUFFER_BYTES)
+        for attempt in range(1, ENTRY_RETRIES + 2):
+            try:
+                if size and position[0] > end:
+                    return
+                stream(position, end, buffer)
+                if size and position[0] != end + 1:
+                    raise requests.RequestException(f"short read at {position[0]} of segment ending {end}")
+                return
+            except (requests.RequestException, urllib3.exceptions.HTTPError, OSError) as e:
+                if attempt > ENTRY_RETRIES or not ranged:
+                    raise
+                reporter.retry(version, "segment", attempt, e)
+
+    try:
+        if size:
+            # Not posix_fallocate: NFS/EFS has no fallocate, and glibc then emulates
+            # it by writing every block, doubling the bytes sent to the volume
+            os.ftruncate(fd, size)
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            list(pool.map(segment, segments))
+    finally:
+        os.close(fd)
+    return done[0]
+
+
+def image_order(version_path):
+    """Member order for the image and the length of its hot prefix.
+
+    The hot prefix is the profiled startup set from .prefetch.json when the version
+    has one, otherwise the binary and the top-level startup files.
+    """
+    files = []
+    for root, dirs, names in os.walk(version_path):
+        for name in names:
+            files.append(os.path.relpath(os.path.join(root, name), version_path))
+    present = set(files)
+
+    hot = []
+    try:
+        with open(os.path.join(version_path, PREFETCH_MANIFEST)) as f:
+            manifest = json.load(f)
+        ordered = [e["path"] for e in manifest.get("files", []) if e["path"] in present]
+        hot = ordered[:manifest.get("hot_count", len(ordered))]
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠ Ignoring unreadable {PREFETCH_MANIFEST} for {version_path}: {e}")
+    if not hot:
+        hot = sorted(rel for rel in files if rel == "chrome" or (
+            "/" not in rel and rel.endswith((".so", ".pak", ".bin", ".dat"))))
+    elif "chrome" in present and "chrome" not in hot:
+        hot.insert(0, "chrome")
+
+    hot_set = set(hot)
+    return hot + sorted(rel for rel in files if rel not in hot_set), len(hot)
+
+
+class FrameWriter:
+    """tarfile sink that compresses each part of the stream into its own zstd frame.
+
+    The frames are appended to one file, so decompressing the whole file still gives a
+    single tar, while the hot frame alone can be read and unpacked by itself.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.position = 0
+        self.frames = []
+        self.process = None
+
+    def start_frame(self):
+        self.end_frame()
+        self.offset = os.fstat(self.out.fileno()).st_size
+        self.process = subprocess.Popen(IMAGE_COMPRESSION.split() + ["-q", "-c"],
+                                        stdin=subprocess.PIPE, stdout=self.out)
+
+    def end_frame(self):
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise OSError(f"{IMAGE_COMPRESSION} exited with {self.process.returncode}")
+        self.process = None
+        length = os.fstat(self.out.fileno()).st_size - self.offset
+        self.frames.append({"offset": self.offset, "length": length})
+
+    def write(self, data):
+        self.process.stdin.write(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+
+def publish_image(version, version_path, crcs=None):
+    """Pack a version tree into IMAGES_DIR/<version>.tar.zst plus a JSON index.
+
+    The tar is compressed as two zstd frames, hot members then the rest, and the index
+    records their offsets so a pod can unpack the hot set without reading the rest.
+    """
+    crcs = crcs or {}
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+    image = os.path.join(IMAGES_DIR, f"{version}.tar.zst")
+    index = os.path.join(IMAGES_DIR, f"{version}.index.json")
+    members, hot_count = image_order(version_path)
+
+    try:
+        with open(f"{image}.tmp", "wb") as out:
+            writer = FrameWriter(out)
+            try:
+                writer.start_frame()
+                with tarfile.open(fileobj=writer, mode="w", copybufsize=READ_BUFFER_BYTES) as tar:
+                    for i, rel in enumerate(members):
+                        # Frames split on member boundaries, so each one is a run of whole entries
+                        if i == hot_count:
+                            writer.start_frame()
+                        tar.add(os.path.join(version_path, rel), arcname=rel, recursive=False)
+                    if hot_count == len(members):
+                        writer.start_frame()
+                writer.end_frame()
+            finally:
+                if writer.process is not None:
+                    writer.process.kill()
+                    writer.process.wait()
+    except (OSError, tarfile.TarError) as e:
+        print(f"⚠ Image packing failed: {e}")
+        if os.path.exists(f"{image}.tmp"):
+            os.remove(f"{image}.tmp")
+        return None
+
+    # CRCs from the source zip let later delta builds skip re-reading this tree
+    entries = [
+        {"path": rel, "size": os.path.getsize(os.path.join(version_path, rel)), "crc": crcs.get(rel)}
+        for rel in members
+    ]
+    hot_frame, cold_frame = writer.frames
+    hot_frame["files"] = hot_count
+    cold_frame["files"] = len(members) - hot_count
+    stats = {
+        "version": version,
+        "files": len(entries),
+        "unpacked_bytes": sum(e["size"] for e in entries),
+        "image_bytes": os.path.getsize(f"{image}.tmp")
+    }
+    with open(f"{index}.tmp", "w") as f:
+        json.dump({**stats, "frames": [hot_frame, cold_frame], "entries": entries}, f)
+    # Index last: a pod only trusts an image whose index exists
+    os.replace(f"{image}.tmp", image)
+    os.replace(f"{index}.tmp", index)
+    print(f"✓ Published image {image} ({stats['image_bytes'] // MB}MB, "
+          f"{hot_count} hot files in {hot_frame['length'] // MB}MB)")
+    return stats
+
+
+def image_stats(version):
+    """files / unpacked_bytes / image_bytes from a published index, or None"""
+    index = os.path.join(IMAGES_DIR, f"{version}.index.json")
+    try:
+        with open(index) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {k: data.get(k, 0) for k in ("files", "unpacked_bytes", "image_bytes")}
+
+
+def remove_image(version):
+    for suffix in (".index.json", ".tar.zst"):
+        path = os.path.join(IMAGES_DIR, f"{version}{suffix}")
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@contextmanager
+def catalog_lock():
+    """Serialize catalog updates between the sync and concurrent on-demand Jobs"""
+    os.makedirs(BASE_PATH, exist_ok=True)
+    with open(f"{CATALOG_FILE}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_catalog():
+    """version -> entry; bootstrapped from the image indexes when there is no catalog yet"""
+    try:
+        with open(CATALOG_FILE) as f:
+            return json.load(f)["versions"]
+    except (OSError, ValueError, KeyError):
+        pass
+    catalog = {}
+    names = os.listdir(IMAGES_DIR) if os.path.isdir(IMAGES_DIR) else []
+    for name in names:
+        if name.endswith(".index.json"):
+            version = name[:-len(".index.json")]
+            catalog[version] = {"published_at": None, "unwanted_since": None, **(image_stats(version) or {})}
+    return catalog
+
+
+def save_catalog(catalog):
+    tmp = f"{CATALOG_FILE}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"updated_at": time.time(), "versions": catalog}, f, indent=2)
+    os.replace(tmp, CATALOG_FILE)
+
+
+def record_version(version, revision=None):
+    with catalog_lock():
+        catalog = load_catalog()
+        entry = catalog.get(version, {"published_at": time.time()})
+        entry.update(image_stats(version) or {})
+        entry["unwanted_since"] = None
+        if revision:
+            entry["revision"] = revision
+        catalog[version] = entry
+        save_catalog(catalog)
+
+
+def desired_versions():
+    if not DESIRED_VERSIONS_FILE:
+        return list(CHROMIUM_VERSIONS)
+    with open(DESIRED_VERSIONS_FILE) as f:
+        return [v for v in json.load(f) if v]
+
+
+def versions_in_use():
+    """Chromium versions of live session pods, or None if they cannot be listed"""
+    url = f"{KUBE_API_URL}/api/v1/namespaces/{SESSION_NAMESPACE}/pods"
+    params = {"labelSelector": "app=chromium-runner", "limit": 500}
+    in_use = set()
+    try:
+        with open(os.path.join(SERVICE_ACCOUNT_DIR, "token")) as f:
+            headers = {"Authorization": f"Bearer {f.read().strip()}"}
+        while True:
+            response = requests.get(url, params=params, headers=headers, timeout=30,
+                                    verify=os.path.join(SERVICE_ACCOUNT_DIR, "ca.crt"))
+            response.raise_for_status()
+            pods = response.json()
+            for pod in pods.get("items", []):
+                if pod.get("status", {}).get("phase") in ("Succeeded", "Failed"):
+                    continue
+                version = (pod["metadata"].get("annotations") or {}).get("chromium-version")
+                if version:
+                    in_use.add(version)
+            params["continue"] = pods.get("metadata", {}).get("continue")
+            if not params["continue"]:
+                return in_use
+    except (OSError, ValueError, requests.RequestException) as e:
+        print(f"⚠ Cannot list session pods ({e}); not deleting any versions this run")
+        return None
+
+
+def delete_version(version):
+    shutil.rmtree(os.path.join(BASE_PATH, version), ignore_errors=True)
+    remove_image(version)
+    summary = os.path.join(BASE_PATH, f".summary-{version}.json")
+    if os.path.exists(summary):
+        os.remove(summary)
+
+
+def download_full(version, revision, version_path):
+    """Stream the whole snapshot zip and extract it; returns path -> crc, or None"""
+    # Download URL for Linux x64
+    download_url = snapshot_url(revision)
+    zip_file = f"{version_path}/chrome-linux.zip"
+    
+    print(f"Downloading from revision {revision}...")
+    print(f"URL: {download_url[:80]}...")
+    
+    # Download with progress
+    reporter = sync_reporter()
+    downloaded = fetch_to_file(version, download_url, zip_file)
+    
+    print(f"✓ Download complete ({downloaded // MB}MB)")
+    
+    # Extract
+    print("Extracting...")
+    result = subprocess.run(
+        ["unzip", "-q", zip_file, "-d", version_path],
+        capture_output=True,
+        text=True
+    )
+    
+    if result.returncode != 0:
+        print(f"✗ Extraction failed: {result.stderr}")
+        return None
+
+    with zipfile.ZipFile(zip_file) as archive:
+        members = [
+            info for info in archive.infolist()
+            if info.filename.startswith(ZIP_PREFIX) and not info.is_dir()
+        ]
+    crcs = {info.filename[len(ZIP_PREFIX):]: info.CRC for info in members}
+    sizes = {info.filename[len(ZIP_PREFIX):]: info.file_size for info in members}
+    
+    # Move files from chrome-linux subfolder to version folder
+    chrome_linux_path = os.path.join(version_path, "chrome-linux")
+    if os.path.exists(chrome_linux_path):
+        for item in os.listdir(chrome_linux_path):
+            src = os.path.join(chrome_linux_path, item)
+            dst = os.path.join(version_path, item)
+            subprocess.run(["mv", src, dst], check=True)
+        os.rmdir(chrome_linux_path)
+    
+    # Cleanup zip
+    os.remove(zip_file)
+
+    for rel in list(crcs):
+        if not selected(rel):
+            os.remove(os.path.join(version_path, rel))
+            del crcs[rel]
+
+    reporter.update(
+        version,
+        source="full",
+        downloaded_bytes=downloaded,
+        skipped_bytes=sum(size for rel, size in sizes.items() if rel not in crcs),
+        unpacked_bytes=sum(sizes[rel] for rel in crcs)
+    )
+    return crcs
+
+
 def download_chromium(version):
-    """Download a specific Chromium version"""
+    """Download a specific Chromium version; failures are reported, never raised"""
+    reporter = sync_reporter()
+    reporter.start(version)
+    try:
+        return sync_version(version, reporter)
+    except Exception as e:
+        # One bad version must not end the run before the summary is written
+        print(f"✗ Failed to sync Chromium {version}: {e}")
+        reporter.finish(version, "failed", error=str(e))
+        return False
+
+
+def sync_version(version, reporter):
     version_path = os.path.join(BASE_PATH, version)
-    
     if os.path.exists(version_path) and os.listdir(version_path):
         print(f"✓ Version {version} already exists, skipping...")
+        stats = image_stats(version)
+        if stats is None:
+            with reporter.stage(version, "publish"):
+                stats = publish_image(version, version_path)
+        reporter.update(version, source="existing", **{
+            k: v for k, v in (stats or {}).items() if k in ("unpacked_bytes", "image_bytes")
+        })
+        if stats:
+            record_version(version)
+        reporter.finish(version, "skipped")
         return True
     
     print(f"\n{'='*60}")
@@ -70,59 +1101,31 @@ def download_chromium(version):
     try:
         os.makedirs(version_path, exist_ok=True)
         
-        revision = VERSION_TO_REVISION.get(version)
+        with reporter.stage(version, "resolve"):
+            revision = resolve_revision(version)
         if not revision:
             print(f"✗ No revision mapping for version {version}")
+            reporter.finish(version, "failed", error="no revision mapping")
             return False
+        reporter.update(version, revision=revision)
+        print(f"Resolved {version} to snapshot revision {revision}")
         
-        # Download URL for Linux x64
-        download_url = f"https://www.googleapis.com/download/storage/v1/b/chromium-browser-snapshots/o/Linux_x64%2F{revision}%2Fchrome-linux.zip?alt=media"
-        zip_file = f"{version_path}/chrome-linux.zip"
-        
-        print(f"Downloading from revision {revision}...")
-        print(f"URL: {download_url[:80]}...")
-        
-        # Download with progress
-        response = requests.get(download_url, stream=True)
-        response.raise_for_status()
-        
-        total_size = int(response.headers.get('content-length', 0))
-        block_size = 1024 * 1024  # 1MB
-        downloaded = 0
-        
-        with open(zip_file, 'wb') as f:
-            for data in response.iter_content(block_size):
-                downloaded += len(data)
-                f.write(data)
-                if total_size > 0:
-                    percent = int((downloaded / total_size) * 100)
-                    print(f"\rProgress: {percent}% ({downloaded // (1024*1024)}MB / {total_size // (1024*1024)}MB)", end='')
-        
-        print("\n✓ Download complete")
-        
-        # Extract
-        print("Extracting...")
-        result = subprocess.run(
-            ["unzip", "-q", zip_file, "-d", version_path],
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            print(f"✗ Extraction failed: {result.stderr}")
-            return False
-        
-        # Move files from chrome-linux subfolder to version folder
-        chrome_linux_path = os.path.join(version_path, "chrome-linux")
-        if os.path.exists(chrome_linux_path):
-            for item in os.listdir(chrome_linux_path):
-                src = os.path.join(chrome_linux_path, item)
-                dst = os.path.join(version_path, item)
-                subprocess.run(["mv", src, dst], check=True)
-            os.rmdir(chrome_linux_path)
-        
-        # Cleanup zip
-        os.remove(zip_file)
+        try:
+            with reporter.stage(version, "download"):
+                crcs = download_ranged(version, revision, version_path)
+        except (requests.RequestException, urllib3.exceptions.HTTPError, RemoteZipError, OSError, zlib.error) as e:
+            print(f"⚠ Ranged download failed ({e}), falling back to full download")
+            reporter.retry(version, "download", 1, f"ranged download failed, using full zip: {e}")
+            shutil.rmtree(version_path, ignore_errors=True)
+            os.makedirs(version_path, exist_ok=True)
+            crcs = None
+
+        if crcs is None:
+            with reporter.stage(version, "download_full"):
+                crcs = download_full(version, revision, version_path)
+            if crcs is None:
+                reporter.finish(version, "failed", error="extraction failed")
+                return False
         
         # Verify chrome binary exists
         chrome_binary = os.path.join(version_path, "chrome")
@@ -131,8 +1134,15 @@ def download_chromium(version):
             print(f"✓ Chrome binary found and made executable")
         else:
             print(f"⚠ Warning: Chrome binary not found at {chrome_binary}")
+
+        with reporter.stage(version, "publish"):
+            stats = publish_image(version, version_path, crcs)
+        if stats:
+            reporter.update(version, image_bytes=stats["image_bytes"])
+            record_version(version, revision)
         
         print(f"✓ Successfully downloaded Chromium {version}")
+        reporter.finish(version, "ok")
         return True
         
     except Exception as e:
@@ -140,9 +1150,107 @@ def download_chromium(version):
         # Cleanup failed download
         if os.path.exists(version_path):
             subprocess.run(["rm", "-rf", version_path])
+        remove_image(version)
+        reporter.finish(version, "failed", error=str(e))
         return False
 
+def download_single(version):
+    """Fetch one version, as the API's on-demand provisioning Job does"""
+    global _reporter
+    os.makedirs(BASE_PATH, exist_ok=True)
+    # Concurrent single-version Jobs must not clobber the full sync's progress files
+    _reporter = SyncReporter(log_path="-", summary_path=os.path.join(BASE_PATH, f".summary-{version}.json"))
+    ok = download_chromium(version)
+    _reporter.write_summary(finished=True)
+    return ok
+
+
+def reconcile():
+    """Bring the volume to the desired version set, touching only what differs.
+
+    Present means catalogued with an image index on the volume, so an unchanged set
+    costs one catalog read and a stat per version. Missing versions are downloaded;
+    versions no longer desired are marked, the mark is refreshed whenever a live
+    session pod still uses them, and they are deleted once GC_GRACE_SECONDS pass
+    without one. Versions fetched on demand by the API are not in the desired set,
+    so they age out the same way unless added to it.
+    """
+    started = time.monotonic()
+    os.makedirs(BASE_PATH, exist_ok=True)
+    desired = desired_versions()
+    with catalog_lock():
+        catalog = load_catalog()
+    present = {
+        v for v in catalog
+        if os.path.exists(os.path.join(IMAGES_DIR, f"{v}.index.json"))
+    }
+    missing = [v for v in desired if v not in present]
+    unwanted = sorted(present - set(desired))
+    print(f"Reconciling {len(desired)} desired versions: {len(present)} present, "
+          f"{len(missing)} missing, {len(unwanted)} unwanted")
+
+    failed = [v for v in missing if not download_chromium(v)]
+    in_use = versions_in_use() if unwanted else set()
+
+    now = time.time()
+    collected, marked = [], []
+    with catalog_lock():
+        catalog = load_catalog()
+        for version in list(catalog):
+            entry = catalog[version]
+            if not os.path.exists(os.path.join(IMAGES_DIR, f"{version}.index.json")):
+                # Image removed out of band; forget it
+                del catalog[version]
+                continue
+            if version in desired:
+                entry["unwanted_since"] = None
+                continue
+            if not entry.get("unwanted_since"):
+                entry["unwanted_since"] = now
+                marked.append(version)
+            elif in_use is None:
+                continue
+            elif version in in_use:
+                # The grace period runs from the last run that saw a session using it
+                entry["unwanted_since"] = now
+            elif now - entry["unwanted_since"] >= GC_GRACE_SECONDS:
+                delete_version(version)
+                del catalog[version]
+                collected.append(version)
+        save_catalog(catalog)
+
+    for version in marked:
+        print(f"⚠ {version} is no longer desired; deleting after {GC_GRACE_SECONDS}s grace")
+    for version in collected:
+        print(f"✓ Garbage-collected {version}")
+
+    reporter = sync_reporter()
+    reporter.extra["reconcile"] = {
+        "desired": len(desired),
+        "present": len(present),
+        "downloaded": [v for v in missing if v not in failed],
+        "failed": failed,
+        "marked_for_gc": marked,
+        "in_use": sorted(set(unwanted) & (in_use or set())),
+        "collected": collected,
+        "seconds": round(time.monotonic() - started, 3)
+    }
+    reporter.write_summary(finished=True)
+    print(f"Reconcile finished in {time.monotonic() - started:.1f}s")
+    return not failed
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Download Chromium snapshot builds into BASE_PATH")
+    parser.add_argument("--version", help="fetch only this version (default: every version in CHROMIUM_VERSIONS)")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="download only missing versions and garbage-collect unwanted ones")
+    args = parser.parse_args()
+    if args.version:
+        raise SystemExit(0 if download_single(args.version) else 1)
+    if args.reconcile:
+        raise SystemExit(0 if reconcile() else 1)
+
     print("\n" + "="*60)
     print("Chromium Multi-Version Downloader")
     print("="*60)
@@ -159,21 +1267,25 @@ def main():
         else:
             fail_count += 1
     
+    reporter = sync_reporter()
+    summary = reporter.write_summary(finished=True)
+    totals = summary["totals"]
+
     print("\n" + "="*60)
     print("Download Summary")
     print("="*60)
     print(f"Total versions: {len(CHROMIUM_VERSIONS)}")
     print(f"✓ Successful: {success_count}")
     print(f"✗ Failed: {fail_count}")
+    print(f"Downloaded {totals['downloaded_bytes'] // MB}MB, reused {totals['reused_bytes'] // MB}MB, "
+          f"{totals['retries']} retries")
     
-    if os.path.exists(BASE_PATH):
-        downloaded_versions = sorted(os.listdir(BASE_PATH))
-        print(f"\nAvailable versions in {BASE_PATH}:")
-        for v in downloaded_versions:
-            size = subprocess.check_output(
-                ["du", "-sh", os.path.join(BASE_PATH, v)]
-            ).decode().split()[0]
-            print(f"  - {v} ({size})")
+    # Sizes come from the run summary; walking every tree over EFS with du is slow
+    print(f"\nAvailable versions in {BASE_PATH}:")
+    for v, entry in sorted(summary["versions"].items()):
+        if entry["status"] != "failed":
+            print(f"  - {v} ({entry['unpacked_bytes'] // MB}MB, image {entry['image_bytes'] // MB}MB)")
+    print(f"Summary written to {reporter.summary_path}")
     
     print("="*60 + "\n")
 